@@ -9,13 +9,23 @@ waypoints and avoiding other vehicles. The agent also responds to traffic lights
 It can also make use of the global route planner to follow a specifed route
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import carla
 from shapely.geometry import Polygon
+try:
+    from shapely import intersects, polygons
+except ImportError:
+    # Shapely 1.x has no vectorized operations
+    intersects, polygons = None, None
 
 from agents.navigation.local_planner import LocalPlanner, RoadOption
-from agents.navigation.global_route_planner import GlobalRoutePlanner
-from agents.tools.misc import (get_speed, is_within_distance,
-                               get_trafficlight_trigger_location,
+from agents.navigation.global_route_planner import GlobalRoutePlanner, get_shared_planner
+from agents.navigation.stage_scheduler import StageScheduler
+from agents.navigation.traffic_light_index import get_traffic_light_index
+from agents.tools.world_state import get_world_state
+from agents.tools.misc import (get_speed, is_within_distance, are_within_distance, get_world_vertices,
                                compute_distance)
 
 
@@ -34,7 +44,23 @@ class BasicAgent(object):
             :param vehicle: actor to apply to agent logic onto
             :param target_speed: speed (in Km/h) at which the vehicle will move
             :param opt_dict: dictionary in case some of its parameters want to be changed.
-                This also applies to parameters related to the LocalPlanner.
+                This also applies to parameters related to the LocalPlanner and the GlobalRoutePlanner.
+                With 'use_lane_index', the perception localizes the actors with the LaneIndex
+                of the GlobalRoutePlanner instead of querying the map.
+                With 'use_world_state', the perception reads the actors from the WorldState of the
+                current frame, shared by all the agents, instead of querying them one by one.
+                With 'lazy_route', the routes of set_destination are expanded into waypoints
+                as they are followed, instead of all at once.
+                Unless 'shared_global_planner' is False, all the agents of the same map and
+                sampling resolution share one GlobalRoutePlanner (see get_shared_planner).
+                With 'background_planner', the GlobalRoutePlanner is built on a background thread
+                while the agent follows random waypoints, and the destinations set in the meantime
+                are traced once it is ready.
+                With 'stage_rates', a dictionary of frequencies in Hz, the checks for traffic lights
+                ('traffic_lights'), vehicles ('vehicles') and walkers ('walkers') run at their own rate,
+                and their last result is reused in between (see StageScheduler). It is refreshed when
+                the ego moves more than 'stage_max_distance' meters, and at every step when the ego
+                is faster than 'stage_refresh_speed' Km/h.
             :param map_inst: carla.Map instance to avoid the expensive call of getting it.
             :param grp_inst: GlobalRoutePlanner instance to avoid the expensive call of getting it.
 
@@ -63,6 +89,16 @@ class BasicAgent(object):
         self._speed_ratio = 1
         self._max_brake = 0.5
         self._offset = 0
+        self._use_lane_index = False
+        self._use_world_state = False
+        self._lazy_route = False
+        self._repairable_route = None
+        self._shared_global_planner = True
+        self._background_planner = False
+        self._dt = 1.0 / 20.0
+        self._stage_rates = {}
+        self._stage_max_distance = 5.0  # meters
+        self._stage_refresh_speed = None
 
         # Change parameters according to the dictionary
         opt_dict['target_speed'] = target_speed
@@ -86,21 +122,92 @@ class BasicAgent(object):
             self._max_brake = opt_dict['max_brake']
         if 'offset' in opt_dict:
             self._offset = opt_dict['offset']
+        if 'use_lane_index' in opt_dict:
+            self._use_lane_index = opt_dict['use_lane_index']
+        if 'use_world_state' in opt_dict:
+            self._use_world_state = opt_dict['use_world_state']
+        if 'lazy_route' in opt_dict:
+            self._lazy_route = opt_dict['lazy_route']
+        if 'shared_global_planner' in opt_dict:
+            self._shared_global_planner = opt_dict['shared_global_planner']
+        if 'background_planner' in opt_dict:
+            self._background_planner = opt_dict['background_planner']
+        if 'dt' in opt_dict:
+            self._dt = opt_dict['dt']
+        if 'stage_rates' in opt_dict:
+            self._stage_rates = opt_dict['stage_rates']
+        if 'stage_max_distance' in opt_dict:
+            self._stage_max_distance = opt_dict['stage_max_distance']
+        if 'stage_refresh_speed' in opt_dict:
+            self._stage_refresh_speed = opt_dict['stage_refresh_speed']
+
+        self._scheduler = StageScheduler(
+            self._dt, self._stage_rates, self._stage_max_distance, self._stage_refresh_speed)
 
         # Initialize the planners
         self._local_planner = LocalPlanner(self._vehicle, opt_dict=opt_dict, map_inst=self._map)
+        self._global_planner = None
+        self._global_planner_future = None
+        self._pending_destinations = []
+        if grp_inst and not isinstance(grp_inst, GlobalRoutePlanner):
+            print("Warning: Ignoring the given map as it is not a 'carla.Map'")
+            grp_inst = None
+
+        # Client side index of the lanes, shared with the global planner, to localize
+        # the ego and the surrounding actors without querying the map at each step
+        self._lane_index = None
+
         if grp_inst:
-            if isinstance(grp_inst, GlobalRoutePlanner):
-                self._global_planner = grp_inst
-            else:
-                print("Warning: Ignoring the given map as it is not a 'carla.Map'")
-                self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._set_global_planner(grp_inst)
+        elif self._background_planner:
+            # Until the planner is ready, the local planner follows random waypoints
+            executor = ThreadPoolExecutor(max_workers=1)
+            self._global_planner_future = executor.submit(self._build_global_planner, dict(opt_dict))
+            executor.shutdown(wait=False)
         else:
-            self._global_planner = GlobalRoutePlanner(self._map, self._sampling_resolution)
+            self._set_global_planner(self._create_global_planner(opt_dict))
 
         # Get the static elements of the scene
         self._lights_list = self._world.get_actors().filter("*traffic_light*")
-        self._lights_map = {}  # Dictionary mapping a traffic light to a wp corrspoing to its trigger volume location
+        self._lights_map = {light.id: light for light in self._lights_list}
+        self._lights_index = get_traffic_light_index(self._map)  # Trigger volume waypoints of the lights, by road
+        self._lights_index.add(self._lights_list)
+
+    def _create_global_planner(self, opt_dict):
+        """Returns the GlobalRoutePlanner of the agent, shared with the other agents unless disabled"""
+        if self._shared_global_planner:
+            return get_shared_planner(self._map, self._sampling_resolution, opt_dict)
+        return GlobalRoutePlanner(self._map, self._sampling_resolution, opt_dict)
+
+    def _build_global_planner(self, opt_dict):
+        """Returns the global planner, with its lane index built if used. Runs on the background thread"""
+        global_planner = self._create_global_planner(opt_dict)
+        if self._use_lane_index:
+            global_planner.get_lane_index()
+        return global_planner
+
+    def _set_global_planner(self, global_planner):
+        """Starts using the given global planner"""
+        if self._use_lane_index:
+            self._lane_index = global_planner.get_lane_index()
+        self._global_planner = global_planner
+
+    def _global_planner_ready(self, wait=False):
+        """
+        Returns whether the global planner is ready, waiting for it if 'wait' is True.
+        Once the planner built on the background is ready, the destinations set while
+        it was being built are traced, in the same order
+        """
+        if self._global_planner is not None:
+            return True
+        if not wait and not self._global_planner_future.done():
+            return False
+
+        self._set_global_planner(self._global_planner_future.result())
+        pending, self._pending_destinations = self._pending_destinations, []
+        for method, args in pending:
+            method(*args)
+        return True
 
     def add_emergency_stop(self, control):
         """
@@ -135,7 +242,8 @@ class BasicAgent(object):
         return self._local_planner
 
     def get_global_planner(self):
-        """Get method for protected member local planner"""
+        """Get method for protected member local planner. Waits for it if it is being built"""
+        self._global_planner_ready(wait=True)
         return self._global_planner
 
     def set_destination(self, end_location, start_location=None):
@@ -148,6 +256,10 @@ class BasicAgent(object):
             :param end_location (carla.Location): final location of the route
             :param start_location (carla.Location): starting location of the route
         """
+        if not self._global_planner_ready():
+            self._pending_destinations.append((self.set_destination, (end_location, start_location)))
+            return
+
         if not start_location:
             start_location = self._local_planner.target_waypoint.transform.location
             clean_queue = True
@@ -155,12 +267,39 @@ class BasicAgent(object):
             start_location = self._vehicle.get_location()
             clean_queue = False
 
-        start_waypoint = self._map.get_waypoint(start_location)
-        end_waypoint = self._map.get_waypoint(end_location)
+        start_waypoint = self._get_waypoint(start_location)
+        end_waypoint = self._get_waypoint(end_location)
 
-        route_trace = self.trace_route(start_waypoint, end_waypoint)
+        self._repairable_route = None
+        if self._lazy_route:
+            route_trace = self._global_planner.trace_route_lazy(
+                start_waypoint.transform.location, end_waypoint.transform.location)
+        else:
+            route_trace = self.trace_route(start_waypoint, end_waypoint)
         self._local_planner.set_global_plan(route_trace, clean_queue=clean_queue)
 
+    def update_destination(self, end_location):
+        """
+        Moves the destination of the route, for example to follow another vehicle. Unlike
+        set_destination, the part of the route that doesn't change is kept, and only the
+        route between the new destination and the old one is searched again. The first call,
+        or any call once the route is finished, traces the whole route from the vehicle.
+
+            :param end_location (carla.Location): final location of the route
+        """
+        if not self._global_planner_ready():
+            self._pending_destinations.append((self.update_destination, (end_location,)))
+            return
+
+        if self._repairable_route is None or self._local_planner.done():
+            start_location = self._local_planner.target_waypoint.transform.location
+            self._repairable_route = self._global_planner.trace_repairable_route(start_location, end_location)
+            self._local_planner.set_global_plan(self._repairable_route.waypoints())
+        else:
+            remaining = len(self._local_planner.get_plan())
+            num_waypoints, plan = self._repairable_route.repair(end_location, remaining)
+            self._local_planner.replace_plan_tail(num_waypoints, plan)
+
     def set_global_plan(self, plan, stop_waypoint_creation=True, clean_queue=True):
         """
         Adds a specific plan to the agent.
@@ -169,6 +308,14 @@ class BasicAgent(object):
             :param stop_waypoint_creation: stops the automatic random creation of waypoints
             :param clean_queue: resets the current agent's plan
         """
+        # The plan replaces the destinations waiting for the global planner, or is added after them
+        if clean_queue:
+            self._pending_destinations = []
+        elif self._pending_destinations:
+            self._pending_destinations.append((self.set_global_plan, (plan, stop_waypoint_creation, clean_queue)))
+            return
+
+        self._repairable_route = None
         self._local_planner.set_global_plan(
             plan,
             stop_waypoint_creation=stop_waypoint_creation,
@@ -184,26 +331,29 @@ class BasicAgent(object):
         """
         start_location = start_waypoint.transform.location
         end_location = end_waypoint.transform.location
+        self._global_planner_ready(wait=True)
         return self._global_planner.trace_route(start_location, end_location)
 
     def run_step(self):
         """Execute one step of navigation."""
+        self._global_planner_ready()
         hazard_detected = False
 
-        # Retrieve all relevant actors
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-
-        vehicle_speed = get_speed(self._vehicle) / 3.6
+        vehicle_speed = get_speed(self._vehicle)
+        self._scheduler.tick(self._vehicle.get_location(), vehicle_speed)
+        vehicle_speed /= 3.6
 
         # Check for possible vehicle obstacles
         max_vehicle_distance = self._base_vehicle_threshold + self._speed_ratio * vehicle_speed
-        affected_by_vehicle, _, _ = self._vehicle_obstacle_detected(vehicle_list, max_vehicle_distance)
+        affected_by_vehicle, _, _ = self._scheduler.run(
+            'vehicles', self._vehicles_detected, max_vehicle_distance, refresh=self._refresh_obstacle)
         if affected_by_vehicle:
             hazard_detected = True
 
         # Check if the vehicle is affected by a red traffic light
         max_tlight_distance = self._base_tlight_threshold + self._speed_ratio * vehicle_speed
-        affected_by_tlight, _ = self._affected_by_traffic_light(self._lights_list, max_tlight_distance)
+        affected_by_tlight, _ = self._scheduler.run(
+            'traffic_lights', self._affected_by_traffic_light, None, max_tlight_distance)
         if affected_by_tlight:
             hazard_detected = True
 
@@ -213,6 +363,42 @@ class BasicAgent(object):
 
         return control
 
+    def _vehicles_detected(self, max_distance):
+        """Checks the vehicles of the scene for obstacles, see _vehicle_obstacle_detected"""
+        vehicle_list = self._get_actors("*vehicle*")
+        return self._vehicle_obstacle_detected(vehicle_list, max_distance)
+
+    def _get_actors(self, pattern, location=None, max_distance=None):
+        """
+        Returns the actors of the scene whose type matches a pattern, read from the
+        WorldState of the current frame if it is enabled.
+
+            :param pattern (str): wildcard pattern of the type ids, such as '*vehicle*'
+            :param location (carla.Location): if given, only the actors closer than 'max_distance' to it are returned
+            :param max_distance (float): distance to the location
+        """
+        if self._use_world_state:
+            return get_world_state(self._world).filter(pattern, location, max_distance)
+
+        actor_list = self._world.get_actors().filter(pattern)
+        if location is None or max_distance is None:
+            return actor_list
+        return [a for a in actor_list if a.get_location().distance(location) < max_distance]
+
+    def _refresh_obstacle(self, detection):
+        """Updates the distance of an obstacle detected in a previous step, forgetting it if it no longer exists"""
+        detected, actor, _ = detection
+        if not detected:
+            return detection
+        if self._use_world_state:
+            # The detected ActorState belongs to the frame of the detection, read the current one instead
+            actor = get_world_state(self._world).get_actor(actor.id)
+            if actor is None:
+                return (False, None, -1)
+        elif not actor.is_alive:
+            return (False, None, -1)
+        return (True, actor, compute_distance(actor.get_location(), self._vehicle.get_location()))
+
     def done(self):
         """Check whether the agent has reached its destination."""
         return self._local_planner.done()
@@ -256,7 +442,7 @@ class BasicAgent(object):
         Method to check if there is a red light affecting the vehicle.
 
             :param lights_list (list of carla.TrafficLight): list containing TrafficLight objects.
-                If None, all traffic lights in the scene are used
+                If None, all traffic lights in the scene when the agent was created are used
             :param max_distance (float): max distance for traffic lights to be considered relevant.
                 If None, the base threshold value is used
         """
@@ -264,42 +450,39 @@ class BasicAgent(object):
             return (False, None)
 
         if not lights_list:
-            lights_list = self._world.get_actors().filter("*traffic_light*")
+            lights_map = self._lights_map
+        else:
+            self._lights_index.add(lights_list)
+            lights_map = {light.id: light for light in lights_list}
 
         if not max_distance:
             max_distance = self._base_tlight_threshold
 
         if self._last_traffic_light:
-            if self._last_traffic_light.state != carla.TrafficLightState.Red:
+            if self._get_light_state(self._last_traffic_light) != carla.TrafficLightState.Red:
                 self._last_traffic_light = None
             else:
                 return (True, self._last_traffic_light)
 
         ego_vehicle_location = self._vehicle.get_location()
-        ego_vehicle_waypoint = self._map.get_waypoint(ego_vehicle_location)
-
-        for traffic_light in lights_list:
-            if traffic_light.id in self._lights_map:
-                trigger_wp = self._lights_map[traffic_light.id]
-            else:
-                trigger_location = get_trafficlight_trigger_location(traffic_light)
-                trigger_wp = self._map.get_waypoint(trigger_location)
-                self._lights_map[traffic_light.id] = trigger_wp
-
-            if trigger_wp.transform.location.distance(ego_vehicle_location) > max_distance:
+        ego_vehicle_waypoint = self._get_waypoint(ego_vehicle_location)
+        ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
+
+        # Only the lights whose trigger is on the road of the ego are checked
+        for light_id, trigger_wp, trigger_location, wp_dir in \
+                self._lights_index.get_road_triggers(ego_vehicle_waypoint.road_id):
+            traffic_light = lights_map.get(light_id)
+            if traffic_light is None:
                 continue
-
-            if trigger_wp.road_id != ego_vehicle_waypoint.road_id:
+            if trigger_location.distance(ego_vehicle_location) > max_distance:
                 continue
 
-            ve_dir = ego_vehicle_waypoint.transform.get_forward_vector()
-            wp_dir = trigger_wp.transform.get_forward_vector()
             dot_ve_wp = ve_dir.x * wp_dir.x + ve_dir.y * wp_dir.y + ve_dir.z * wp_dir.z
 
             if dot_ve_wp < 0:
                 continue
 
-            if traffic_light.state != carla.TrafficLightState.Red:
+            if self._get_light_state(traffic_light) != carla.TrafficLightState.Red:
                 continue
 
             if is_within_distance(trigger_wp.transform, self._vehicle.get_transform(), max_distance, [0, 90]):
@@ -308,6 +491,18 @@ class BasicAgent(object):
 
         return (False, None)
 
+    def _get_light_state(self, traffic_light):
+        """
+        Returns the state of a traffic light, read from the WorldState of the current frame if it is enabled
+
+            :param traffic_light (carla.TrafficLight): traffic light
+        """
+        if self._use_world_state:
+            world_state = get_world_state(self._world)
+            if traffic_light.id in world_state:
+                return world_state.get_traffic_light_state(traffic_light.id)
+        return traffic_light.state
+
     def _vehicle_obstacle_detected(self, vehicle_list=None, max_distance=None, up_angle_th=90, low_angle_th=0, lane_offset=0):
         """
         Method to check if there is a vehicle in front of the agent blocking its path.
@@ -317,43 +512,18 @@ class BasicAgent(object):
             :param max_distance: max freespace to check for obstacles.
                 If None, the base threshold value is used
         """
-        def get_route_polygon():
-            route_bb = []
-            extent_y = self._vehicle.bounding_box.extent.y
-            r_ext = extent_y + self._offset
-            l_ext = -extent_y + self._offset
-            r_vec = ego_transform.get_right_vector()
-            p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-            p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-            route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            for wp, _ in self._local_planner.get_plan():
-                if ego_location.distance(wp.transform.location) > max_distance:
-                    break
-
-                r_vec = wp.transform.get_right_vector()
-                p1 = wp.transform.location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
-                p2 = wp.transform.location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
-                route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
-
-            # Two points don't create a polygon, nothing to check
-            if len(route_bb) < 3:
-                return None
-
-            return Polygon(route_bb)
-
         if self._ignore_vehicles:
             return (False, None, -1)
 
         if not vehicle_list:
-            vehicle_list = self._world.get_actors().filter("*vehicle*")
+            vehicle_list = self._get_actors("*vehicle*")
 
         if not max_distance:
             max_distance = self._base_vehicle_threshold
 
         ego_transform = self._vehicle.get_transform()
         ego_location = ego_transform.location
-        ego_wpt = self._map.get_waypoint(ego_location)
+        ego_wpt = self._get_lane_position(ego_location)
 
         # Get the right offset
         if ego_wpt.lane_id < 0 and lane_offset != 0:
@@ -368,52 +538,120 @@ class BasicAgent(object):
         use_bbs = self._use_bbs_detection or opposite_invasion or ego_wpt.is_junction
 
         # Get the route bounding box
-        route_polygon = get_route_polygon()
-
-        for target_vehicle in vehicle_list:
-            if target_vehicle.id == self._vehicle.id:
-                continue
-
-            target_transform = target_vehicle.get_transform()
-            if target_transform.location.distance(ego_location) > max_distance:
-                continue
+        extent_y = self._vehicle.bounding_box.extent.y
+        route_polygon = self._local_planner.get_route_corridor(
+            ego_front_transform, extent_y + self._offset, -extent_y + self._offset, max_distance)
+
+        # The geometric tests are done for all the vehicles at once. Only the ones passing them
+        # are localized on the lanes, in the order of the list, until one of them is detected
+        ids, locations, rotations, extents, box_locations, box_rotations = self._get_actor_arrays(vehicle_list)
+        ego_point = np.array([ego_location.x, ego_location.y, ego_location.z])
+        close = np.flatnonzero((np.linalg.norm(locations - ego_point, axis=1) <= max_distance)
+                               & (ids != self._vehicle.id))
+        if len(close) == 0:
+            return (False, None, -1)
 
-            target_wpt = self._map.get_waypoint(target_transform.location, lane_type=carla.LaneType.Any)
+        locations = locations[close]
+        rotations = rotations[close]
+        extents = extents[close]
+
+        # Simplified approach: the rear of the target has to be in front of the ego
+        yaws = np.radians(rotations[:, 1])
+        pitches = np.radians(rotations[:, 0])
+        rear_points = locations[:, :2] - (extents[:, 0] * np.cos(pitches))[:, np.newaxis] * np.stack(
+            (np.cos(yaws), np.sin(yaws)), axis=1)
+        in_front = are_within_distance(rear_points, ego_front_transform, max_distance, [low_angle_th, up_angle_th])
+
+        # General approach: the bounding box of the target has to intersect the route
+        on_route = np.zeros(len(close), dtype=bool)
+        if route_polygon:
+            vertices = get_world_vertices(
+                locations, rotations, extents, box_locations[close], box_rotations[close])
+            on_route = _intersects(route_polygon, vertices)
+
+        next_wpt = None
+        for i in np.flatnonzero(in_front | on_route):
+            target_vehicle = vehicle_list[close[i]]
+            target_location = carla.Location(*locations[i].tolist())
+            target_wpt = self._get_lane_position(target_location, lane_type=carla.LaneType.Any)
 
             # General approach for junctions and vehicles invading other lanes due to the offset
             if (use_bbs or target_wpt.is_junction) and route_polygon:
-
-                target_bb = target_vehicle.bounding_box
-                target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
-                target_list = [[v.x, v.y, v.z] for v in target_vertices]
-                target_polygon = Polygon(target_list)
-
-                if route_polygon.intersects(target_polygon):
-                    return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+                if on_route[i]:
+                    return (True, target_vehicle, compute_distance(target_location, ego_location))
 
             # Simplified approach, using only the plan waypoints (similar to TM)
-            else:
+            elif in_front[i]:
 
                 if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id  + lane_offset:
-                    next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
+                    if next_wpt is None:
+                        next_wpt = self._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
                     if not next_wpt:
                         continue
                     if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id  + lane_offset:
                         continue
 
-                target_forward_vector = target_transform.get_forward_vector()
-                target_extent = target_vehicle.bounding_box.extent.x
-                target_rear_transform = target_transform
-                target_rear_transform.location -= carla.Location(
-                    x=target_extent * target_forward_vector.x,
-                    y=target_extent * target_forward_vector.y,
-                )
-
-                if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
-                    return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
+                target_rear_location = carla.Location(*rear_points[i].tolist(), locations[i, 2])
+                return (True, target_vehicle, compute_distance(target_rear_location, ego_transform.location))
 
         return (False, None, -1)
 
+    def _get_actor_arrays(self, actors):
+        """
+        Returns the ids of a list of actors and, as (N, 3) arrays, their locations, rotations
+        (pitch, yaw and roll) and the extents, locations and rotations of their bounding boxes.
+        They are read from the WorldState of the current frame if it is enabled.
+
+            :param actors (list of carla.Actor): actors
+        """
+        if self._use_world_state:
+            world_state = get_world_state(self._world)
+            rows = getattr(actors, 'rows', None)
+            if rows is None or getattr(actors, 'world_state', None) is not world_state:
+                rows = [world_state.index(a.id) for a in actors]
+                if None in rows:
+                    rows = None
+            if rows is not None:
+                return (world_state.ids[rows], world_state.locations[rows], world_state.rotations[rows],
+                        world_state.extents[rows], world_state.box_locations[rows], world_state.box_rotations[rows])
+
+        transforms = [a.get_transform() for a in actors]
+        boxes = [a.bounding_box for a in actors]
+        return (np.array([a.id for a in actors], dtype=np.int64),
+                np.array([(t.location.x, t.location.y, t.location.z) for t in transforms]).reshape(-1, 3),
+                np.array([(t.rotation.pitch, t.rotation.yaw, t.rotation.roll) for t in transforms]).reshape(-1, 3),
+                np.array([(b.extent.x, b.extent.y, b.extent.z) for b in boxes]).reshape(-1, 3),
+                np.array([(b.location.x, b.location.y, b.location.z) for b in boxes]).reshape(-1, 3),
+                np.array([(b.rotation.pitch, b.rotation.yaw, b.rotation.roll) for b in boxes]).reshape(-1, 3))
+
+    def _get_waypoint(self, location):
+        """
+        Returns the carla.Waypoint of the lane closest to a location,
+        using the lane index if it is enabled.
+
+            :param location (carla.Location): location to localize
+        """
+        if self._lane_index is not None:
+            waypoint = self._lane_index.get_waypoint(location)
+            if waypoint is not None:
+                return waypoint
+        return self._map.get_waypoint(location)
+
+    def _get_lane_position(self, location, lane_type=carla.LaneType.Driving):
+        """
+        Returns the lane closest to a location. With the lane index, it is a LanePosition,
+        which has the road_id, lane_id, lane_width and is_junction of the carla.Waypoint
+        returned otherwise, but is found without querying the map.
+
+            :param location (carla.Location): location to localize
+            :param lane_type (carla.LaneType): types of the lanes taken into account
+        """
+        if self._lane_index is not None:
+            position = self._lane_index.locate(location, lane_type)
+            if position is not None:
+                return position
+        return self._map.get_waypoint(location, lane_type=lane_type)
+
     def _generate_lane_change_path(self, waypoint, direction='left', distance_same_lane=10,
                                 distance_other_lane=25, lane_change_distance=25,
                                 check=True, lane_changes=1, step_distance=2):
@@ -489,3 +727,10 @@ class BasicAgent(object):
             plan.append((next_wp, RoadOption.LANEFOLLOW))
 
         return plan
+
+
+def _intersects(polygon, vertices):
+    """Returns whether a polygon intersects the polygons of each of the (N, M, 3) vertices"""
+    if intersects is not None:
+        return intersects(polygon, polygons(vertices))
+    return np.array([polygon.intersects(Polygon(v)) for v in vertices], dtype=bool)
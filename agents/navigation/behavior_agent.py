@@ -38,6 +38,10 @@ class BehaviorAgent(BasicAgent):
             :param behavior: type of agent to apply
         """
 
+        # Passed to the base agent, so that its GlobalRoutePlanner is built once, at this resolution
+        opt_dict = dict(opt_dict)
+        opt_dict.setdefault('sampling_resolution', 4.5)
+
         super().__init__(vehicle, opt_dict=opt_dict, map_inst=map_inst, grp_inst=grp_inst)
         self._look_ahead_steps = 0
 
@@ -49,7 +53,6 @@ class BehaviorAgent(BasicAgent):
         self._incoming_waypoint = None
         self._min_speed = 5
         self._behavior = None
-        self._sampling_resolution = 4.5
 
         # Parameters for agent behavior
         if behavior == 'cautious':
@@ -84,9 +87,7 @@ class BehaviorAgent(BasicAgent):
         """
         This method is in charge of behaviors for red lights.
         """
-        actor_list = self._world.get_actors()
-        lights_list = actor_list.filter("*traffic_light*")
-        affected, _ = self._affected_by_traffic_light(lights_list)
+        affected, _ = self._affected_by_traffic_light()
 
         return affected
 
@@ -132,6 +133,8 @@ class BehaviorAgent(BasicAgent):
         """
         This module is in charge of warning in case of a collision
         and managing possible tailgating chances.
+        The detection runs at the rate of the 'vehicles' stage, while
+        the tailgating chances are checked at every step.
 
             :param location: current location of the agent
             :param waypoint: current waypoint of the agent
@@ -139,31 +142,45 @@ class BehaviorAgent(BasicAgent):
             :return vehicle: nearby vehicle
             :return distance: distance to nearby vehicle
         """
+        vehicle_list = None
+        if self._scheduler.is_due('vehicles'):
+            vehicle_list = self._nearby_vehicles(waypoint)
+        vehicle_state, vehicle, distance = self._scheduler.run(
+            'vehicles', self._vehicle_avoid_detected, vehicle_list, refresh=self._refresh_obstacle)
+
+        # Check for tailgating
+        if not vehicle_state and self._direction == RoadOption.LANEFOLLOW \
+                and not waypoint.is_junction and self._speed > 10 \
+                and self._behavior.tailgate_counter == 0:
+            if vehicle_list is None:
+                vehicle_list = self._nearby_vehicles(waypoint)
+            self._tailgating(waypoint, vehicle_list)
+
+        return vehicle_state, vehicle, distance
 
-        vehicle_list = self._world.get_actors().filter("*vehicle*")
-        def dist(v): return v.get_location().distance(waypoint.transform.location)
-        vehicle_list = [v for v in vehicle_list if dist(v) < 45 and v.id != self._vehicle.id]
+    def _nearby_vehicles(self, waypoint):
+        """Returns the vehicles around a waypoint, other than the ego"""
+        vehicle_list = self._get_actors("*vehicle*", waypoint.transform.location, 45)
+        return [v for v in vehicle_list if v.id != self._vehicle.id]
 
+    def _vehicle_avoid_detected(self, vehicle_list):
+        """
+        Checks the vehicles for obstacles in the direction of the agent,
+        see _vehicle_obstacle_detected
+
+            :param vehicle_list: list of the nearby vehicles
+        """
         if self._direction == RoadOption.CHANGELANELEFT:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
+            return self._vehicle_obstacle_detected(
                 vehicle_list, max(
                     self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=-1)
         elif self._direction == RoadOption.CHANGELANERIGHT:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
+            return self._vehicle_obstacle_detected(
                 vehicle_list, max(
                     self._behavior.min_proximity_threshold, self._speed_limit / 2), up_angle_th=180, lane_offset=1)
-        else:
-            vehicle_state, vehicle, distance = self._vehicle_obstacle_detected(
-                vehicle_list, max(
-                    self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=30)
-
-            # Check for tailgating
-            if not vehicle_state and self._direction == RoadOption.LANEFOLLOW \
-                    and not waypoint.is_junction and self._speed > 10 \
-                    and self._behavior.tailgate_counter == 0:
-                self._tailgating(waypoint, vehicle_list)
-
-        return vehicle_state, vehicle, distance
+        return self._vehicle_obstacle_detected(
+            vehicle_list, max(
+                self._behavior.min_proximity_threshold, self._speed_limit / 3), up_angle_th=30)
 
     def pedestrian_avoid_manager(self, waypoint):
         """
@@ -177,9 +194,7 @@ class BehaviorAgent(BasicAgent):
             :return distance: distance to nearby walker
         """
 
-        walker_list = self._world.get_actors().filter("*walker.pedestrian*")
-        def dist(w): return w.get_location().distance(waypoint.transform.location)
-        walker_list = [w for w in walker_list if dist(w) < 10]
+        walker_list = self._get_actors("*walker.pedestrian*", waypoint.transform.location, 10)
 
         if self._direction == RoadOption.CHANGELANELEFT:
             walker_state, walker, distance = self._vehicle_obstacle_detected(walker_list, max(
@@ -243,6 +258,7 @@ class BehaviorAgent(BasicAgent):
             :param debug: boolean for debugging
             :return control: carla.VehicleControl
         """
+        self._global_planner_ready()
         self._update_information()
 
         control = None
@@ -250,14 +266,16 @@ class BehaviorAgent(BasicAgent):
             self._behavior.tailgate_counter -= 1
 
         ego_vehicle_loc = self._vehicle.get_location()
-        ego_vehicle_wp = self._map.get_waypoint(ego_vehicle_loc)
+        ego_vehicle_wp = self._get_waypoint(ego_vehicle_loc)
+        self._scheduler.tick(ego_vehicle_loc, self._speed)
 
         # 1: Red lights and stops behavior
-        if self.traffic_light_manager():
+        if self._scheduler.run('traffic_lights', self.traffic_light_manager):
             return self.emergency_stop()
 
         # 2.1: Pedestrian avoidance behaviors
-        walker_state, walker, w_distance = self.pedestrian_avoid_manager(ego_vehicle_wp)
+        walker_state, walker, w_distance = self._scheduler.run(
+            'walkers', self.pedestrian_avoid_manager, ego_vehicle_wp, refresh=self._refresh_obstacle)
 
         if walker_state:
             # Distance is computed from the center of the two cars,
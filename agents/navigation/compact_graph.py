@@ -0,0 +1,442 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+
+"""
+This module provides an array based representation of the route planner graph.
+"""
+
+from heapq import heappush, heappop
+from itertools import count
+import math
+
+import numpy as np
+import networkx as nx
+
+
+class CompactGraph(object):
+    """
+    CompactGraph stores the nodes and edges of a networkx.DiGraph in contiguous arrays,
+    using a CSR (compressed sparse row) adjacency, and searches it with A*.
+
+    The successors of each node keep the order of the original graph and the
+    search mirrors networkx.astar_path, so both return the same routes.
+
+    The cost of each edge is its weight times a multiplier, 1 by default, which can be
+    updated at any time with set_cost_multipliers, for example to avoid congested lanes.
+    """
+
+    def __init__(self, graph, weight='length'):
+        """
+        :param graph: networkx.DiGraph whose nodes have a 'vertex' attribute with their (x, y, z) position
+        :param weight: edge attribute used as the cost of the edges
+        """
+        nodes = list(graph.nodes)
+        self._node_index = {node: i for i, node in enumerate(nodes)}
+
+        indptr = [0]
+        indices = []
+        lengths = []
+        edge_nodes = []
+        for node in nodes:
+            for neighbor, attributes in graph.adj[node].items():
+                indices.append(self._node_index[neighbor])
+                lengths.append(attributes.get(weight, 1))
+                edge_nodes.append((node, neighbor))
+            indptr.append(len(indices))
+
+        self.node_ids = np.array(nodes, dtype=np.int64)
+        self.vertices = np.array([graph.nodes[node]['vertex'] for node in nodes], dtype=np.float64).reshape(-1, 3)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.lengths = np.array(lengths, dtype=np.float32)
+        self._edge_index = {edge: i for i, edge in enumerate(edge_nodes)}
+        self.multipliers = np.ones(len(lengths), dtype=np.float32)
+
+        # Plain lists are much faster than numpy arrays for the scalar accesses of the search
+        self._nodes_list = nodes
+        self._indptr_list = self.indptr.tolist()
+        self._indices_list = self.indices.tolist()
+        self._lengths_list = self.lengths.tolist()
+        self._vertices_list = self.vertices.tolist()
+        self._reverse_lists = None
+        self._reverse_edges = None
+        # Costs of the edges used by the searches, updated when the multipliers change
+        self._costs_list = self._lengths_list
+        self._costs_outdated = False
+
+        # Landmark tables of the ALT search, see build_landmarks
+        self.landmarks = None
+        self.landmark_from = None
+        self.landmark_to = None
+
+    def __len__(self):
+        return len(self._nodes_list)
+
+    def __contains__(self, node):
+        return node in self._node_index
+
+    def edge_index(self, n1, n2):
+        """Returns the position of the edge (n1, n2) in the edge arrays"""
+        return self._edge_index[(n1, n2)]
+
+    def set_cost_multipliers(self, edge_indices, multipliers):
+        """
+        Sets the cost multipliers of some edges. Multipliers below 1 are raised to 1, so that
+        the landmark distances, computed with the plain weights, stay lower bounds of the costs.
+
+            :param edge_indices: array with the positions of the edges, see edge_index
+            :param multipliers: array with the multiplier of each edge, or a single multiplier for all of them
+            :return: tuple of two boolean arrays, telling which of the given edges got
+                more and less expensive
+        """
+        edge_indices = np.asarray(edge_indices, dtype=np.int64)
+        multipliers = np.maximum(np.broadcast_to(np.asarray(multipliers, dtype=np.float32), edge_indices.shape), 1.0)
+        previous = self.multipliers[edge_indices]
+        self.multipliers[edge_indices] = multipliers
+        self._costs_outdated = True
+        return multipliers > previous, multipliers < previous
+
+    def reset_cost_multipliers(self):
+        """Sets all the cost multipliers back to 1"""
+        self.multipliers.fill(1.0)
+        self._costs_list = self._lengths_list
+        self._costs_outdated = False
+
+    def astar(self, source, target):
+        """
+        Finds the shortest path between two nodes using A* with an euclidean distance heuristic.
+
+            :param source: id of the starting node
+            :param target: id of the ending node
+            :return: list of the node ids from source to target
+        """
+        src, dst = self._search_nodes(source, target)
+        return self._search(src, dst, self._euclidean_heuristic(dst))
+
+    def _euclidean_heuristic(self, dst):
+        """Returns the function giving the euclidean distance from a node index to the node index 'dst'"""
+        vertices = self._vertices_list
+        tx, ty, tz = vertices[dst]
+
+        def heuristic(node):
+            x, y, z = vertices[node]
+            return math.sqrt((x - tx) * (x - tx) + (y - ty) * (y - ty) + (z - tz) * (z - tz))
+
+        return heuristic
+
+    def has_landmarks(self):
+        """Returns whether the landmark tables used by the ALT search are available"""
+        return self.landmarks is not None
+
+    def build_landmarks(self, num_landmarks):
+        """
+        Preprocessing of the ALT (A*, landmarks and triangle inequality) search.
+        Selects a set of landmarks far apart from each other and stores the distances
+        from each landmark to every node, and from every node to each landmark.
+
+            :param num_landmarks: number of landmarks. More landmarks give tighter bounds
+                but make the preprocessing and each query slower
+        """
+        num_nodes = len(self._nodes_list)
+        num_landmarks = max(1, min(num_landmarks, num_nodes))
+
+        # Landmarks are picked among the nodes that can be reached from, and can reach, the node
+        # closest to the center of the map, so that dead ends and isolated roads are never chosen.
+        # Starting from that seed, keep adding the node that is the furthest, through the graph,
+        # from all the landmarks selected so far
+        centroid = self.vertices.mean(axis=0)
+        seed = int(np.argmin(np.linalg.norm(self.vertices - centroid, axis=1)))
+        seed_from, seed_to = self._dijkstra(seed), self._dijkstra(seed, reverse=True)
+        connected = np.isfinite(seed_from) & np.isfinite(seed_to)
+        closest = seed_from + seed_to
+
+        landmarks, from_landmark, to_landmark = [], [], []
+        while len(landmarks) < num_landmarks:
+            reachable = connected & (closest > 0)
+            if not np.any(reachable):
+                break
+            candidate = int(np.argmax(np.where(reachable, closest, -1)))
+            landmarks.append(candidate)
+            from_landmark.append(self._dijkstra(candidate))
+            to_landmark.append(self._dijkstra(candidate, reverse=True))
+
+            distance = from_landmark[-1] + to_landmark[-1]
+            closest = distance if len(landmarks) == 1 else np.fmin(closest, distance)
+            closest[landmarks] = 0
+
+        if not landmarks:
+            landmarks = [seed]
+            from_landmark.append(self._dijkstra(seed))
+            to_landmark.append(self._dijkstra(seed, reverse=True))
+
+        self.set_landmarks(
+            self.node_ids[landmarks],
+            np.array(from_landmark, dtype=np.float32),
+            np.array(to_landmark, dtype=np.float32))
+
+    def get_landmarks(self):
+        """
+        Returns the landmark tables as (landmark node ids, distances from the landmarks,
+        distances to the landmarks), so that they can be stored and restored with set_landmarks
+        """
+        if self.landmarks is None:
+            return None
+        return self.node_ids[self.landmarks], self.landmark_from, self.landmark_to
+
+    def set_landmarks(self, landmark_ids, landmark_from, landmark_to):
+        """
+        Sets the landmark tables used by the ALT search.
+
+            :param landmark_ids: node ids of the landmarks
+            :param landmark_from: (landmarks x nodes) array with the distances from each landmark to each node
+            :param landmark_to: (landmarks x nodes) array with the distances from each node to each landmark
+        """
+        landmark_from = np.asarray(landmark_from, dtype=np.float32)
+        landmark_to = np.asarray(landmark_to, dtype=np.float32)
+        if landmark_from.shape != landmark_to.shape or landmark_from.shape[1] != len(self._nodes_list):
+            raise ValueError("The landmark tables don't match the graph")
+        self.landmarks = np.array([self._node_index[node] for node in landmark_ids], dtype=np.int64)
+        self.landmark_from = landmark_from
+        self.landmark_to = landmark_to
+
+    def alt(self, source, target):
+        """
+        Finds the shortest path between two nodes using A* with the landmark lower bounds
+        as heuristic. Unlike the euclidean heuristic, the bounds never overestimate the
+        remaining cost, so the returned path is always a shortest one.
+
+            :param source: id of the starting node
+            :param target: id of the ending node
+            :return: list of the node ids from source to target
+        """
+        if self.landmarks is None:
+            raise RuntimeError("The landmarks have to be built before running an ALT search")
+        src, dst = self._search_nodes(source, target)
+
+        # Road networks have many routes of equal cost, prefer the nodes closer to the target
+        return self._search(src, dst, self._landmark_heuristic(dst), deeper_first=True)
+
+    def _landmark_heuristic(self, dst):
+        """Returns the function giving the landmark lower bound of the cost from a node index to the node index 'dst'"""
+        # Triangle inequality: d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L).
+        # Infinite bounds mean that the target can't be reached from that node
+        with np.errstate(invalid='ignore'):
+            forward = self.landmark_from[:, dst:dst + 1] - self.landmark_from
+            backward = self.landmark_to - self.landmark_to[:, dst:dst + 1]
+            bounds = np.fmax(np.fmax.reduce(forward, axis=0), np.fmax.reduce(backward, axis=0))
+        bounds = np.fmax(bounds, 0.0)
+
+        def heuristic(node):
+            return float(bounds[node])
+
+        return heuristic
+
+    def alternatives(self, source, target, k, max_overlap=0.5, penalty=1.5, max_iterations=None, use_landmarks=False):
+        """
+        Finds up to k diverse paths between two nodes with the penalty method. The first one is
+        the shortest path, then each search is run with the edges of the paths found so far made
+        more expensive, and its path is kept if it doesn't overlap too much with the kept ones.
+        The heuristic values are shared by all the searches, as the penalties never lower the costs.
+
+            :param source: id of the starting node
+            :param target: id of the ending node
+            :param k: maximum number of paths
+            :param max_overlap: maximum fraction of the length of a path shared with any of the other paths
+            :param penalty: factor applied to the cost of the edges of a path each time it is found
+            :param max_iterations: maximum number of searches. Defaults to 3 * k
+            :param use_landmarks: if True, the searches use the landmarks (see alt) instead of the euclidean distance
+            :return: list of paths, each one a list of node ids from source to target, shortest first
+        """
+        src, dst = self._search_nodes(source, target)
+        heuristic = self._landmark_heuristic(dst) if use_landmarks else self._euclidean_heuristic(dst)
+        estimates = {}
+
+        def cached_heuristic(node):
+            if node not in estimates:
+                estimates[node] = heuristic(node)
+            return estimates[node]
+
+        self._update_costs()
+        costs = list(self._costs_list)
+        lengths = self._lengths_list
+        if max_iterations is None:
+            max_iterations = 3 * k
+
+        paths, path_edges = [], []
+        for _ in range(max_iterations):
+            path = self._search(src, dst, cached_heuristic, deeper_first=use_landmarks, costs=costs)
+            edges = [self._edge_index[edge] for edge in zip(path[:-1], path[1:])]
+
+            length = sum(lengths[edge] for edge in edges)
+            overlap = 0.0
+            for kept_edges in path_edges:
+                shared = sum(lengths[edge] for edge in edges if edge in kept_edges)
+                overlap = max(overlap, shared / length if length > 0 else 1.0)
+            if not paths or overlap <= max_overlap:
+                paths.append(path)
+                path_edges.append(set(edges))
+                if len(paths) >= k:
+                    break
+
+            for edge in edges:
+                costs[edge] *= penalty
+
+        return paths
+
+    def search_backward(self, target, sources, max_expansions=None):
+        """
+        Searches the graph backwards from the target node until reaching one of the source nodes,
+        so that the cost of the search depends on how far the closest source is from the target.
+
+            :param target: id of the ending node
+            :param sources: set of the ids of the nodes where the path can start
+            :param max_expansions: maximum number of nodes expanded before giving up
+            :return: list of the node ids from the closest source to the target, or None if
+                none of the sources was reached
+        """
+        if target not in self._node_index:
+            raise nx.NodeNotFound("Target {} is not in G".format(target))
+        indptr, indices, _ = self._reverse_adjacency()
+        self._update_costs()
+        costs, edges = self._costs_list, self._reverse_edges
+        dst = self._node_index[target]
+
+        distances = {dst: 0.0}
+        successors = {dst: None}
+        queue = [(0.0, dst)]
+        expansions = 0
+        while queue:
+            dist, current = heappop(queue)
+            if dist > distances[current]:
+                continue
+            if self._nodes_list[current] in sources:
+                path = [self._nodes_list[current]]
+                while successors[current] is not None:
+                    current = successors[current]
+                    path.append(self._nodes_list[current])
+                return path
+
+            expansions += 1
+            if max_expansions is not None and expansions > max_expansions:
+                return None
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                ncost = dist + costs[edges[edge]]
+                if ncost < distances.get(neighbor, math.inf):
+                    distances[neighbor] = ncost
+                    successors[neighbor] = current
+                    heappush(queue, (ncost, neighbor))
+
+        return None
+
+    def _search_nodes(self, source, target):
+        """Returns the indices of the source and target nodes of a search"""
+        if source not in self._node_index:
+            raise nx.NodeNotFound("Source {} is not in G".format(source))
+        if target not in self._node_index:
+            raise nx.NodeNotFound("Target {} is not in G".format(target))
+        return self._node_index[source], self._node_index[target]
+
+    def _update_costs(self):
+        """Updates the costs of the edges used by the searches after a change of the multipliers"""
+        if self._costs_outdated:
+            self._costs_list = (self.lengths * self.multipliers).tolist()
+            self._costs_outdated = False
+
+    def _search(self, src, dst, heuristic, deeper_first=False, costs=None):
+        """
+        A* search between two node indices, following the same steps as networkx.astar_path.
+        'heuristic' returns the estimated cost from a node index to the target. If 'deeper_first'
+        is True, ties between nodes of the same estimated cost are broken in favor of the one
+        with the highest cost so far, instead of the one enqueued first.
+        'costs' replaces the list of the costs of the edges, if given.
+        """
+        if costs is None:
+            self._update_costs()
+            costs = self._costs_list
+        indptr, indices, lengths = self._indptr_list, self._indices_list, costs
+
+        counter = count()
+        queue = [(0, 0, next(counter), src, 0, None)]
+        # Cost and heuristic of the enqueued nodes, and parent of the explored ones
+        enqueued = {}
+        explored = {}
+
+        while queue:
+            _, _, _, current, dist, parent = heappop(queue)
+
+            if current == dst:
+                path = [current]
+                node = parent
+                while node is not None:
+                    path.append(node)
+                    node = explored[node]
+                path.reverse()
+                return [self._nodes_list[i] for i in path]
+
+            if current in explored:
+                # Do not override the parent of the starting node
+                if explored[current] is None:
+                    continue
+                # Skip paths that were enqueued before finding a better one
+                if enqueued[current][0] < dist:
+                    continue
+
+            explored[current] = parent
+
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                ncost = dist + lengths[edge]
+                if neighbor in enqueued:
+                    qcost, h = enqueued[neighbor]
+                    if qcost <= ncost:
+                        continue
+                else:
+                    h = heuristic(neighbor)
+
+                enqueued[neighbor] = ncost, h
+                tie = -ncost if deeper_first else 0
+                heappush(queue, (ncost + h, tie, next(counter), neighbor, ncost, current))
+
+        raise nx.NetworkXNoPath("Node {} not reachable from {}".format(
+            self._nodes_list[dst], self._nodes_list[src]))
+
+    def _dijkstra(self, src, reverse=False):
+        """
+        Returns the array of the distances from the node index 'src' to all the nodes,
+        or from all the nodes to 'src' if 'reverse' is True. Unreachable nodes are at infinity.
+        """
+        if reverse:
+            indptr, indices, lengths = self._reverse_adjacency()
+        else:
+            indptr, indices, lengths = self._indptr_list, self._indices_list, self._lengths_list
+
+        distances = [math.inf] * len(self._nodes_list)
+        distances[src] = 0.0
+        queue = [(0.0, src)]
+        while queue:
+            dist, current = heappop(queue)
+            if dist > distances[current]:
+                continue
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                ncost = dist + lengths[edge]
+                if ncost < distances[neighbor]:
+                    distances[neighbor] = ncost
+                    heappush(queue, (ncost, neighbor))
+
+        return np.array(distances)
+
+    def _reverse_adjacency(self):
+        """Returns the CSR lists (indptr, indices, lengths) of the graph with all its edges reversed"""
+        if self._reverse_lists is None:
+            order = np.argsort(self.indices, kind='stable')
+            self._reverse_edges = order.tolist()
+            sources = np.repeat(np.arange(len(self._nodes_list)), np.diff(self.indptr))
+            counts = np.bincount(self.indices, minlength=len(self._nodes_list))
+            indptr = np.concatenate(([0], np.cumsum(counts)))
+            self._reverse_lists = (indptr.tolist(), sources[order].tolist(), self.lengths[order].tolist())
+        return self._reverse_lists
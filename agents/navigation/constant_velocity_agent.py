@@ -73,6 +73,7 @@ class ConstantVelocityAgent(BasicAgent):
 
     def run_step(self):
         """Execute one step of navigation."""
+        self._global_planner_ready()
         if not self.is_constant_velocity_active:
             if self._world.get_snapshot().timestamp.elapsed_seconds - self._constant_velocity_stop_time > self._restart_time:
                 self.restart_constant_velocity()
@@ -84,15 +85,12 @@ class ConstantVelocityAgent(BasicAgent):
 
         hazard_detected = False
 
-        # Retrieve all relevant actors
-        actor_list = self._world.get_actors()
-        vehicle_list = actor_list.filter("*vehicle*")
-        lights_list = actor_list.filter("*traffic_light*")
-
         vehicle_speed = self._vehicle.get_velocity().length()
+        self._scheduler.tick(self._vehicle.get_location(), 3.6 * vehicle_speed)
 
         max_vehicle_distance = self._base_vehicle_threshold + vehicle_speed
-        affected_by_vehicle, adversary, _ = self._vehicle_obstacle_detected(vehicle_list, max_vehicle_distance)
+        affected_by_vehicle, adversary, _ = self._scheduler.run(
+            'vehicles', self._vehicles_detected, max_vehicle_distance, refresh=self._refresh_obstacle)
         if affected_by_vehicle:
             vehicle_velocity = self._vehicle.get_velocity()
             if vehicle_velocity.length() == 0:
@@ -103,7 +101,9 @@ class ConstantVelocityAgent(BasicAgent):
 
         # Check if the vehicle is affected by a red traffic light
         max_tlight_distance = self._base_tlight_threshold + 0.3 * vehicle_speed
-        affected_by_tlight, _ = self._affected_by_traffic_light(lights_list, max_tlight_distance)
+        # Without a list, all the traffic lights of the scene are retrieved, only when the check runs
+        affected_by_tlight, _ = self._scheduler.run(
+            'traffic_lights', self._affected_by_traffic_light, None, max_tlight_distance)
         if affected_by_tlight:
             hazard_speed = 0
             hazard_detected = True
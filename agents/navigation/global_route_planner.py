@@ -8,20 +8,55 @@
 This module provides GlobalRoutePlanner implementation.
 """
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import math
+import multiprocessing
+import os
+import pickle
+import threading
 import numpy as np
 import networkx as nx
 
 import carla
+from agents.navigation.compact_graph import CompactGraph
+from agents.navigation.lane_index import LaneIndex
 from agents.navigation.local_planner import RoadOption
 from agents.tools.misc import vector
 
+# Bump whenever the layout of the cached graph changes
+GRAPH_CACHE_VERSION = 4
+
+
 class GlobalRoutePlanner(object):
     """
     This class provides a very high level route plan.
     """
 
-    def __init__(self, wmap, sampling_resolution):
+    def __init__(self, wmap, sampling_resolution, opt_dict={}):
+        """
+        :param wmap: carla.Map instance (or any object with the same interface, such as
+            a carla.Map built locally from its OpenDRIVE content)
+        :param sampling_resolution: distance between the waypoints of the graph edges
+        :param opt_dict: dictionary of arguments with different parameters:
+            graph_cache_dir: directory where the built graph is stored and reused between runs.
+                The cache is disabled by default
+            routing_engine: 'networkx' (default) to search the networkx graph, 'compact' to
+                search an array based copy of it, which is faster and returns the same routes,
+                or 'alt' to search it with precomputed landmark distances (see CompactGraph.alt).
+                ALT queries expand a small part of the graph and always return a shortest route,
+                which might differ from the one found with the default distance heuristic
+            num_landmarks: number of landmarks used by the 'alt' engine
+            route_cache_size: maximum number of routes kept in memory, keyed by their start and
+                end edges, so that repeated queries between the same roads skip the search and
+                most of the waypoint expansion. Disabled (0) by default
+            build_workers: number of threads used to sample the topology and to find the
+                lane changes when the graph is built. The graph is the same for any number of
+                workers. Defaults to 1, building it serially
+            use_lane_index: if True, the origin and destination of the routes are localized with
+                a LaneIndex of the map instead of querying the map each time (see get_lane_index)
+        """
         self._sampling_resolution = sampling_resolution
         self._wmap = wmap
         self._topology = None
@@ -29,57 +64,472 @@ class GlobalRoutePlanner(object):
         self._id_map = None
         self._road_id_to_edge = None
 
-        self._intersection_end_node = -1
-        self._previous_decision = RoadOption.VOID
+        self._turn_decisions = None
+
+        self._graph_cache_dir = None
+        self._routing_engine = 'networkx'
+        self._num_landmarks = 8
+        self._compact_graph = None
+        self._route_cache = OrderedDict()
+        self._route_cache_size = 0
+        self._route_cache_hits = 0
+        self._route_cache_misses = 0
+        self._route_cache_evictions = 0
+        self._route_cache_invalidations = 0
+        self._route_cache_lock = threading.Lock()
+        self._build_workers = 1
+        self._use_lane_index = False
+        self._lane_index = None
+        self._lane_index_file = None
+        self._lane_index_lock = threading.Lock()
+        if 'graph_cache_dir' in opt_dict:
+            self._graph_cache_dir = opt_dict['graph_cache_dir']
+        if 'num_landmarks' in opt_dict:
+            self._num_landmarks = opt_dict['num_landmarks']
+        if 'route_cache_size' in opt_dict:
+            self._route_cache_size = opt_dict['route_cache_size']
+        if 'build_workers' in opt_dict:
+            self._build_workers = opt_dict['build_workers']
+        if 'use_lane_index' in opt_dict:
+            self._use_lane_index = opt_dict['use_lane_index']
+        if 'routing_engine' in opt_dict:
+            if opt_dict['routing_engine'] in ('networkx', 'compact', 'alt'):
+                self._routing_engine = opt_dict['routing_engine']
+            else:
+                print("Warning: Ignoring the unknown routing engine '{}'".format(opt_dict['routing_engine']))
+
+        # Build the graph, unless an up to date one is already cached
+        cache_file, cache_key = None, None
+        if self._graph_cache_dir:
+            cache_file, cache_key = self._graph_cache_entry()
+
+        if not cache_file or not self._load_graph_cache(cache_file, cache_key):
+            self._build_topology()
+            self._build_graph()
+            self._find_loose_ends()
+            self._lane_change_link()
+            self._compact_paths()
+            self._build_turn_decisions()
 
-        # Build the graph
-        self._build_topology()
-        self._build_graph()
-        self._find_loose_ends()
-        self._lane_change_link()
+            if cache_file:
+                self._save_graph_cache(cache_file, cache_key)
+
+        if self._routing_engine in ('compact', 'alt'):
+            self._compact_graph = CompactGraph(self._graph)
+        if self._routing_engine == 'alt':
+            landmarks_file = None
+            if cache_file:
+                landmarks_file = '{}_alt{}.npz'.format(os.path.splitext(cache_file)[0], self._num_landmarks)
+            if not landmarks_file or not self._load_landmarks(landmarks_file):
+                self._compact_graph.build_landmarks(self._num_landmarks)
+                if landmarks_file:
+                    self._save_landmarks(landmarks_file)
+
+        if cache_file:
+            self._lane_index_file = '{}_lanes.npz'.format(os.path.splitext(cache_file)[0])
+        if self._use_lane_index:
+            self.get_lane_index()
+
+    def get_lane_index(self):
+        """
+        Returns the LaneIndex of the map, creating it the first time. It is stored
+        next to the cached graph, and can be shared with the agents using this planner
+        """
+        if self._lane_index is None:
+            with self._lane_index_lock:
+                if self._lane_index is None:
+                    self._lane_index = LaneIndex(self._wmap, cache_file=self._lane_index_file)
+        return self._lane_index
 
     def trace_route(self, origin, destination):
         """
         This method returns list of (carla.Waypoint, RoadOption)
-        from origin to destination
+        from origin to destination. It only reads the graph and the precomputed
+        turn decisions, so one planner can trace routes from several threads
+        """
+        current_waypoint = self._get_waypoint(origin)
+        destination_waypoint = self._get_waypoint(destination)
+        start = self._waypoint_edge(current_waypoint)
+        end = self._waypoint_edge(destination_waypoint)
+
+        # The route between two edges, and its waypoints except for the ones of the first and
+        # last edges, only depend on the edges themselves, so they can be reused between queries
+        cached_route = self._get_cached_route(start, end)
+        if cached_route is None:
+            cached_route = self._new_cached_route(self._path_search(start, end))
+            self._add_cached_route(start, end, cached_route)
+
+        return self._expand_route(cached_route, current_waypoint, destination, destination_waypoint)
+
+    def trace_route_lazy(self, origin, destination):
+        """
+        Lazy version of trace_route. The route is searched at once, but its waypoints are only
+        created as they are consumed, one edge at a time, so that long routes can be followed
+        without expanding them first. It can be given to LocalPlanner.set_global_plan.
+
+            :param origin: carla.Location of the start of the route
+            :param destination: carla.Location of the end of the route
+            :return: LazyRoute, an iterator of (carla.Waypoint, RoadOption)
+        """
+        current_waypoint = self._get_waypoint(origin)
+        destination_waypoint = self._get_waypoint(destination)
+        start = self._waypoint_edge(current_waypoint)
+        end = self._waypoint_edge(destination_waypoint)
+
+        cached_route = self._get_cached_route(start, end)
+        if cached_route is None:
+            cached_route = self._new_cached_route(self._path_search(start, end))
+            self._add_cached_route(start, end, cached_route)
+
+        # The inner waypoints are only reused, as storing them would keep the whole route in memory
+        chunks = self._iter_route(cached_route, current_waypoint, destination, destination_waypoint, store_body=False)
+        return LazyRoute(cached_route['route'], cached_route['road_options'], chunks)
+
+    def trace_repairable_route(self, origin, destination):
+        """
+        Version of trace_route for destinations that keep moving, such as another vehicle.
+        The returned RepairableRoute has the same waypoints as trace_route, and its destination
+        can then be moved with RepairableRoute.repair, which only updates the end of the route.
+
+            :param origin: carla.Location of the start of the route
+            :param destination: carla.Location of the end of the route
+            :return: RepairableRoute
+        """
+        return RepairableRoute(self, self._get_waypoint(origin), destination)
+
+    def trace_alternatives(self, origin, destination, k=3, max_overlap=0.5):
+        """
+        Returns up to k distinct routes from origin to destination, shortest first, for example
+        to have fallback routes when a lane is blocked. After each search, the edges of the route
+        found are made more expensive and the search is repeated, keeping the routes that share
+        at most 'max_overlap' of their length with each of the ones already kept.
+
+            :param origin: carla.Location of the start of the routes
+            :param destination: carla.Location of the end of the routes
+            :param k: maximum number of routes
+            :param max_overlap: maximum fraction of the length of a route shared with another one
+            :return: list of routes, each one a list of (carla.Waypoint, RoadOption) as returned by trace_route
+        """
+        current_waypoint = self._get_waypoint(origin)
+        destination_waypoint = self._get_waypoint(destination)
+        start = self._waypoint_edge(current_waypoint)
+        end = self._waypoint_edge(destination_waypoint)
+
+        routes = self._get_compact_graph().alternatives(
+            start[0], end[0], k, max_overlap, use_landmarks=self._routing_engine == 'alt')
+
+        return [self._expand_route(self._new_cached_route(route + [end[1]]), current_waypoint, destination, destination_waypoint)
+                for route in routes]
+
+    def trace_routes(self, pairs, processes=None):
+        """
+        Batch version of trace_route. The graph searches are spread over a pool of worker processes,
+        which receive a copy of the graph once, when they start. The waypoints are then generated
+        in this process, as carla.Waypoint objects can't be shared between processes.
+
+            :param pairs: list of (origin, destination) carla.Location pairs
+            :param processes: number of worker processes. Defaults to the number of CPUs,
+                and 0 or 1 run all the searches in this process
+            :return: list with the route of each pair, in the same order, as returned by trace_route.
+                Pairs that can't be localized or connected get None instead
+        """
+        queries = []
+        searches = {}
+        for origin, destination in pairs:
+            current_waypoint = self._get_waypoint(origin)
+            destination_waypoint = self._get_waypoint(destination)
+            start = self._waypoint_edge(current_waypoint)
+            end = self._waypoint_edge(destination_waypoint)
+
+            cached_route = None
+            if start is not None and end is not None:
+                cached_route = self._get_cached_route(start, end)
+                if cached_route is None:
+                    searches[(start[0], end[0])] = None
+            queries.append((current_waypoint, destination, destination_waypoint, start, end, cached_route))
+
+        if searches:
+            tasks = list(searches)
+            for task, route in zip(tasks, self._search_routes(tasks, processes)):
+                searches[task] = route
+
+        route_traces = []
+        for current_waypoint, destination, destination_waypoint, start, end, cached_route in queries:
+            if cached_route is None and start is not None and end is not None:
+                route = searches[(start[0], end[0])]
+                if route is not None:
+                    cached_route = self._new_cached_route(route + [end[1]])
+                    self._add_cached_route(start, end, cached_route)
+            if cached_route is None:
+                route_traces.append(None)
+            else:
+                route_traces.append(self._expand_route(cached_route, current_waypoint, destination, destination_waypoint))
+
+        return route_traces
+
+    def _search_routes(self, tasks, processes=None):
+        """
+        Runs the graph searches of a list of (source node, target node) tasks, in a process pool
+        if possible, returning the list of node routes (None if there is no route) in the same order
+        """
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, len(tasks))
+
+        compact_graph = self._get_compact_graph()
+        use_alt = self._routing_engine == 'alt'
+
+        if processes > 1:
+            chunksize = max(1, len(tasks) // (4 * processes))
+            try:
+                with multiprocessing.Pool(processes, _init_search_worker, (compact_graph, use_alt)) as pool:
+                    return pool.map(_search_worker, tasks, chunksize)
+            except (OSError, ValueError, ImportError) as error:
+                print("Warning: Running the route searches serially, the process pool failed: {}".format(error))
+
+        _init_search_worker(compact_graph, use_alt)
+        try:
+            return [_search_worker(task) for task in tasks]
+        finally:
+            _init_search_worker(None, False)
+
+    def _new_cached_route(self, route):
+        """Returns the data stored in the route cache for the given node route"""
+        return {'route': route, 'road_options': self._route_road_options(route)[0], 'body': None, 'edges': None}
+
+    def _expand_route(self, cached_route, current_waypoint, destination, destination_waypoint):
+        """
+        Returns the list of (carla.Waypoint, RoadOption) of a route, reusing the
+        waypoints of its inner edges if they were already expanded
         """
         route_trace = []
-        route = self._path_search(origin, destination)
-        current_waypoint = self._wmap.get_waypoint(origin)
-        destination_waypoint = self._wmap.get_waypoint(destination)
+        for chunk in self._iter_route(cached_route, current_waypoint, destination, destination_waypoint):
+            route_trace.extend(chunk)
+        return route_trace
 
-        for i in range(len(route) - 1):
-            road_option = self._turn_decision(i, route)
-            edge = self._graph.edges[route[i], route[i+1]]
-            path = []
+    def _iter_route(self, cached_route, current_waypoint, destination, destination_waypoint, store_body=True):
+        """
+        Generator of the (carla.Waypoint, RoadOption) pairs of a route, as one list per edge.
+        The waypoints of the inner edges are taken from the cache when possible, and stored in
+        it once they are all expanded if 'store_body' is True
+        """
+        route, road_options = cached_route['route'], cached_route['road_options']
 
-            if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
-                route_trace.append((current_waypoint, road_option))
-                exit_wp = edge['exit_waypoint']
-                n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
-                next_edge = self._graph.edges[n1, n2]
-                if next_edge['path']:
-                    closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
-                    closest_index = min(len(next_edge['path'])-1, closest_index+5)
-                    current_waypoint = next_edge['path'][closest_index]
+        chunk = []
+        last_index = len(route) - 2
+        current_waypoint = self._expand_route_edge(
+            0, route, road_options[0], current_waypoint, destination, destination_waypoint, chunk)
+        yield chunk
+
+        if last_index > 0:
+            if last_index > 1:
+                # The body is stored as a single (seed, waypoints, last waypoint) tuple,
+                # so that concurrent queries never see a partially updated one
+                cached_body = cached_route['body']
+                if cached_body is not None and cached_body[0] == _waypoint_key(current_waypoint):
+                    yield cached_body[1]
+                    current_waypoint = cached_body[2]
                 else:
-                    current_waypoint = next_edge['exit_waypoint']
-                route_trace.append((current_waypoint, road_option))
+                    seed, body = _waypoint_key(current_waypoint), []
+                    for i in range(1, last_index):
+                        chunk = []
+                        current_waypoint = self._expand_route_edge(
+                            i, route, road_options[i], current_waypoint, destination, destination_waypoint, chunk)
+                        if store_body:
+                            body.extend(chunk)
+                        yield chunk
+                    if store_body:
+                        cached_route['body'] = (seed, body, current_waypoint)
+
+            chunk = []
+            self._expand_route_edge(
+                last_index, route, road_options[last_index], current_waypoint, destination, destination_waypoint, chunk)
+            yield chunk
+
+    def get_route_cache_stats(self):
+        """
+        Returns a dictionary with the number of hits, misses, evictions and invalidations
+        of the route cache, as well as its current and maximum size
+        """
+        with self._route_cache_lock:
+            return {
+                'hits': self._route_cache_hits,
+                'misses': self._route_cache_misses,
+                'evictions': self._route_cache_evictions,
+                'invalidations': self._route_cache_invalidations,
+                'size': len(self._route_cache),
+                'max_size': self._route_cache_size,
+            }
+
+    def clear_route_cache(self):
+        """Empties the route cache. The statistics are kept"""
+        with self._route_cache_lock:
+            self._route_cache.clear()
+
+    def get_edge_indices(self, lanes):
+        """
+        Returns the positions of the edges of some lanes in the cost multipliers of the graph,
+        to be used with set_edge_cost_multipliers. As they don't change, they can be computed once
+        and reused for each update.
 
+            :param lanes: list of (road_id, section_id, lane_id)
+            :return: array with the position of the edge of each lane, -1 if it isn't part of the graph
+        """
+        compact_graph = self._get_compact_graph()
+        edge_indices = np.full(len(lanes), -1, dtype=np.int64)
+        for i, (road_id, section_id, lane_id) in enumerate(lanes):
+            try:
+                n1, n2 = self._road_id_to_edge[road_id][section_id][lane_id]
+            except KeyError:
+                continue
+            edge_indices[i] = compact_graph.edge_index(n1, n2)
+        return edge_indices
+
+    def set_edge_cost_multipliers(self, edge_indices, multipliers):
+        """
+        Updates the cost multipliers of some edges, for example according to the traffic density
+        of their lanes. The routes are searched with the costs of the edges multiplied by them
+        (multipliers below 1 count as 1). With the 'networkx' engine, the searches then use the
+        array based copy of the graph, which returns the same routes.
+
+        Only the cached routes that may change are dropped: the ones going through an edge that
+        got more expensive or, if any edge got cheaper, all of them, as that can shorten any route.
+
+            :param edge_indices: array with the positions of the edges, see get_edge_indices.
+                Negative positions are ignored
+            :param multipliers: array with the multiplier of each edge, or a single multiplier for all of them
+        """
+        edge_indices = np.asarray(edge_indices, dtype=np.int64)
+        multipliers = np.broadcast_to(np.asarray(multipliers, dtype=np.float32), edge_indices.shape)
+        valid = edge_indices >= 0
+        if not valid.all():
+            edge_indices, multipliers = edge_indices[valid], multipliers[valid]
+
+        compact_graph = self._get_compact_graph()
+        increased, decreased = compact_graph.set_cost_multipliers(edge_indices, multipliers)
+        if decreased.any():
+            self._invalidate_cached_routes(None)
+        elif increased.any():
+            changed = np.zeros(len(compact_graph.multipliers), dtype=bool)
+            changed[edge_indices[increased]] = True
+            self._invalidate_cached_routes(changed)
+
+    def reset_edge_cost_multipliers(self):
+        """Sets the cost multipliers of all the edges back to 1"""
+        if self._compact_graph is not None and (self._compact_graph.multipliers != 1.0).any():
+            self._compact_graph.reset_cost_multipliers()
+            self._invalidate_cached_routes(None)
+
+    def _get_compact_graph(self):
+        """Returns the array based copy of the graph, creating it the first time"""
+        if self._compact_graph is None:
+            with self._route_cache_lock:
+                if self._compact_graph is None:
+                    self._compact_graph = CompactGraph(self._graph)
+        return self._compact_graph
+
+    def _invalidate_cached_routes(self, changed):
+        """
+        Drops the cached routes going through the edges marked in the boolean array 'changed',
+        or all of them if it is None
+        """
+        with self._route_cache_lock:
+            self._drop_cached_routes(changed)
+
+    def _drop_cached_routes(self, changed):
+        """Implementation of _invalidate_cached_routes, called with the route cache lock held"""
+        if changed is None:
+            self._route_cache_invalidations += len(self._route_cache)
+            self._route_cache.clear()
+            return
+        if not self._route_cache:
+            return
+
+        keys = list(self._route_cache)
+        route_edges = []
+        for key in keys:
+            cached_route = self._route_cache[key]
+            if cached_route['edges'] is None:
+                route = cached_route['route']
+                cached_route['edges'] = np.array(
+                    [self._compact_graph.edge_index(n1, n2) for n1, n2 in zip(route[:-1], route[1:])], dtype=np.int64)
+            route_edges.append(cached_route['edges'])
+
+        owners = np.repeat(np.arange(len(keys)), [len(edges) for edges in route_edges])
+        for i in np.unique(owners[changed[np.concatenate(route_edges)]]):
+            del self._route_cache[keys[i]]
+            self._route_cache_invalidations += 1
+
+    def _get_cached_route(self, start, end):
+        """Returns the cached route between the two edges, or None if it isn't cached"""
+        if self._route_cache_size <= 0:
+            return None
+        with self._route_cache_lock:
+            cached_route = self._route_cache.get((start, end))
+            if cached_route is None:
+                self._route_cache_misses += 1
+                return None
+            self._route_cache_hits += 1
+            self._route_cache.move_to_end((start, end))
+            return cached_route
+
+    def _add_cached_route(self, start, end, cached_route):
+        """Adds a route to the cache, evicting the least recently used one if it is full"""
+        if self._route_cache_size <= 0:
+            return
+        with self._route_cache_lock:
+            self._route_cache[(start, end)] = cached_route
+            if len(self._route_cache) > self._route_cache_size:
+                self._route_cache.popitem(last=False)
+                self._route_cache_evictions += 1
+
+    def _expand_route_edge(self, index, route, road_option, current_waypoint, destination, destination_waypoint, route_trace):
+        """
+        Appends to 'route_trace' the (carla.Waypoint, RoadOption) pairs of the edge starting
+        at the given index of the route, and returns the last waypoint added.
+        Only the last edge of the route depends on the destination.
+        """
+        edge = self._graph.edges[route[index], route[index+1]]
+
+        if edge['type'] != RoadOption.LANEFOLLOW and edge['type'] != RoadOption.VOID:
+            route_trace.append((current_waypoint, road_option))
+            exit_wp = edge['exit_waypoint']
+            n1, n2 = self._road_id_to_edge[exit_wp.road_id][exit_wp.section_id][exit_wp.lane_id]
+            next_edge = self._graph.edges[n1, n2]
+            if next_edge['path']:
+                closest_index = self._find_closest_in_list(current_waypoint, next_edge['path'])
+                closest_index = min(len(next_edge['path'])-1, closest_index+5)
+                current_waypoint = next_edge['path'][closest_index]
             else:
-                path = path + [edge['entry_waypoint']] + edge['path'] + [edge['exit_waypoint']]
-                closest_index = self._find_closest_in_list(current_waypoint, path)
-                for waypoint in path[closest_index:]:
-                    current_waypoint = waypoint
-                    route_trace.append((current_waypoint, road_option))
-                    if len(route)-i <= 2 and waypoint.transform.location.distance(destination) < 2*self._sampling_resolution:
+                current_waypoint = next_edge['exit_waypoint']
+            route_trace.append((current_waypoint, road_option))
+
+        else:
+            # The path goes from the entry waypoint, through the sampled ones, to the exit waypoint.
+            # Only the waypoints added to the route are created
+            path = edge['path']
+            locations = np.vstack((
+                _waypoint_location(edge['entry_waypoint']), path.locations, _waypoint_location(edge['exit_waypoint'])))
+            closest_index = _closest_location(locations, current_waypoint)
+            destination_index = None
+            for i in range(closest_index, len(locations)):
+                if i == 0:
+                    waypoint = edge['entry_waypoint']
+                elif i == len(locations) - 1:
+                    waypoint = edge['exit_waypoint']
+                else:
+                    waypoint = path[i - 1]
+                current_waypoint = waypoint
+                route_trace.append((current_waypoint, road_option))
+                if len(route)-index <= 2 and waypoint.transform.location.distance(destination) < 2*self._sampling_resolution:
+                    break
+                elif len(route)-index <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
+                    if destination_index is None:
+                        destination_index = _closest_location(locations, destination_waypoint)
+                    if closest_index > destination_index:
                         break
-                    elif len(route)-i <= 2 and current_waypoint.road_id == destination_waypoint.road_id and current_waypoint.section_id == destination_waypoint.section_id and current_waypoint.lane_id == destination_waypoint.lane_id:
-                        destination_index = self._find_closest_in_list(destination_waypoint, path)
-                        if closest_index > destination_index:
-                            break
 
-        return route_trace
+        return current_waypoint
 
     def _build_topology(self):
         """
@@ -95,31 +545,59 @@ class GlobalRoutePlanner(object):
         """
         self._topology = []
         # Retrieving waypoints to construct a detailed topology
-        for segment in self._wmap.get_topology():
-            wp1, wp2 = segment[0], segment[1]
-            l1, l2 = wp1.transform.location, wp2.transform.location
-            # Rounding off to avoid floating point imprecision
-            x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
-            wp1.transform.location, wp2.transform.location = l1, l2
-            seg_dict = dict()
-            seg_dict['entry'], seg_dict['exit'] = wp1, wp2
-            seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
-            seg_dict['path'] = []
-            endloc = wp2.transform.location
-            if wp1.transform.location.distance(endloc) > self._sampling_resolution:
-                w = wp1.next(self._sampling_resolution)[0]
-                while w.transform.location.distance(endloc) > self._sampling_resolution:
-                    seg_dict['path'].append(w)
-                    next_ws = w.next(self._sampling_resolution)
-                    if len(next_ws) == 0:
-                        break
-                    w = next_ws[0]
-            else:
-                next_wps = wp1.next(self._sampling_resolution)
-                if len(next_wps) == 0:
-                    continue
-                seg_dict['path'].append(next_wps[0])
-            self._topology.append(seg_dict)
+        for seg_dict in self._map_segments(self._sample_segment, self._wmap.get_topology()):
+            if seg_dict is not None:
+                self._topology.append(seg_dict)
+
+    def _sample_segment(self, segment):
+        """
+        Returns the topology dictionary of a (entry, exit) road segment, sampling
+        the waypoints of its path, or None if the segment has no path
+        """
+        wp1, wp2 = segment[0], segment[1]
+        l1, l2 = wp1.transform.location, wp2.transform.location
+        # Rounding off to avoid floating point imprecision
+        x1, y1, z1, x2, y2, z2 = np.round([l1.x, l1.y, l1.z, l2.x, l2.y, l2.z], 0)
+        wp1.transform.location, wp2.transform.location = l1, l2
+        seg_dict = dict()
+        seg_dict['entry'], seg_dict['exit'] = wp1, wp2
+        seg_dict['entryxyz'], seg_dict['exitxyz'] = (x1, y1, z1), (x2, y2, z2)
+        seg_dict['path'] = []
+        endloc = wp2.transform.location
+        if wp1.transform.location.distance(endloc) > self._sampling_resolution:
+            w = wp1.next(self._sampling_resolution)[0]
+            while w.transform.location.distance(endloc) > self._sampling_resolution:
+                seg_dict['path'].append(w)
+                next_ws = w.next(self._sampling_resolution)
+                if len(next_ws) == 0:
+                    break
+                w = next_ws[0]
+        else:
+            next_wps = wp1.next(self._sampling_resolution)
+            if len(next_wps) == 0:
+                return None
+            seg_dict['path'].append(next_wps[0])
+        return seg_dict
+
+    def _map_segments(self, function, segments):
+        """
+        Returns the list of the results of a function applied to each segment, in order.
+        With several build workers, the segments are split in consecutive chunks that
+        are processed by a thread pool, and the results merged back in the same order
+        """
+        segments = list(segments)
+        num_chunks = min(len(segments), 4 * self._build_workers)
+        if self._build_workers <= 1 or num_chunks <= 1:
+            return [function(segment) for segment in segments]
+
+        def process_chunk(chunk):
+            return [function(segment) for segment in chunk]
+
+        chunk_size = int(math.ceil(len(segments) / num_chunks))
+        chunks = [segments[i:i + chunk_size] for i in range(0, len(segments), chunk_size)]
+        with ThreadPoolExecutor(max_workers=self._build_workers) as executor:
+            results = list(executor.map(process_chunk, chunks))
+        return [result for chunk_results in results for result in chunk_results]
 
     def _build_graph(self):
         """
@@ -173,7 +651,7 @@ class GlobalRoutePlanner(object):
                     [entry_carla_vector.x, entry_carla_vector.y, entry_carla_vector.z]),
                 exit_vector=np.array(
                     [exit_carla_vector.x, exit_carla_vector.y, exit_carla_vector.z]),
-                net_vector=vector(entry_wp.transform.location, exit_wp.transform.location),
+                net_vector=np.array(vector(entry_wp.transform.location, exit_wp.transform.location)),
                 intersection=intersection, type=RoadOption.LANEFOLLOW)
 
     def _find_loose_ends(self):
@@ -226,48 +704,94 @@ class GlobalRoutePlanner(object):
         representing availability of lane changes.
         """
 
+        # The links of each segment only depend on the graph built so far,
+        # so they are found independently and added in the order of the topology
+        for links in self._map_segments(self._find_lane_change_links, self._topology):
+            for n1, n2, attributes in links:
+                self._graph.add_edge(n1, n2, **attributes)
+
+    def _find_lane_change_links(self, segment):
+        """
+        Returns the list of (n1, n2, attributes) lane change edges starting at a segment,
+        at most one to the left and one to the right lane, without modifying the graph
+        """
+        links = []
+        left_found, right_found = False, False
+
+        for waypoint in segment['path']:
+            if not segment['entry'].is_junction:
+                next_waypoint, next_road_option, next_segment = None, None, None
+
+                if waypoint.right_lane_marking and waypoint.right_lane_marking.lane_change & carla.LaneChange.Right and not right_found:
+                    next_waypoint = waypoint.get_right_lane()
+                    if next_waypoint is not None \
+                            and next_waypoint.lane_type == carla.LaneType.Driving \
+                            and waypoint.road_id == next_waypoint.road_id:
+                        next_road_option = RoadOption.CHANGELANERIGHT
+                        next_segment = self._localize(next_waypoint.transform.location)
+                        if next_segment is not None:
+                            links.append((self._id_map[segment['entryxyz']], next_segment[0], dict(
+                                entry_waypoint=waypoint, exit_waypoint=next_waypoint, intersection=False,
+                                exit_vector=None, path=[], length=0, type=next_road_option,
+                                change_waypoint=next_waypoint)))
+                            right_found = True
+                if waypoint.left_lane_marking and waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
+                    next_waypoint = waypoint.get_left_lane()
+                    if next_waypoint is not None \
+                            and next_waypoint.lane_type == carla.LaneType.Driving \
+                            and waypoint.road_id == next_waypoint.road_id:
+                        next_road_option = RoadOption.CHANGELANELEFT
+                        next_segment = self._localize(next_waypoint.transform.location)
+                        if next_segment is not None:
+                            links.append((self._id_map[segment['entryxyz']], next_segment[0], dict(
+                                entry_waypoint=waypoint, exit_waypoint=next_waypoint, intersection=False,
+                                exit_vector=None, path=[], length=0, type=next_road_option,
+                                change_waypoint=next_waypoint)))
+                            left_found = True
+            if left_found and right_found:
+                break
+
+        return links
+
+    def _compact_paths(self):
+        """
+        Replaces the lists of waypoints of the topology segments and graph edges by SegmentPaths,
+        which store their geometry in arrays and only create the waypoints when they are used
+        """
+        paths = {}
+        def compact(waypoints):
+            if id(waypoints) not in paths:
+                paths[id(waypoints)] = (waypoints, SegmentPath.from_waypoints(self._wmap, waypoints))
+            return paths[id(waypoints)][1]
+
         for segment in self._topology:
-            left_found, right_found = False, False
-
-            for waypoint in segment['path']:
-                if not segment['entry'].is_junction:
-                    next_waypoint, next_road_option, next_segment = None, None, None
-
-                    if waypoint.right_lane_marking and waypoint.right_lane_marking.lane_change & carla.LaneChange.Right and not right_found:
-                        next_waypoint = waypoint.get_right_lane()
-                        if next_waypoint is not None \
-                                and next_waypoint.lane_type == carla.LaneType.Driving \
-                                and waypoint.road_id == next_waypoint.road_id:
-                            next_road_option = RoadOption.CHANGELANERIGHT
-                            next_segment = self._localize(next_waypoint.transform.location)
-                            if next_segment is not None:
-                                self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
-                                right_found = True
-                    if waypoint.left_lane_marking and waypoint.left_lane_marking.lane_change & carla.LaneChange.Left and not left_found:
-                        next_waypoint = waypoint.get_left_lane()
-                        if next_waypoint is not None \
-                                and next_waypoint.lane_type == carla.LaneType.Driving \
-                                and waypoint.road_id == next_waypoint.road_id:
-                            next_road_option = RoadOption.CHANGELANELEFT
-                            next_segment = self._localize(next_waypoint.transform.location)
-                            if next_segment is not None:
-                                self._graph.add_edge(
-                                    self._id_map[segment['entryxyz']], next_segment[0], entry_waypoint=waypoint,
-                                    exit_waypoint=next_waypoint, intersection=False, exit_vector=None,
-                                    path=[], length=0, type=next_road_option, change_waypoint=next_waypoint)
-                                left_found = True
-                if left_found and right_found:
-                    break
+            segment['path'] = compact(segment['path'])
+        for _, _, attributes in self._graph.edges(data=True):
+            attributes['path'] = compact(attributes['path'])
 
     def _localize(self, location):
         """
         This function finds the road segment that a given location
         is part of, returning the edge it belongs to
         """
-        waypoint = self._wmap.get_waypoint(location)
+        return self._waypoint_edge(self._get_waypoint(location))
+
+    def _get_waypoint(self, location):
+        """
+        Returns the waypoint of the lane closest to a location. Once the graph is
+        built, the lane index is used instead of the map if it is enabled
+        """
+        if self._use_lane_index and self._lane_index is not None:
+            waypoint = self._lane_index.get_waypoint(location)
+            if waypoint is not None:
+                return waypoint
+        return self._wmap.get_waypoint(location)
+
+    def _waypoint_edge(self, waypoint):
+        """
+        This function returns the edge of the graph that
+        a given waypoint is part of, or None if there is none
+        """
         edge = None
         try:
             edge = self._road_id_to_edge[waypoint.road_id][waypoint.section_id][waypoint.lane_id]
@@ -284,23 +808,63 @@ class GlobalRoutePlanner(object):
         l2 = np.array(self._graph.nodes[n2]['vertex'])
         return np.linalg.norm(l1-l2)
 
-    def _path_search(self, origin, destination):
+    def _path_search(self, start, end):
         """
-        This function finds the shortest path connecting origin and destination
+        This function finds the shortest path connecting the origin and destination edges
         using A* search with distance heuristic.
-        origin      :   carla.Location object of start position
-        destination :   carla.Location object of of end position
+        start       :   edge (pair of node ids) of the start position, see _localize
+        end         :   edge (pair of node ids) of the end position
         return      :   path as list of node ids (as int) of the graph self._graph
         connecting origin and destination
         """
-        start, end = self._localize(origin), self._localize(destination)
-
-        route = nx.astar_path(
-            self._graph, source=start[0], target=end[0],
-            heuristic=self._distance_heuristic, weight='length')
+        if self._routing_engine == 'alt':
+            route = self._compact_graph.alt(start[0], end[0])
+        elif self._compact_graph is not None:
+            route = self._compact_graph.astar(start[0], end[0])
+        else:
+            route = nx.astar_path(
+                self._graph, source=start[0], target=end[0],
+                heuristic=self._distance_heuristic, weight='length')
         route.append(end[1])
         return route
 
+    def _build_turn_decisions(self):
+        """
+        Computes the turn decision of every way of entering an intersection: from a lane, through
+        an intersection edge, to the last edge of the chain of intersection edges that follows it.
+        Routes only look them up, so tracing them doesn't modify the planner
+        """
+        self._turn_decisions = {}
+        for current_node, next_node, next_edge in self._graph.edges(data=True):
+            if next_edge['type'] != RoadOption.LANEFOLLOW or not next_edge['intersection']:
+                continue
+            previous_nodes = []
+            for previous_node in self._graph.predecessors(current_node):
+                current_edge = self._graph.edges[previous_node, current_node]
+                if current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge['intersection']:
+                    previous_nodes.append(previous_node)
+
+            for tail in self._intersection_tails(current_node, next_node) if previous_nodes else []:
+                for previous_node in previous_nodes:
+                    self._turn_decisions[(previous_node, current_node, next_node) + tail] = \
+                        self._compute_turn_decision(previous_node, current_node, next_node, tail)
+
+    def _intersection_tails(self, node1, node2):
+        """
+        Returns the edges that can end the chain of successive intersection
+        edges starting with the intersection edge (node1, node2)
+        """
+        tails = []
+        stack = [((node1, node2), {node1, node2})]
+        while stack:
+            tail, visited = stack.pop()
+            tails.append(tail)
+            for neighbor in self._graph.successors(tail[1]):
+                edge = self._graph.edges[tail[1], neighbor]
+                if neighbor not in visited and edge['type'] == RoadOption.LANEFOLLOW and edge['intersection']:
+                    stack.append(((tail[1], neighbor), visited | {neighbor}))
+        return tails
+
     def _successive_last_intersection_edge(self, index, route):
         """
         This method returns the last successive intersection edge
@@ -308,91 +872,580 @@ class GlobalRoutePlanner(object):
         This helps moving past tiny intersection edges to calculate
         proper turn decisions.
         """
-
-        last_intersection_edge = None
-        last_node = None
-        for node1, node2 in [(route[i], route[i+1]) for i in range(index, len(route)-1)]:
-            candidate_edge = self._graph.edges[node1, node2]
-            if node1 == route[index]:
-                last_intersection_edge = candidate_edge
+        last_intersection_edge = (route[index], route[index+1])
+        for i in range(index + 1, len(route) - 1):
+            candidate_edge = self._graph.edges[route[i], route[i+1]]
             if candidate_edge['type'] == RoadOption.LANEFOLLOW and candidate_edge['intersection']:
-                last_intersection_edge = candidate_edge
-                last_node = node2
+                last_intersection_edge = (route[i], route[i+1])
             else:
                 break
 
-        return last_node, last_intersection_edge
+        return last_intersection_edge
+
+    def _route_road_options(self, route, start=0, state=(RoadOption.VOID, -1)):
+        """
+        This method returns the turn decision (RoadOption) of each edge of the route from
+        the 'start' index, along with the (previous decision, intersection end node) state
+        after each edge, from which the decisions of the next edges can be computed again.
+        The decisions at the intersections are taken from the table of _build_turn_decisions
+        """
+        road_options = []
+        states = []
+        previous_decision, intersection_end_node = state
+        for index in range(start, len(route) - 1):
+            current_node = route[index]
+            next_node = route[index+1]
+            next_edge = self._graph.edges[current_node, next_node]
+            decision, remember = next_edge['type'], True
+            if index > 0:
+                previous_node = route[index-1]
+                if previous_decision != RoadOption.VOID \
+                        and intersection_end_node > 0 \
+                        and intersection_end_node != previous_node \
+                        and next_edge['type'] == RoadOption.LANEFOLLOW \
+                        and next_edge['intersection']:
+                    decision = previous_decision
+                else:
+                    intersection_end_node = -1
+                    current_edge = self._graph.edges[previous_node, current_node]
+                    calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
+                        'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
+                    if calculate_turn:
+                        tail = self._successive_last_intersection_edge(index, route)
+                        intersection_end_node = tail[1]
+                        turn = self._turn_decisions.get((previous_node, current_node, next_node) + tail)
+                        if turn is None:
+                            turn = self._compute_turn_decision(previous_node, current_node, next_node, tail)
+                        decision, remember = turn
+
+            # Decisions that couldn't be computed don't carry over to the next edges
+            if remember:
+                previous_decision = decision
+            road_options.append(decision)
+            states.append((previous_decision, intersection_end_node))
 
-    def _turn_decision(self, index, route, threshold=math.radians(35)):
+        return road_options, states
+
+    def _compute_turn_decision(self, previous_node, current_node, next_node, tail, threshold=math.radians(35)):
         """
-        This method returns the turn decision (RoadOption) for pair of edges
-        around current index of route list
+        This method returns the turn decision (RoadOption) when going from the edge
+        (previous_node, current_node) into the intersection through next_node, and leaving
+        it through the 'tail' edge, along with whether the decision could be computed
         """
+        current_edge = self._graph.edges[previous_node, current_node]
+        next_edge = self._graph.edges[tail]
+        cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
+        if cv is None or nv is None:
+            return next_edge['type'], False
 
         decision = None
-        previous_node = route[index-1]
-        current_node = route[index]
-        next_node = route[index+1]
-        next_edge = self._graph.edges[current_node, next_node]
-        if index > 0:
-            if self._previous_decision != RoadOption.VOID \
-                    and self._intersection_end_node > 0 \
-                    and self._intersection_end_node != previous_node \
-                    and next_edge['type'] == RoadOption.LANEFOLLOW \
-                    and next_edge['intersection']:
-                decision = self._previous_decision
-            else:
-                self._intersection_end_node = -1
-                current_edge = self._graph.edges[previous_node, current_node]
-                calculate_turn = current_edge['type'] == RoadOption.LANEFOLLOW and not current_edge[
-                    'intersection'] and next_edge['type'] == RoadOption.LANEFOLLOW and next_edge['intersection']
-                if calculate_turn:
-                    last_node, tail_edge = self._successive_last_intersection_edge(index, route)
-                    self._intersection_end_node = last_node
-                    if tail_edge is not None:
-                        next_edge = tail_edge
-                    cv, nv = current_edge['exit_vector'], next_edge['exit_vector']
-                    if cv is None or nv is None:
-                        return next_edge['type']
-                    cross_list = []
-                    for neighbor in self._graph.successors(current_node):
-                        select_edge = self._graph.edges[current_node, neighbor]
-                        if select_edge['type'] == RoadOption.LANEFOLLOW:
-                            if neighbor != route[index+1]:
-                                sv = select_edge['net_vector']
-                                cross_list.append(np.cross(cv, sv)[2])
-                    next_cross = np.cross(cv, nv)[2]
-                    deviation = math.acos(np.clip(
-                        np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
-                    if not cross_list:
-                        cross_list.append(0)
-                    if deviation < threshold:
-                        decision = RoadOption.STRAIGHT
-                    elif cross_list and next_cross < min(cross_list):
-                        decision = RoadOption.LEFT
-                    elif cross_list and next_cross > max(cross_list):
-                        decision = RoadOption.RIGHT
-                    elif next_cross < 0:
-                        decision = RoadOption.LEFT
-                    elif next_cross > 0:
-                        decision = RoadOption.RIGHT
-                else:
-                    decision = next_edge['type']
+        cross_list = []
+        for neighbor in self._graph.successors(current_node):
+            select_edge = self._graph.edges[current_node, neighbor]
+            if select_edge['type'] == RoadOption.LANEFOLLOW:
+                if neighbor != next_node:
+                    sv = select_edge['net_vector']
+                    cross_list.append(np.cross(cv, sv)[2])
+        next_cross = np.cross(cv, nv)[2]
+        deviation = math.acos(np.clip(
+            np.dot(cv, nv)/(np.linalg.norm(cv)*np.linalg.norm(nv)), -1.0, 1.0))
+        if not cross_list:
+            cross_list.append(0)
+        if deviation < threshold:
+            decision = RoadOption.STRAIGHT
+        elif cross_list and next_cross < min(cross_list):
+            decision = RoadOption.LEFT
+        elif cross_list and next_cross > max(cross_list):
+            decision = RoadOption.RIGHT
+        elif next_cross < 0:
+            decision = RoadOption.LEFT
+        elif next_cross > 0:
+            decision = RoadOption.RIGHT
 
-        else:
-            decision = next_edge['type']
+        return decision, True
+
+    def _graph_cache_entry(self):
+        """
+        Returns the path of the cache file and the key identifying the graph stored in it.
+        The key changes with the map name, its OpenDRIVE content and the sampling resolution.
+        """
+        opendrive_hash = hashlib.sha1(self._wmap.to_opendrive().encode('utf-8')).hexdigest()
+        map_name = self._wmap.name.replace('/', '_').replace('\\', '_')
+        cache_key = (GRAPH_CACHE_VERSION, self._wmap.name, opendrive_hash, float(self._sampling_resolution))
+        file_name = '{}_{:g}_{}.pkl'.format(map_name, self._sampling_resolution, opendrive_hash[:16])
+        return os.path.join(self._graph_cache_dir, file_name), cache_key
+
+    def _load_graph_cache(self, cache_file, cache_key):
+        """
+        Restores the topology and graph from the cache file.
+        Returns False if the file is missing, unreadable or was built for another key.
+        """
+        if not os.path.isfile(cache_file):
+            return False
+        try:
+            with open(cache_file, 'rb') as fd:
+                data = pickle.load(fd)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as error:
+            print("Warning: Ignoring the route planner cache '{}': {}".format(cache_file, error))
+            return False
+        if not isinstance(data, dict) or data.get('key') != cache_key:
+            return False
+
+        waypoints = {}
+        def unpack(packed):
+            if packed not in waypoints:
+                waypoints[packed] = _unpack_waypoint(self._wmap, packed)
+            return waypoints[packed]
+
+        try:
+            self._restore_graph(data, unpack)
+        except RuntimeError as error:
+            print("Warning: Ignoring the route planner cache '{}': {}".format(cache_file, error))
+            return False
+        return True
+
+    def _restore_graph(self, data, unpack):
+        """
+        Rebuilds the topology and graph attributes from the cached data,
+        using 'unpack' to turn the stored identifiers back into waypoints
+        """
+        offsets = data['path_offsets']
+        paths = [SegmentPath(self._wmap, data['path_geometry'][start:end], data['path_lanes'][start:end])
+                 for start, end in zip(offsets[:-1], offsets[1:])]
+
+        self._topology = []
+        for seg in data['topology']:
+            seg_dict = dict(seg)
+            seg_dict['entry'], seg_dict['exit'] = unpack(seg['entry']), unpack(seg['exit'])
+            seg_dict['path'] = paths[seg['path']]
+            self._topology.append(seg_dict)
+
+        self._graph = nx.DiGraph()
+        for node, vertex in data['nodes']:
+            self._graph.add_node(node, vertex=vertex)
+        for n1, n2, attributes in data['edges']:
+            edge = dict(attributes)
+            for key in ('entry_waypoint', 'exit_waypoint', 'change_waypoint'):
+                if key in edge:
+                    edge[key] = unpack(edge[key])
+            for key in ('entry_vector', 'exit_vector', 'net_vector'):
+                if edge.get(key) is not None:
+                    edge[key] = np.array(edge[key])
+            edge['path'] = paths[edge['path']]
+            self._graph.add_edge(n1, n2, **edge)
+
+        self._id_map = data['id_map']
+        self._road_id_to_edge = data['road_id_to_edge']
+        self._turn_decisions = {
+            key: (RoadOption(decision) if decision is not None else None, remember)
+            for key, (decision, remember) in data['turn_decisions'].items()}
+
+    def _save_graph_cache(self, cache_file, cache_key):
+        """
+        Stores the topology and graph in the cache file. Waypoints are saved as their
+        OpenDRIVE identifiers, as carla.Waypoint objects can't be serialized, and the
+        SegmentPaths shared by the segments and the edges are only stored once.
+        """
+        # All the paths are concatenated in two arrays, and referenced by their index
+        paths, path_index = [], {}
+        def pack_path(path):
+            if id(path) not in path_index:
+                path_index[id(path)] = len(paths)
+                paths.append(path)
+            return path_index[id(path)]
+
+        topology = []
+        for seg in self._topology:
+            seg_dict = dict(seg)
+            seg_dict['entry'], seg_dict['exit'] = _pack_waypoint(seg['entry']), _pack_waypoint(seg['exit'])
+            seg_dict['path'] = pack_path(seg['path'])
+            topology.append(seg_dict)
+
+        edges = []
+        for n1, n2, attributes in self._graph.edges(data=True):
+            edge = dict(attributes)
+            for key in ('entry_waypoint', 'exit_waypoint', 'change_waypoint'):
+                if key in edge:
+                    edge[key] = _pack_waypoint(edge[key])
+            for key in ('entry_vector', 'exit_vector', 'net_vector'):
+                if edge.get(key) is not None:
+                    edge[key] = [float(value) for value in edge[key]]
+            edge['path'] = pack_path(edge['path'])
+            edges.append((n1, n2, edge))
+
+        data = {
+            'key': cache_key,
+            'topology': topology,
+            'nodes': list(self._graph.nodes(data='vertex')),
+            'edges': edges,
+            'id_map': self._id_map,
+            'road_id_to_edge': self._road_id_to_edge,
+            'turn_decisions': {
+                key: (int(decision) if decision is not None else None, remember)
+                for key, (decision, remember) in self._turn_decisions.items()},
+            'path_offsets': np.cumsum([0] + [len(path) for path in paths]),
+            'path_geometry': np.concatenate([path.geometry for path in paths] or [np.empty((0, 5), np.float32)]),
+            'path_lanes': np.concatenate([path.lanes for path in paths] or [np.empty((0, 3), np.int32)]),
+        }
 
-        self._previous_decision = decision
-        return decision
+        # Write to a temporary file first so that concurrent runs never read a partial cache
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        try:
+            os.makedirs(self._graph_cache_dir, exist_ok=True)
+            with open(tmp_file, 'wb') as fd:
+                pickle.dump(data, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as error:
+            print("Warning: Unable to write the route planner cache '{}': {}".format(cache_file, error))
+
+    def _load_landmarks(self, landmarks_file):
+        """
+        Restores the landmark tables of the 'alt' engine from the given file.
+        Returns False if the file is missing or doesn't match the current graph.
+        """
+        if not os.path.isfile(landmarks_file):
+            return False
+        try:
+            with np.load(landmarks_file) as data:
+                if int(data['version']) != GRAPH_CACHE_VERSION:
+                    return False
+                self._compact_graph.set_landmarks(data['landmarks'], data['landmark_from'], data['landmark_to'])
+        except (OSError, KeyError, ValueError) as error:
+            print("Warning: Ignoring the route planner landmarks '{}': {}".format(landmarks_file, error))
+            return False
+        return True
+
+    def _save_landmarks(self, landmarks_file):
+        """Stores the landmark tables of the 'alt' engine next to the cached graph"""
+        landmarks, landmark_from, landmark_to = self._compact_graph.get_landmarks()
+        tmp_file = '{}.{}.tmp.npz'.format(landmarks_file, os.getpid())
+        try:
+            os.makedirs(self._graph_cache_dir, exist_ok=True)
+            np.savez(tmp_file, version=GRAPH_CACHE_VERSION, landmarks=landmarks,
+                     landmark_from=landmark_from, landmark_to=landmark_to)
+            os.replace(tmp_file, landmarks_file)
+        except OSError as error:
+            print("Warning: Unable to write the route planner landmarks '{}': {}".format(landmarks_file, error))
 
     def _find_closest_in_list(self, current_waypoint, waypoint_list):
-        min_distance = float('inf')
-        closest_index = -1
-        for i, waypoint in enumerate(waypoint_list):
-            distance = waypoint.transform.location.distance(
-                current_waypoint.transform.location)
-            if distance < min_distance:
-                min_distance = distance
-                closest_index = i
-
-        return closest_index
+        """
+        Returns the index of the waypoint of the list (or SegmentPath)
+        closest to the current waypoint, or -1 if the list is empty
+        """
+        if len(waypoint_list) == 0:
+            return -1
+        if isinstance(waypoint_list, SegmentPath):
+            locations = waypoint_list.locations
+        else:
+            locations = np.array([_waypoint_location(waypoint) for waypoint in waypoint_list])
+        return _closest_location(locations, current_waypoint)
+
+
+def _pack_waypoint(waypoint):
+    """Returns the OpenDRIVE identifiers (road_id, section_id, lane_id, s) of a waypoint"""
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s)
+
+
+def _waypoint_key(waypoint):
+    """Returns the OpenDRIVE identifiers of a waypoint, which identify it regardless of the object"""
+    return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, waypoint.s)
+
+
+def _waypoint_location(waypoint):
+    """Returns the (x, y, z) location of a waypoint"""
+    location = waypoint.transform.location
+    return (location.x, location.y, location.z)
+
+
+def _closest_location(locations, waypoint):
+    """Returns the index of the row of the (N, 3) locations array closest to a waypoint"""
+    offsets = locations - _waypoint_location(waypoint)
+    return int(np.argmin(np.einsum('ij,ij->i', offsets, offsets)))
+
+
+def _unpack_waypoint(wmap, packed):
+    """
+    Returns the waypoint at the given OpenDRIVE identifiers. Waypoints at the very end of a lane,
+    or at the boundary between two lane sections, can't always be queried by their exact s,
+    so they are moved a few millimeters into their lane section.
+    """
+    road_id, section_id, lane_id, s = packed
+    for offset in (0.0, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2):
+        for nudged_s in ((s,) if offset == 0.0 else (s - offset, s + offset)):
+            waypoint = wmap.get_waypoint_xodr(road_id, lane_id, max(nudged_s, 0.0))
+            if waypoint is not None and waypoint.section_id == section_id:
+                return waypoint
+    raise RuntimeError("Unable to find the waypoint at road {}, section {}, lane {}, s {}".format(
+        road_id, section_id, lane_id, s))
+
+
+class SegmentPath(object):
+    """
+    SegmentPath stores the waypoints sampled along a graph edge as a float32 array with
+    their (x, y, z, yaw, s), and the road, section and lane ids needed to find them again.
+    It can be used as a read only list of waypoints, which are created when accessed.
+    """
+
+    def __init__(self, wmap, geometry, lanes):
+        """
+        :param wmap: carla.Map of the waypoints
+        :param geometry: (N, 5) float32 array with the x, y, z, yaw and s of the waypoints
+        :param lanes: (N, 3) int32 array with the road, section and lane ids of the waypoints
+        """
+        self._wmap = wmap
+        self.geometry = geometry
+        self.lanes = lanes
+
+    @staticmethod
+    def from_waypoints(wmap, waypoints):
+        """Returns the SegmentPath of a list of carla.Waypoint"""
+        geometry = np.array(
+            [(wp.transform.location.x, wp.transform.location.y, wp.transform.location.z,
+              wp.transform.rotation.yaw, wp.s) for wp in waypoints],
+            dtype=np.float32).reshape(-1, 5)
+        lanes = np.array([(wp.road_id, wp.section_id, wp.lane_id) for wp in waypoints],
+                         dtype=np.int32).reshape(-1, 3)
+        return SegmentPath(wmap, geometry, lanes)
+
+    @property
+    def locations(self):
+        """(N, 3) array with the locations of the waypoints"""
+        return self.geometry[:, :3]
+
+    def __len__(self):
+        return len(self.geometry)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        road_id, section_id, lane_id = self.lanes[index].tolist()
+        return _unpack_waypoint(self._wmap, (road_id, section_id, lane_id, float(self.geometry[index, 4])))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class RepairableRoute(object):
+    """
+    RepairableRoute is the route returned by GlobalRoutePlanner.trace_repairable_route. It keeps
+    the node route and the waypoints of each of its edges, so that when the destination moves,
+    only the part of the route between the new destination and the closest node of the old
+    route is searched and expanded again.
+    """
+
+    def __init__(self, planner, origin_waypoint, destination):
+        """
+        :param planner: GlobalRoutePlanner of the route
+        :param origin_waypoint: carla.Waypoint of the start of the route
+        :param destination: carla.Location of the end of the route
+        """
+        self._planner = planner
+        self.route = []
+        self.road_options = []
+        self._states = []
+        self._chunks = []
+        self._length = 0
+        self._origin_waypoint = None
+        self._destination = None
+        self._destination_waypoint = None
+
+        destination_waypoint = planner._get_waypoint(destination)
+        self._trace(origin_waypoint, destination, destination_waypoint, planner._waypoint_edge(destination_waypoint))
+
+    def __len__(self):
+        return self._length
+
+    def waypoints(self):
+        """Returns the list of (carla.Waypoint, RoadOption) of the route"""
+        return [pair for chunk in self._chunks for pair in chunk]
+
+    def repair(self, destination, remaining=None, max_expansions=1000):
+        """
+        Moves the destination of the route. The graph is searched backwards from the new destination
+        until reaching a node of the old route that hasn't been reached yet, and the route is changed
+        from there. If there is none close enough, the route is traced again from the first waypoint
+        not followed yet.
+
+            :param destination: new carla.Location of the end of the route
+            :param remaining: number of waypoints at the end of the route that haven't been followed yet,
+                such as the length of the LocalPlanner queue. Defaults to all of them
+            :param max_expansions: maximum number of nodes expanded by the backward search
+            :return: tuple (number of waypoints to remove from the end of the plan,
+                list of (carla.Waypoint, RoadOption) to add in their place)
+        """
+        planner = self._planner
+        if remaining is None:
+            remaining = self._length
+        consumed = max(0, self._length - remaining)
+
+        # Edge of the route being followed, which can't be changed anymore
+        current, followed = 0, 0
+        while current < len(self._chunks) - 1 and followed + len(self._chunks[current]) <= consumed:
+            followed += len(self._chunks[current])
+            current += 1
+
+        destination_waypoint = planner._get_waypoint(destination)
+        end = planner._waypoint_edge(destination_waypoint)
+        path = None
+        candidates = self.route[current + 1:len(self.route) - 1]
+        if end is not None and candidates:
+            path = planner._get_compact_graph().search_backward(end[0], set(candidates), max_expansions)
+
+        if path is None:
+            waypoints = self.waypoints()
+            origin_waypoint = waypoints[min(consumed, len(waypoints) - 1)][0]
+            self._trace(origin_waypoint, destination, destination_waypoint, end)
+            return remaining, self.waypoints()
+
+        splice = self.route.index(path[0], current + 1)
+        route = self.route[:splice] + path + [end[1]]
+
+        # The decision of a turn depends on the intersection edges after it, so the decisions
+        # are computed again from the last turn before the new part of the route
+        start = splice
+        while start > current + 1:
+            edge = planner._graph.edges[route[start - 1], route[start]]
+            if edge['type'] != RoadOption.LANEFOLLOW or not edge['intersection']:
+                break
+            start -= 1
+        start = max(current + 1, start - 1)
+        road_options, states = planner._route_road_options(route, start, self._states[start - 1])
+        road_options = self.road_options[:start] + road_options
+        states = self._states[:start] + states
+
+        # Only the waypoints of the edges whose decision changed are expanded again
+        first = splice
+        for i in range(start, splice):
+            if road_options[i] != self.road_options[i]:
+                first = i
+                break
+
+        removed = sum(len(chunk) for chunk in self._chunks[first:])
+        self.route, self.road_options, self._states = route, road_options, states
+        self._chunks = self._chunks[:first]
+        self._length -= removed
+        self._destination, self._destination_waypoint = destination, destination_waypoint
+        self._expand(first)
+
+        return removed, [pair for chunk in self._chunks[first:] for pair in chunk]
+
+    def _trace(self, origin_waypoint, destination, destination_waypoint, end):
+        """Searches and expands the whole route"""
+        planner = self._planner
+        start = planner._waypoint_edge(origin_waypoint)
+        self.route = planner._path_search(start, end)
+        self.road_options, self._states = planner._route_road_options(self.route)
+        self._origin_waypoint = origin_waypoint
+        self._destination, self._destination_waypoint = destination, destination_waypoint
+        self._chunks, self._length = [], 0
+        self._expand(0)
+
+    def _expand(self, first):
+        """Expands the waypoints of the edges of the route from the given index"""
+        current_waypoint = self._chunks[first - 1][-1][0] if first > 0 else self._origin_waypoint
+        for i in range(first, len(self.route) - 1):
+            chunk = []
+            current_waypoint = self._planner._expand_route_edge(
+                i, self.route, self.road_options[i], current_waypoint,
+                self._destination, self._destination_waypoint, chunk)
+            self._chunks.append(chunk)
+            self._length += len(chunk)
+
+
+class LazyRoute(object):
+    """
+    LazyRoute is the route returned by GlobalRoutePlanner.trace_route_lazy. It is an iterator of
+    (carla.Waypoint, RoadOption) pairs, which expands the edges of the route as it is consumed.
+    The node route and the RoadOption of its edges are available at once.
+    """
+
+    def __init__(self, route, road_options, chunks):
+        """
+        :param route: list of the nodes of the route
+        :param road_options: list with the RoadOption of each edge of the route
+        :param chunks: iterator of the lists of (carla.Waypoint, RoadOption) of each edge
+        """
+        self.route = route
+        self.road_options = road_options
+        self._chunks = chunks
+        self._chunk = []
+        self._chunk_index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self._chunk_index >= len(self._chunk):
+            self._chunk = next(self._chunks)
+            self._chunk_index = 0
+        self._chunk_index += 1
+        return self._chunk[self._chunk_index - 1]
+
+
+# Planners shared by the whole process, see get_shared_planner
+_shared_planners = {}
+_shared_planners_lock = threading.Lock()
+
+# Options that change the graph or the routes of a planner, and so are part of its shared key.
+# 'build_workers' only changes how the graph is built, not the result.
+_SHARED_PLANNER_OPTIONS = ('graph_cache_dir', 'num_landmarks', 'route_cache_size', 'use_lane_index', 'routing_engine')
+
+
+def get_shared_planner(wmap, sampling_resolution, opt_dict={}):
+    """
+    Returns the GlobalRoutePlanner of a map and sampling resolution shared by the whole process,
+    building it the first time it is requested. Concurrent requests for the same planner wait
+    until it is built, while planners of other maps or resolutions can be built at the same time.
+
+    Planners are shared between the requests with the same map, OpenDRIVE content, sampling
+    resolution and planner options, so that a map reloaded with other content, or a request
+    with other options, gets its own planner. As it is shared, changes made to a planner,
+    such as its edge cost multipliers, apply to all its users.
+
+        :param wmap: carla.Map of the planner
+        :param sampling_resolution: distance between the waypoints of the graph edges
+        :param opt_dict: options of the planner, see GlobalRoutePlanner
+        :return: GlobalRoutePlanner
+    """
+    opendrive_hash = hashlib.sha1(wmap.to_opendrive().encode('utf-8')).hexdigest()
+    options = tuple((name, opt_dict[name]) for name in _SHARED_PLANNER_OPTIONS if name in opt_dict)
+    key = (wmap.name, opendrive_hash, float(sampling_resolution), options)
+    with _shared_planners_lock:
+        entry = _shared_planners.get(key)
+        if entry is None:
+            entry = _shared_planners[key] = [threading.Lock(), None]
+
+    with entry[0]:
+        if entry[1] is None:
+            entry[1] = GlobalRoutePlanner(wmap, sampling_resolution, opt_dict)
+    return entry[1]
+
+
+def clear_shared_planners():
+    """Forgets the shared planners, so that they are built again when requested"""
+    with _shared_planners_lock:
+        _shared_planners.clear()
+
+
+# Graph used by the route searches of the current process, see GlobalRoutePlanner.trace_routes
+_search_graph = None
+_search_with_alt = False
+
+
+def _init_search_worker(compact_graph, use_alt):
+    """Sets the graph searched by _search_worker in this process"""
+    global _search_graph, _search_with_alt
+    _search_graph = compact_graph
+    _search_with_alt = use_alt
+
+
+def _search_worker(task):
+    """Returns the node route between the (source, target) nodes of the task, or None if there is none"""
+    source, target = task
+    try:
+        if _search_with_alt:
+            return _search_graph.alt(source, target)
+        return _search_graph.astar(source, target)
+    except nx.NetworkXException:
+        return None
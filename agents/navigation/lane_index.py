@@ -0,0 +1,464 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+
+"""
+This module provides a client side spatial index of the lanes of a map.
+"""
+
+from collections import namedtuple
+import math
+import os
+
+import numpy as np
+import carla
+
+
+LANE_INDEX_VERSION = 2
+
+# The centerlines are split in segments like the map does for carla.Map.get_waypoint: a segment
+# ends at the first sample whose direction differs by more than this angle from its start ...
+_SEGMENT_MAX_ANGLE = math.pi / 100.0
+# ... or that is further than this distance along the lane
+_SEGMENT_MAX_LENGTH = 100.0
+
+# Segments closer than this to the closest one are tied with it, such as at the joints between lanes.
+# If they give another lane or s, the map is asked, as its choice between them can't be reproduced
+_TIE_DISTANCE = 1e-2
+_TIE_S = 1e-3
+
+# Position of a location relative to the closest lane. The lateral offset is measured
+# from the center of the lane, positive towards the right of its driving direction. As it
+# is measured from the indexed segments, it can be off by a few decimeters on long gentle curves
+LanePosition = namedtuple('LanePosition', [
+    'road_id', 'section_id', 'lane_id', 's', 'lateral_offset',
+    'lane_type', 'lane_width', 'is_junction', 'distance'])
+
+
+class LaneIndex(object):
+    """
+    LaneIndex stores the centerlines of all the lanes of a map as polylines, and indexes
+    their segments in a uniform grid. It is used to find the lane a location is part of,
+    the same query as carla.Map.get_waypoint, without going through the map each time.
+
+    The centerlines are sampled once, when the index is created, and split in segments
+    the same way the map does, so that the locations are projected on the same segments
+    and the answers are within a few centimeters of the ones of the map. The locations tied
+    between lanes, such as at their joints, are localized by the map.
+    """
+
+    def __init__(self, wmap, resolution=1.0, cell_size=10.0, cache_file=None):
+        """
+        :param wmap: carla.Map whose lanes are indexed
+        :param resolution: distance between the samples of the lane centerlines. The map uses 1 meter
+        :param cell_size: size of the cells of the grid
+        :param cache_file: file where the sampled centerlines are stored and reused between runs.
+            It has to be specific to the map and the resolution
+        """
+        self._wmap = wmap
+        self._resolution = resolution
+        self._cell_size = cell_size
+
+        if not cache_file or not self._load(cache_file):
+            self._sample_lanes()
+            if cache_file:
+                self._save(cache_file)
+
+        self._lane_index = {(lane[0], lane[1], lane[2]): i for i, lane in enumerate(self._lanes)}
+        self._lane_types = np.array([int(lane[3]) for lane in self._lanes], dtype=np.int64)
+        self._segment_lanes = np.repeat(
+            np.arange(len(self._lanes), dtype=np.int64),
+            np.array([lane[6] for lane in self._lanes], dtype=np.int64))
+
+        self._deltas = self._ends - self._starts
+        self._inverse_lengths = 1.0 / np.maximum(np.einsum('ij,ij->i', self._deltas, self._deltas), 1e-12)
+
+        self._build_grid()
+
+    def __len__(self):
+        """Returns the number of indexed segments"""
+        return len(self._segment_lanes)
+
+    def locate(self, location, lane_type=carla.LaneType.Driving):
+        """
+        Finds the lane closest to a location.
+
+            :param location: carla.Location (or any object with x, y and z attributes)
+            :param lane_type: carla.LaneType flags of the lanes taken into account
+            :return: LanePosition of the location, or None if there are no lanes of that type
+        """
+        return self._locate(location, lane_type)[0]
+
+    def get_waypoint(self, location, lane_type=carla.LaneType.Driving):
+        """
+        Returns the carla.Waypoint at the center of the lane closest to a location,
+        the equivalent of carla.Map.get_waypoint, or None if there isn't one.
+
+            :param location: carla.Location
+            :param lane_type: carla.LaneType flags of the lanes taken into account
+        """
+        position, waypoint = self._locate(location, lane_type)
+        if waypoint is not None:
+            return waypoint
+        if position is None:
+            return None
+        return self.position_to_waypoint(position)
+
+    def _locate(self, location, lane_type):
+        """
+        Returns the LanePosition of a location, and the waypoint of the map if it had to be asked
+        because the location is tied between lanes
+        """
+        x, y, z = location.x, location.y, location.z
+        mask = int(lane_type)
+        cx, cy = self._cell(x, y)
+        point = np.array([x, y, z])
+
+        # Most locations are close to a lane, so start with the cells around the one of the
+        # location. Any segment outside of them is at least one cell size away
+        best_distance = math.inf
+        candidates = []
+        segments, starts, deltas, inverse_lengths = self._neighborhood(cx, cy, mask)
+        if len(segments):
+            t, distances = _project(point, starts, deltas, inverse_lengths)
+            candidates.append((segments, t, distances))
+            best_distance = float(distances.min())
+
+        if best_distance > self._cell_size:
+            for ring in range(2, self._max_ring(cx, cy) + 1):
+                segments = self._filter(self._ring_segments(cx, cy, ring), mask)
+                if len(segments):
+                    t, distances = _project(
+                        point, self._starts[segments], self._deltas[segments], self._inverse_lengths[segments])
+                    candidates.append((segments, t, distances))
+                    best_distance = min(best_distance, float(distances.min()))
+
+                # Segments outside the searched cells are further than the border of the searched area
+                if candidates and best_distance <= ring * self._cell_size:
+                    break
+
+        if not candidates:
+            return None, None
+        if len(candidates) == 1:
+            segments, t, distances = candidates[0]
+        else:
+            segments, t, distances = (np.concatenate(values) for values in zip(*candidates))
+        ties = np.flatnonzero(distances <= best_distance + _TIE_DISTANCE)
+        if len(ties) == 1:
+            return self._position(point, segments[ties[0]], t[ties[0]], distances[ties[0]]), None
+
+        ties = ties[np.argsort(distances[ties], kind='stable')]
+        positions = [self._position(point, segments[i], t[i], distances[i]) for i in ties]
+        best = positions[0]
+        if all((p.road_id, p.section_id, p.lane_id) == (best.road_id, best.section_id, best.lane_id)
+               and abs(p.s - best.s) <= _TIE_S for p in positions[1:]):
+            return best, None
+
+        waypoint = self._wmap.get_waypoint(location, lane_type=lane_type)
+        if waypoint is None:
+            return best, None
+        for position in positions:
+            if (position.road_id, position.section_id, position.lane_id) == \
+                    (waypoint.road_id, waypoint.section_id, waypoint.lane_id):
+                return position._replace(s=waypoint.s), waypoint
+        return best, waypoint
+
+    def position_to_waypoint(self, position):
+        """Returns the carla.Waypoint at the center of the lane of a LanePosition"""
+        lane = self._lanes[self._lane_index[(position.road_id, position.section_id, position.lane_id)]]
+        s_start, s_end = lane[4], lane[5]
+        return self._xodr_waypoint(position.road_id, position.lane_id, position.s, s_start, s_end)
+
+    def _sample_lanes(self):
+        """
+        Samples the centerlines of all the lanes of the map. The road sections are found
+        with the driving lanes of the map, and the rest of their lanes by moving sideways.
+        """
+        sections = {}
+        for waypoint in self._wmap.generate_waypoints(self._resolution):
+            key = (waypoint.road_id, waypoint.section_id)
+            if key in sections:
+                first, s_start, s_end = sections[key]
+                sections[key] = (first, min(s_start, waypoint.s), max(s_end, waypoint.s))
+            else:
+                sections[key] = (waypoint, waypoint.s, waypoint.s)
+
+        # The samples don't reach the ends of the sections, look for them within a resolution
+        for key, (waypoint, s_start, s_end) in sections.items():
+            sections[key] = (
+                waypoint,
+                self._section_end(waypoint, s_start, s_start - self._resolution),
+                self._section_end(waypoint, s_end, s_end + self._resolution))
+
+        starts, ends, s_values, widths, lanes = [], [], [], [], []
+        for (road_id, section_id), (waypoint, s_start, s_end) in sorted(sections.items()):
+            if s_end - s_start <= 0:
+                continue
+            for lane_waypoint in self._section_lanes(waypoint):
+                points = self._sample_lane(road_id, lane_waypoint.lane_id, s_start, s_end)
+                if len(points) < 2:
+                    continue
+
+                for p1, p2 in zip(points[:-1], points[1:]):
+                    starts.append(p1[:3])
+                    ends.append(p2[:3])
+                    s_values.append((p1[3], p2[3]))
+                    widths.append((p1[4], p2[4]))
+
+                lanes.append((road_id, section_id, lane_waypoint.lane_id, lane_waypoint.lane_type,
+                              s_start, s_end, len(points) - 1, lane_waypoint.is_junction))
+
+        self._lanes = lanes
+        self._starts = np.array(starts, dtype=np.float64).reshape(-1, 3)
+        self._ends = np.array(ends, dtype=np.float64).reshape(-1, 3)
+        self._s_values = np.array(s_values, dtype=np.float64).reshape(-1, 2)
+        self._widths = np.array(widths, dtype=np.float64).reshape(-1, 2)
+
+    def _sample_lane(self, road_id, lane_id, s_start, s_end):
+        """
+        Returns the ends of the segments of a lane of a road section, in its driving direction,
+        as (x, y, z, s, lane width) tuples. The lane is sampled every resolution from its start,
+        and a segment is closed at the first sample whose direction changes too much from the
+        start of the segment, or that is too far from it, and at the end of the lane
+        """
+        if lane_id < 0:
+            first, last, direction = s_start, s_end, 1.0
+        else:
+            first, last, direction = s_end, s_start, -1.0
+
+        def sample(s):
+            waypoint = self._xodr_waypoint(road_id, lane_id, s, s_start, s_end)
+            if waypoint is None:
+                return None
+            loc = waypoint.transform.location
+            if not (math.isfinite(loc.x) and math.isfinite(loc.y) and math.isfinite(loc.z)):
+                return None
+            forward = waypoint.transform.get_forward_vector()
+            return (loc.x, loc.y, loc.z, s, waypoint.lane_width), (forward.x, forward.y, forward.z)
+
+        points = []
+        current = sample(first)
+        if current is not None:
+            points.append(current[0])
+
+        step = 1
+        while step * self._resolution < s_end - s_start:
+            candidate = sample(first + direction * step * self._resolution)
+            step += 1
+            if candidate is None:
+                continue
+            if current is None:
+                current = candidate
+                points.append(current[0])
+                continue
+
+            cosine = sum(a * b for a, b in zip(current[1], candidate[1]))
+            angle = math.acos(min(max(cosine, -1.0), 1.0))
+            if angle > _SEGMENT_MAX_ANGLE or abs(candidate[0][3] - current[0][3]) > _SEGMENT_MAX_LENGTH:
+                current = candidate
+                points.append(current[0])
+
+        end = sample(last)
+        if end is not None and (not points or end[0][3] != points[-1][3]):
+            points.append(end[0])
+        return points
+
+    def _load(self, cache_file):
+        """
+        Restores the sampled centerlines from the given file.
+        Returns False if the file is missing or can't be read.
+        """
+        if not os.path.isfile(cache_file):
+            return False
+        try:
+            with np.load(cache_file) as data:
+                if int(data['version']) != LANE_INDEX_VERSION or float(data['resolution']) != self._resolution:
+                    return False
+                lanes = data['lanes'].tolist()
+                self._starts = data['starts']
+                self._ends = data['ends']
+                self._s_values = data['s_values']
+                self._widths = data['widths']
+        except (OSError, KeyError, ValueError) as error:
+            print("Warning: Ignoring the lane index cache '{}': {}".format(cache_file, error))
+            return False
+
+        self._lanes = [
+            (int(road_id), int(section_id), int(lane_id), carla.LaneType.values.get(int(lane_type), int(lane_type)),
+             s_start, s_end, int(num_segments), bool(is_junction))
+            for road_id, section_id, lane_id, lane_type, s_start, s_end, num_segments, is_junction in lanes]
+        return True
+
+    def _save(self, cache_file):
+        """Stores the sampled centerlines in the given file"""
+        lanes = np.array([
+            (road_id, section_id, lane_id, int(lane_type), s_start, s_end, num_segments, is_junction)
+            for road_id, section_id, lane_id, lane_type, s_start, s_end, num_segments, is_junction in self._lanes],
+            dtype=np.float64).reshape(-1, 8)
+        tmp_file = '{}.{}.tmp.npz'.format(cache_file, os.getpid())
+        try:
+            cache_dir = os.path.dirname(cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            np.savez(tmp_file, version=LANE_INDEX_VERSION, resolution=self._resolution, lanes=lanes,
+                     starts=self._starts, ends=self._ends, s_values=self._s_values, widths=self._widths)
+            os.replace(tmp_file, cache_file)
+        except OSError as error:
+            print("Warning: Unable to write the lane index cache '{}': {}".format(cache_file, error))
+
+    def _section_end(self, waypoint, s_inside, s_outside):
+        """Bisects the s at which the lane of a waypoint leaves its road section"""
+        def inside(s):
+            sample = self._wmap.get_waypoint_xodr(waypoint.road_id, waypoint.lane_id, s)
+            return sample is not None and sample.section_id == waypoint.section_id
+
+        if inside(s_outside):
+            return s_outside
+        while abs(s_outside - s_inside) > 1e-3:
+            s_middle = 0.5 * (s_inside + s_outside)
+            if inside(s_middle):
+                s_inside = s_middle
+            else:
+                s_outside = s_middle
+        return s_inside
+
+    @staticmethod
+    def _section_lanes(waypoint):
+        """Returns a waypoint of each lane of the road section of the given waypoint"""
+        lanes = {waypoint.lane_id: waypoint}
+        pending = [waypoint]
+        while pending:
+            current = pending.pop()
+            for neighbor in (current.get_left_lane(), current.get_right_lane()):
+                if neighbor is None or neighbor.lane_id in lanes:
+                    continue
+                if neighbor.road_id != waypoint.road_id or neighbor.section_id != waypoint.section_id:
+                    continue
+                lanes[neighbor.lane_id] = neighbor
+                pending.append(neighbor)
+        return [lanes[lane_id] for lane_id in sorted(lanes)]
+
+    def _xodr_waypoint(self, road_id, lane_id, s, s_start, s_end):
+        """
+        Returns the waypoint of a lane at a given s. The map has no waypoints exactly at
+        the ends of some lanes, so the ones at the ends are moved slightly inwards
+        """
+        for offset in (0.0, 1e-4, 1e-3, 1e-2):
+            waypoint = self._wmap.get_waypoint_xodr(road_id, lane_id, min(max(s, s_start + offset), s_end - offset))
+            if waypoint is not None:
+                return waypoint
+        return None
+
+    def _build_grid(self):
+        """Registers each segment in all the grid cells covered by its bounding box"""
+        cell_size = self._cell_size
+        low = np.floor(np.minimum(self._starts[:, :2], self._ends[:, :2]) / cell_size).astype(np.int64)
+        high = np.floor(np.maximum(self._starts[:, :2], self._ends[:, :2]) / cell_size).astype(np.int64)
+
+        grid = {}
+        for segment, (x1, y1, x2, y2) in enumerate(np.hstack((low, high)).tolist()):
+            for cx in range(x1, x2 + 1):
+                for cy in range(y1, y2 + 1):
+                    grid.setdefault((cx, cy), []).append(segment)
+        self._grid = {cell: np.array(segments, dtype=np.int64) for cell, segments in grid.items()}
+        self._neighborhoods = {}
+
+        if grid:
+            cells = np.array(list(grid), dtype=np.int64)
+            self._grid_low = cells.min(axis=0).tolist()
+            self._grid_high = cells.max(axis=0).tolist()
+        else:
+            self._grid_low = self._grid_high = [0, 0]
+
+    def _cell(self, x, y):
+        """Returns the grid cell of a point"""
+        return int(math.floor(x / self._cell_size)), int(math.floor(y / self._cell_size))
+
+    def _max_ring(self, cx, cy):
+        """Returns the ring around a cell after which all the grid has been searched"""
+        return max(cx - self._grid_low[0], self._grid_high[0] - cx,
+                   cy - self._grid_low[1], self._grid_high[1] - cy, 0)
+
+    def _ring_segments(self, cx, cy, ring):
+        """Returns the segments registered in the cells at the given chebyshev distance of a cell"""
+        if ring == 0:
+            cells = [(cx, cy)]
+        else:
+            cells = []
+            for dx in range(-ring, ring + 1):
+                cells.append((cx + dx, cy - ring))
+                cells.append((cx + dx, cy + ring))
+            for dy in range(-ring + 1, ring):
+                cells.append((cx - ring, cy + dy))
+                cells.append((cx + ring, cy + dy))
+
+        segments = [self._grid[cell] for cell in cells if cell in self._grid]
+        if not segments:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(segments))
+
+    def _neighborhood(self, cx, cy, mask):
+        """
+        Returns the segments of the lanes of the given types around a cell, with their
+        starts, directions and inverse squared lengths. They are cached as most queries
+        of an agent fall in the same few cells
+        """
+        key = (cx, cy, mask)
+        neighborhood = self._neighborhoods.get(key)
+        if neighborhood is None:
+            segments = [self._grid[(cx + dx, cy + dy)] for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                        if (cx + dx, cy + dy) in self._grid]
+            if segments:
+                segments = self._filter(np.unique(np.concatenate(segments)), mask)
+            else:
+                segments = np.empty(0, dtype=np.int64)
+            neighborhood = (segments, self._starts[segments], self._deltas[segments], self._inverse_lengths[segments])
+            self._neighborhoods[key] = neighborhood
+        return neighborhood
+
+    def _filter(self, segments, mask):
+        """Returns the segments whose lane type matches the carla.LaneType flags"""
+        if mask == int(carla.LaneType.Any):
+            return segments
+        return segments[(self._lane_types[self._segment_lanes[segments]] & mask) != 0]
+
+    def _position(self, point, segment, t, distance):
+        """Builds the LanePosition of a point projected on a segment"""
+        lane = self._lanes[self._segment_lanes[segment]]
+        lane_id = lane[2]
+
+        s1, s2 = self._s_values[segment].tolist()
+        w1, w2 = self._widths[segment].tolist()
+        dx, dy, _ = self._deltas[segment].tolist()
+        sx, sy, _ = self._starts[segment].tolist()
+
+        # As the map, the point is projected in the XY plane, and its s is moved from the start of the
+        # segment by the distance along it rather than interpolated, which is shorter on curved segments.
+        # Points beyond the end of the segment take the s of the end, as the next segment starts there
+        norm = math.hypot(dx, dy)
+        if norm > 0:
+            t = min(max(((point[0] - sx) * dx + (point[1] - sy) * dy) / (norm * norm), 0.0), 1.0)
+        else:
+            t = float(t)
+        s = s2 if t >= 1.0 else s1 + math.copysign(min(t * norm, abs(s2 - s1)), s2 - s1)
+        ox, oy = point[0] - (sx + t * dx), point[1] - (sy + t * dy)
+
+        # The right of the lane direction, as the segments follow it (with the left handed axes)
+        lateral_offset = 0.0
+        if norm > 0:
+            lateral_offset = (dx * oy - dy * ox) / norm
+
+        return LanePosition(
+            lane[0], lane[1], lane_id, s, float(lateral_offset),
+            lane[3], w1 + t * (w2 - w1), lane[7], float(distance))
+
+
+def _project(point, starts, deltas, inverse_lengths):
+    """Returns the projection parameter of a point on some segments, and its distance to them"""
+    offsets = point - starts
+    t = np.einsum('ij,ij->i', offsets, deltas) * inverse_lengths
+    np.clip(t, 0.0, 1.0, out=t)
+    offsets -= t[:, None] * deltas
+    return t, np.sqrt(np.einsum('ij,ij->i', offsets, offsets))
@@ -5,11 +5,22 @@
 
 """ This module contains a local planner to perform low-level waypoint following based on PID controllers. """
 
+from collections import OrderedDict
 from enum import IntEnum
-from collections import deque
+from itertools import chain, islice
+import math
 import random
+import threading
 
+import numpy as np
 import carla
+from shapely.geometry import Polygon
+try:
+    from shapely import prepare
+except ImportError:
+    # Shapely 1.x can't prepare the geometries in place
+    prepare = None
+
 from agents.navigation.controller import VehiclePIDController
 from agents.tools.misc import draw_waypoints, get_speed
 
@@ -28,6 +39,437 @@ class RoadOption(IntEnum):
     CHANGELANERIGHT = 6
 
 
+_ROAD_OPTIONS = {option.value: option for option in RoadOption}
+
+
+class WaypointQueue(object):
+    """
+    WaypointQueue is the queue of (carla.Waypoint, RoadOption) pairs followed by the LocalPlanner.
+    It is a ring buffer that keeps the locations of the waypoints in a preallocated numpy array,
+    next to their RoadOption codes, so that the waypoints reached by the vehicle are found with
+    vectorized distances. The pairs are only created when they are accessed.
+
+    The queue is also parameterized by arc length: each waypoint has the distance 's' along the
+    plan from its first waypoint, which is kept as waypoints are removed from the head of the queue.
+    The right vectors of the waypoints are computed the first time they are needed, and kept with them.
+    """
+
+    def __init__(self, maxlen=10000, capacity=256, history_length=32):
+        """
+        :param maxlen: length up to which random waypoints are added. Plans can make the queue longer
+        :param capacity: initial size of the buffer, which grows as needed
+        :param history_length: number of waypoints removed from the head whose location is kept
+        """
+        self.maxlen = maxlen
+        self._head = 0
+        self._size = 0
+        self._locations = np.zeros((capacity, 3))
+        self._options = np.zeros(capacity, dtype=np.int8)
+        self._waypoints = np.empty(capacity, dtype=object)
+        self._s = np.zeros(capacity)
+        self._right_vectors = np.full((capacity, 2), np.nan)
+
+        # Number of changes of the queue, to know whether it changed since a result was computed
+        self.version = 0
+
+        # Location and s of the last waypoints removed from the head, which start the polyline, as the
+        # vehicle can still be behind them when they are removed for being close to it
+        self._history_length = history_length
+        self._history = np.zeros((0, 4))
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('WaypointQueue index out of range')
+        index = (self._head + index) % len(self._options)
+        return self._waypoints[index], _ROAD_OPTIONS[int(self._options[index])]
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self[i]
+
+    def _indices(self, start, count):
+        """Returns the buffer indices of 'count' elements starting at position 'start' of the queue"""
+        return (self._head + start + np.arange(count)) % len(self._options)
+
+    def _reserve(self, size):
+        """Grows the buffer, keeping the queue in order, until it fits 'size' elements"""
+        capacity = len(self._options)
+        if size <= capacity:
+            return
+        indices = self._indices(0, self._size)
+        capacity = max(size, 2 * capacity)
+
+        locations = np.zeros((capacity, 3))
+        locations[:self._size] = self._locations[indices]
+        options = np.zeros(capacity, dtype=np.int8)
+        options[:self._size] = self._options[indices]
+        waypoints = np.empty(capacity, dtype=object)
+        waypoints[:self._size] = self._waypoints[indices]
+        arc_lengths = np.zeros(capacity)
+        arc_lengths[:self._size] = self._s[indices]
+        right_vectors = np.full((capacity, 2), np.nan)
+        right_vectors[:self._size] = self._right_vectors[indices]
+
+        self._head = 0
+        self._locations, self._options, self._waypoints, self._s = locations, options, waypoints, arc_lengths
+        self._right_vectors = right_vectors
+
+    def append(self, elem):
+        """Adds a (carla.Waypoint, RoadOption) pair at the end of the queue"""
+        self.extend([elem])
+
+    def extend(self, elems, locations=None):
+        """
+        Adds a list of (carla.Waypoint, RoadOption) pairs at the end of the queue
+
+            :param elems: list of (carla.Waypoint, RoadOption)
+            :param locations: (N, 3) array with the locations of the waypoints, if already known
+        """
+        if not elems:
+            return
+        waypoints = np.empty(len(elems), dtype=object)
+        waypoints[:] = [wp for wp, _ in elems]
+        if locations is None:
+            locations = [wp.transform.location for wp in waypoints]
+            locations = np.array([(loc.x, loc.y, loc.z) for loc in locations]).reshape(-1, 3)
+
+        # The arc length continues from the end of the queue
+        if self._size > 0:
+            tail = self._indices(self._size - 1, 1)[0]
+            last_location, last_s = self._locations[tail], self._s[tail]
+        elif len(self._history) > 0:
+            last_location, last_s = self._history[-1, :3], self._history[-1, 3]
+        else:
+            last_location, last_s = locations[0], 0.0
+        steps = np.linalg.norm(np.diff(np.vstack((last_location, locations)), axis=0), axis=1)
+
+        self._reserve(self._size + len(elems))
+        indices = self._indices(self._size, len(elems))
+        self._locations[indices] = locations
+        self._options[indices] = [option for _, option in elems]
+        self._waypoints[indices] = waypoints
+        self._s[indices] = last_s + np.cumsum(steps)
+        self._right_vectors[indices] = np.nan
+        self._size += len(elems)
+        self.version += 1
+
+    def popleft(self, count=1):
+        """Removes the first 'count' pairs of the queue"""
+        count = min(count, self._size)
+        if count == 0:
+            return
+        indices = self._indices(0, count)
+        indices = indices[-self._history_length:]
+        removed = np.hstack((self._locations[indices], self._s[indices, np.newaxis]))
+        self._history = np.vstack((self._history, removed))[-self._history_length:]
+        self._waypoints[indices] = None
+        self._head = (self._head + count) % len(self._options)
+        self._size -= count
+        self.version += 1
+
+    def pop(self, count=1):
+        """Removes the last 'count' pairs of the queue"""
+        count = min(count, self._size)
+        self._waypoints[self._indices(self._size - count, count)] = None
+        self._size -= count
+        self.version += 1
+
+    def clear(self):
+        """Removes all the pairs of the queue"""
+        self.popleft(self._size)
+        self._head = 0
+        self._history = np.zeros((0, 4))
+        self.version += 1
+
+    def get_s(self, index):
+        """Returns the arc length of the waypoint at a position of the queue"""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('WaypointQueue index out of range')
+        return float(self._s[(self._head + index) % len(self._s)])
+
+    def bisect(self, s):
+        """Returns the number of waypoints of the queue with an arc length lower than 's', in O(log n)"""
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._s[(self._head + middle) % len(self._s)] < s:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_right_vectors(self, count):
+        """
+        Returns the locations and the right vectors, in the XY plane, of the first waypoints of the queue
+
+            :param count: number of waypoints
+            :return: (N, 3) array of locations and (N, 2) array of right vectors
+        """
+        count = min(count, self._size)
+        indices = self._indices(0, count)
+        right_vectors = self._right_vectors[indices]
+        for i in np.flatnonzero(np.isnan(right_vectors[:, 0])):
+            r_vec = self._waypoints[indices[i]].transform.get_right_vector()
+            right_vectors[i] = self._right_vectors[indices[i]] = (r_vec.x, r_vec.y)
+        return self._locations[indices], right_vectors
+
+    def project(self, location, start_s=None, end_s=None):
+        """
+        Projects a location onto the polyline of the queue, which starts at the last waypoints removed
+        from it, or is extended backwards from its first waypoint if there are none. Only the segments
+        between the arc lengths 'start_s' and 'end_s' are checked, which are found by bisection.
+
+            :param location: carla.Location to project
+            :param start_s: arc length from which the segments are checked. Defaults to the start of the queue
+            :param end_s: arc length up to which the segments are checked. Defaults to the end of the queue
+            :return: arc length of the projection, and lateral distance to the polyline,
+                which is positive when the location is to its right
+        """
+        point = np.array([location.x, location.y, location.z])
+        first = 0 if start_s is None else max(self.bisect(start_s) - 1, 0)
+        last = self._size if end_s is None else min(self.bisect(end_s) + 1, self._size)
+        indices = self._indices(first, max(last - first, 1))
+        points, arc_lengths = self._locations[indices], self._s[indices]
+
+        extend_backwards = first == 0
+        if first == 0 and len(self._history) > 0:
+            history = self._history
+            if start_s is not None:
+                history = history[max(np.searchsorted(history[:, 3], start_s) - 1, 0):]
+            points = np.vstack((history[:, :3], points))
+            arc_lengths = np.concatenate((history[:, 3], arc_lengths))
+            extend_backwards = len(history) == len(self._history)
+
+        lower_bounds = np.zeros(len(points) - 1)
+        if extend_backwards and len(lower_bounds) > 0:
+            lower_bounds[0] = -np.inf
+
+        if len(points) == 1:
+            return float(arc_lengths[0]), float(np.linalg.norm(point - points[0]))
+
+        vectors = np.diff(points, axis=0)
+        squared_lengths = np.einsum('ij,ij->i', vectors, vectors)
+        dots = np.einsum('ij,ij->i', point - points[:-1], vectors)
+        ratios = np.divide(dots, squared_lengths, out=np.zeros_like(dots), where=squared_lengths > 0)
+        ratios = np.clip(ratios, lower_bounds, 1.0)
+
+        offsets = point - (points[:-1] + ratios[:, np.newaxis] * vectors)
+        distances = np.linalg.norm(offsets, axis=1)
+        closest = int(np.argmin(distances))
+
+        arc_length = arc_lengths[closest] + ratios[closest] * np.sqrt(squared_lengths[closest])
+        vector, offset = vectors[closest], offsets[closest]
+        side = 1.0 if vector[0] * offset[1] - vector[1] * offset[0] >= 0 else -1.0
+        return float(arc_length), side * float(distances[closest])
+
+    def num_reached(self, location, min_distance, last_min_distance=1.0):
+        """
+        Returns the number of waypoints at the start of the queue that are closer than 'min_distance'
+        to a location, stopping at the first one that isn't. The last waypoint of the queue uses
+        'last_min_distance' instead. Only the waypoints up to that one are checked, by growing blocks
+
+            :param location: carla.Location of the vehicle
+            :param min_distance: distance below which a waypoint is reached
+            :param last_min_distance: distance below which the last waypoint is reached
+        """
+        point = np.array([location.x, location.y, location.z])
+        reached = 0
+        block = 16
+        while reached < self._size:
+            count = min(block, self._size - reached)
+            distances = np.linalg.norm(self._locations[self._indices(reached, count)] - point, axis=1)
+            thresholds = np.full(count, float(min_distance))
+            if reached + count == self._size:
+                thresholds[-1] = last_min_distance
+            far = distances >= thresholds
+            if far.any():
+                return reached + int(np.argmax(far))
+            reached += count
+            block *= 2
+        return reached
+
+    def num_within(self, location, max_distance):
+        """
+        Returns the number of waypoints at the start of the queue that are at most 'max_distance'
+        away from a location, stopping at the first one that isn't. Only the waypoints up to that
+        one are checked, by growing blocks
+
+            :param location: carla.Location from which the distances are measured
+            :param max_distance: distance up to which the waypoints are counted
+        """
+        point = np.array([location.x, location.y, location.z])
+        within = 0
+        block = 16
+        while within < self._size:
+            count = min(block, self._size - within)
+            far = np.linalg.norm(self._locations[self._indices(within, count)] - point, axis=1) > max_distance
+            if far.any():
+                return within + int(np.argmax(far))
+            within += count
+            block *= 2
+        return within
+
+
+class RouteCorridor(object):
+    """
+    RouteCorridor is the polygon covered by a vehicle following the waypoints of a WaypointQueue,
+    from its current transform. Its edges are built from the right vectors kept in the queue,
+    so each waypoint is only queried once while it is part of the plan. The edges and the prepared
+    polygons are cached until the vehicle or the queue change, and the polygons with less waypoints,
+    for shorter distances, are truncations of the same edges.
+    """
+
+    def __init__(self, queue):
+        """
+        :param queue: WaypointQueue followed by the vehicle
+        """
+        self._queue = queue
+        self._key = None
+        self._edges = np.zeros((0, 3))
+        self._polygons = {}
+
+    def get_polygon(self, transform, right_extent, left_extent, num_waypoints):
+        """
+        Returns the polygon of the corridor, with the points at both sides of the vehicle
+        and of each waypoint, in that order, or None if there are no waypoints
+
+            :param transform: carla.Transform from which the corridor starts
+            :param right_extent: distance to the right border, along the right vectors
+            :param left_extent: distance to the left border, along the right vectors
+            :param num_waypoints: number of waypoints of the queue covered by the corridor
+            :return: shapely Polygon
+        """
+        location, rotation = transform.location, transform.rotation
+        key = (location.x, location.y, location.z, rotation.pitch, rotation.yaw, rotation.roll,
+               right_extent, left_extent, self._queue.version)
+        if key != self._key:
+            r_vec = transform.get_right_vector()
+            start = np.array([location.x, location.y, location.z])
+            self._edges = np.array([
+                start + (right_extent * r_vec.x, right_extent * r_vec.y, 0),
+                start + (left_extent * r_vec.x, left_extent * r_vec.y, 0)])
+            self._polygons = {}
+            self._key = key
+
+        num_waypoints = min(num_waypoints, len(self._queue))
+        if num_waypoints == 0:
+            return None
+
+        polygon = self._polygons.get(num_waypoints)
+        if polygon is None:
+            # Only the edges of the waypoints not covered yet are added
+            covered = len(self._edges) // 2 - 1
+            if num_waypoints > covered:
+                locations, right_vectors = self._queue.get_right_vectors(num_waypoints)
+                locations, right_vectors = locations[covered:], right_vectors[covered:]
+                edges = np.empty((2 * len(locations), 3))
+                edges[0::2] = locations
+                edges[1::2] = locations
+                edges[0::2, :2] += right_extent * right_vectors
+                edges[1::2, :2] += left_extent * right_vectors
+                self._edges = np.vstack((self._edges, edges))
+
+            polygon = self._polygons[num_waypoints] = Polygon(self._edges[:2 * num_waypoints + 2])
+            if prepare is not None:
+                prepare(polygon)
+        return polygon
+
+
+class SuccessorCache(object):
+    """
+    SuccessorCache answers carla.Waypoint.next for a fixed distance from memory, together with the
+    RoadOption of each successor at the forks. The answers are stored by lane and position along it,
+    quantized, so waypoints closer than the quantum share their successors, and the random
+    waypoints of the agents roaming the same lanes are created once. The least recently used
+    answers are forgotten once the cache is full.
+    """
+
+    def __init__(self, distance, quantum=0.5, max_size=50000):
+        """
+        :param distance: distance to the successors
+        :param quantum: length of the parts of the lanes whose waypoints share their successors
+        :param max_size: maximum number of answers kept in memory
+        """
+        self._distance = distance
+        self._quantum = quantum
+        self._max_size = max_size
+        self._successors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._successors)
+
+    def key(self, waypoint):
+        """Returns the key under which the successors of a waypoint are stored"""
+        return (waypoint.road_id, waypoint.section_id, waypoint.lane_id, int(math.floor(waypoint.s / self._quantum)))
+
+    def successors(self, waypoint, key=None):
+        """
+        Returns the waypoints at the cache distance from a waypoint, and their RoadOption,
+        which is LANEFOLLOW unless there is more than one. Their keys and locations are also
+        returned, so that walking along the lanes doesn't need to query the waypoints
+
+            :param waypoint: carla.Waypoint
+            :param key: key of the waypoint, if already known
+            :return: lists of carla.Waypoint, RoadOption and keys, and (N, 3) array of locations
+        """
+        if key is None:
+            key = self.key(waypoint)
+        with self._lock:
+            successors = self._successors.get(key)
+            if successors is not None:
+                self._successors.move_to_end(key)
+        if successors is None:
+            next_waypoints = list(waypoint.next(self._distance))
+            if len(next_waypoints) == 1:
+                road_options = [RoadOption.LANEFOLLOW]
+            else:
+                road_options = _retrieve_options(next_waypoints, waypoint)
+            keys = [self.key(wp) for wp in next_waypoints]
+            locations = np.array([
+                (wp.transform.location.x, wp.transform.location.y, wp.transform.location.z)
+                for wp in next_waypoints]).reshape(-1, 3)
+            successors = (next_waypoints, road_options, keys, locations)
+            with self._lock:
+                self._successors[key] = successors
+                if len(self._successors) > self._max_size:
+                    self._successors.popitem(last=False)
+        return successors
+
+
+_successor_caches = {}
+_successor_caches_lock = threading.Lock()
+
+
+def get_successor_cache(wmap, distance):
+    """
+    Returns the SuccessorCache of a map and distance shared by the whole process
+
+        :param wmap: carla.Map of the waypoints, identified by its name
+        :param distance: distance to the successors
+        :return: SuccessorCache
+    """
+    key = (wmap.name, float(distance))
+    with _successor_caches_lock:
+        cache = _successor_caches.get(key)
+        if cache is None:
+            cache = _successor_caches[key] = SuccessorCache(distance)
+    return cache
+
+
+def clear_successor_caches():
+    """Forgets the shared successor caches"""
+    with _successor_caches_lock:
+        _successor_caches.clear()
+
+
 class LocalPlanner(object):
     """
     LocalPlanner implements the basic behavior of following a
@@ -53,6 +495,10 @@ class LocalPlanner(object):
             max_brake: maximum brake applied to the vehicle
             max_steering: maximum steering applied to the vehicle
             offset: distance between the route waypoints and the center of the lane
+            successor_cache: whether the random waypoints are created through the SuccessorCache
+                shared by all the planners of the map, instead of asking the map for each of them.
+                Disabled by default, as the cached successors can be up to its quantum away from the
+                ones the map returns
         :param map_inst: carla.Map instance to avoid the expensive call of getting it.
         """
         self._vehicle = vehicle
@@ -70,9 +516,25 @@ class LocalPlanner(object):
         self.target_waypoint = None
         self.target_road_option = None
 
-        self._waypoints_queue = deque(maxlen=10000)
+        self._waypoints_queue = WaypointQueue(maxlen=10000)
+        self._route_corridor = RouteCorridor(self._waypoints_queue)
         self._min_waypoint_queue_length = 100
         self._stop_waypoint_creation = False
+        self._plan_source = None
+
+        # Progress of the vehicle along the plan, as the arc length of its projection
+        self._route_s = None
+        self._route_lateral_error = 0.0
+
+        # Arc length before and after the last progress in which the vehicle is projected onto the plan.
+        # If it is further than the maximum lateral error, such as after a detour, it is searched up to the
+        # maximum jump ahead instead, and the new progress is only used once it is found there during some
+        # consecutive steps, so that a plan passing nearby again doesn't make the vehicle skip the rest of it
+        self._progress_window = (10.0, 30.0)
+        self._max_lateral_error = 5.0
+        self._max_progress_jump = 100.0
+        self._progress_confirmations = 3
+        self._pending_progress = None
 
         # Base parameters
         self._dt = 1.0 / 20.0
@@ -87,6 +549,7 @@ class LocalPlanner(object):
         self._base_min_distance = 3.0
         self._distance_ratio = 0.5
         self._follow_speed_limits = False
+        self._use_successor_cache = False
 
         # Overload parameters
         if opt_dict:
@@ -114,6 +577,12 @@ class LocalPlanner(object):
                 self._distance_ratio = opt_dict['distance_ratio']
             if 'follow_speed_limits' in opt_dict:
                 self._follow_speed_limits = opt_dict['follow_speed_limits']
+            if 'successor_cache' in opt_dict:
+                self._use_successor_cache = opt_dict['successor_cache']
+
+        self._successor_cache = None
+        if self._use_successor_cache:
+            self._successor_cache = get_successor_cache(self._map, self._sampling_radius)
 
         # initializing controller
         self._init_controller()
@@ -169,25 +638,42 @@ class LocalPlanner(object):
         available_entries = self._waypoints_queue.maxlen - len(self._waypoints_queue)
         k = min(available_entries, k)
 
+        new_waypoints = []
+        new_locations = []
+        last_waypoint = self._waypoints_queue[-1][0]
+        last_key = None
         for _ in range(k):
-            last_waypoint = self._waypoints_queue[-1][0]
-            next_waypoints = list(last_waypoint.next(self._sampling_radius))
+            if self._successor_cache is not None:
+                next_waypoints, road_options_list, next_keys, next_locations = \
+                    self._successor_cache.successors(last_waypoint, last_key)
+            else:
+                next_waypoints, road_options_list = list(last_waypoint.next(self._sampling_radius)), None
 
             if len(next_waypoints) == 0:
                 break
             elif len(next_waypoints) == 1:
                 # only one option available ==> lanefollowing
-                next_waypoint = next_waypoints[0]
+                index = 0
                 road_option = RoadOption.LANEFOLLOW
             else:
                 # random choice between the possible options
-                road_options_list = _retrieve_options(
-                    next_waypoints, last_waypoint)
+                if road_options_list is None:
+                    road_options_list = _retrieve_options(
+                        next_waypoints, last_waypoint)
                 road_option = random.choice(road_options_list)
-                next_waypoint = next_waypoints[road_options_list.index(
-                    road_option)]
+                index = road_options_list.index(road_option)
+
+            last_waypoint = next_waypoints[index]
+            new_waypoints.append((last_waypoint, road_option))
+            if self._successor_cache is not None:
+                last_key = next_keys[index]
+                new_locations.append(next_locations[index])
 
-            self._waypoints_queue.append((next_waypoint, road_option))
+        # The locations of the cached successors are already known
+        if new_locations:
+            self._waypoints_queue.extend(new_waypoints, np.array(new_locations))
+        else:
+            self._waypoints_queue.extend(new_waypoints)
 
     def set_global_plan(self, current_plan, stop_waypoint_creation=True, clean_queue=True):
         """
@@ -195,26 +681,59 @@ class LocalPlanner(object):
         The 'clean_queue` parameter erases the previous plan if True, otherwise, it adds it to the old one
         The 'stop_waypoint_creation' flag stops the automatic creation of random waypoints
 
-        :param current_plan: list of (carla.Waypoint, RoadOption)
+        The plan can also be an iterator of pairs, such as the routes of GlobalRoutePlanner.trace_route_lazy,
+        in which case its waypoints are added to the queue as it drains
+
+        :param current_plan: list or iterator of (carla.Waypoint, RoadOption)
         :param stop_waypoint_creation: bool
         :param clean_queue: bool
         :return:
         """
         if clean_queue:
             self._waypoints_queue.clear()
+            self._plan_source = None
+            self._route_s = None
+            self._pending_progress = None
 
-        # Remake the waypoints queue if the new plan has a higher length than the queue
-        new_plan_length = len(current_plan) + len(self._waypoints_queue)
-        if new_plan_length > self._waypoints_queue.maxlen:
-            new_waypoint_queue = deque(maxlen=new_plan_length)
-            for wp in self._waypoints_queue:
-                new_waypoint_queue.append(wp)
-            self._waypoints_queue = new_waypoint_queue
+        self._stop_waypoint_creation = stop_waypoint_creation
 
-        for elem in current_plan:
-            self._waypoints_queue.append(elem)
+        if self._plan_source is not None or not hasattr(current_plan, '__len__'):
+            if self._plan_source is None:
+                self._plan_source = iter(current_plan)
+            else:
+                self._plan_source = chain(self._plan_source, current_plan)
+            self._extend_plan()
+            return
 
-        self._stop_waypoint_creation = stop_waypoint_creation
+        # The queue grows as needed to fit the plan
+        self._waypoints_queue.extend(list(current_plan))
+
+    def replace_plan_tail(self, num_waypoints, plan):
+        """
+        Replaces the last waypoints of the plan with a new list of waypoints, keeping the rest of
+        the queue, for example when only the end of the route changes
+
+        :param num_waypoints: number of waypoints removed from the end of the queue
+        :param plan: list of (carla.Waypoint, RoadOption) added in their place
+        :return:
+        """
+        self._waypoints_queue.pop(num_waypoints)
+        self.set_global_plan(plan, stop_waypoint_creation=self._stop_waypoint_creation, clean_queue=False)
+
+    def _extend_plan(self):
+        """
+        Moves waypoints from the lazy plan to the queue until it has the minimum length.
+        The plan is dropped once it is exhausted
+        """
+        missing = self._min_waypoint_queue_length - len(self._waypoints_queue)
+        missing = min(missing, self._waypoints_queue.maxlen - len(self._waypoints_queue))
+        if missing <= 0:
+            return
+
+        added = list(islice(self._plan_source, missing))
+        self._waypoints_queue.extend(added)
+        if len(added) < missing:
+            self._plan_source = None
 
     def run_step(self, debug=False):
         """
@@ -228,7 +747,9 @@ class LocalPlanner(object):
             self._target_speed = self._vehicle.get_speed_limit()
 
         # Add more waypoints too few in the horizon
-        if not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
+        if self._plan_source is not None:
+            self._extend_plan()
+        elif not self._stop_waypoint_creation and len(self._waypoints_queue) < self._min_waypoint_queue_length:
             self._compute_next_waypoints(k=self._min_waypoint_queue_length)
 
         # Purge the queue of obsolete waypoints
@@ -236,22 +757,15 @@ class LocalPlanner(object):
         vehicle_speed = get_speed(self._vehicle) / 3.6
         self._min_distance = self._base_min_distance + self._distance_ratio * vehicle_speed
 
-        num_waypoint_removed = 0
-        for waypoint, _ in self._waypoints_queue:
-
-            if len(self._waypoints_queue) - num_waypoint_removed == 1:
-                min_distance = 1  # Don't remove the last waypoint until very close by
-            else:
-                min_distance = self._min_distance
-
-            if veh_location.distance(waypoint.transform.location) < min_distance:
-                num_waypoint_removed += 1
-            else:
-                break
-
-        if num_waypoint_removed > 0:
-            for _ in range(num_waypoint_removed):
-                self._waypoints_queue.popleft()
+        # Besides the waypoints close to the vehicle, the ones it has already passed are removed,
+        # so that it doesn't go back to them after cutting a corner or being teleported.
+        # Don't remove the last waypoint until very close by
+        self._update_progress(veh_location)
+        num_waypoint_removed = self._waypoints_queue.num_reached(veh_location, self._min_distance, 1)
+        if self._route_s is not None:
+            num_passed = min(self._waypoints_queue.bisect(self._route_s), len(self._waypoints_queue) - 1)
+            num_waypoint_removed = max(num_waypoint_removed, num_passed)
+        self._waypoints_queue.popleft(num_waypoint_removed)
 
         # Get the target waypoint and move using the PID controllers. Stop if no target waypoint
         if len(self._waypoints_queue) == 0:
@@ -270,6 +784,74 @@ class LocalPlanner(object):
 
         return control
 
+    def _update_progress(self, location):
+        """
+        Projects the vehicle onto the plan, around its last progress. When it is too far from the plan there,
+        the progress is kept until the vehicle is found further ahead during consecutive steps
+        """
+        if len(self._waypoints_queue) == 0:
+            return
+
+        last_s = self._route_s if self._route_s is not None else self._waypoints_queue.get_s(0)
+        back, ahead = self._progress_window
+        route_s, lateral_error = self._waypoints_queue.project(location, last_s - back, last_s + ahead)
+        if abs(lateral_error) <= self._max_lateral_error:
+            self._pending_progress = None
+            self._route_s, self._route_lateral_error = route_s, lateral_error
+            return
+
+        jump_s, jump_error = self._waypoints_queue.project(location, last_s - back, last_s + self._max_progress_jump)
+        if abs(jump_error) > self._max_lateral_error:
+            self._pending_progress = None
+        else:
+            # Confirmed when found at increasing arc lengths, close to each other, during consecutive steps
+            confirmations = 1
+            if self._pending_progress is not None:
+                pending_s, pending_confirmations = self._pending_progress
+                if pending_s <= jump_s <= pending_s + ahead:
+                    confirmations = pending_confirmations + 1
+            if confirmations >= self._progress_confirmations:
+                self._pending_progress = None
+                self._route_s, self._route_lateral_error = jump_s, jump_error
+                return
+            self._pending_progress = (jump_s, confirmations)
+
+        self._route_s, self._route_lateral_error = last_s, lateral_error
+
+    def get_route_progress(self):
+        """
+        Returns the progress of the vehicle along the plan, as updated by the last run_step
+
+            :return: arc length of the vehicle along the plan since its start, lateral distance
+                to the plan, positive to its right, and distance left until the end of the plan.
+                None if the plan is empty
+        """
+        if self._route_s is None or len(self._waypoints_queue) == 0:
+            return None
+        remaining_distance = max(self._waypoints_queue.get_s(-1) - self._route_s, 0.0)
+        return self._route_s, self._route_lateral_error, remaining_distance
+
+    def get_route_distance(self, index):
+        """
+        Returns the distance along the plan from the vehicle to one of its waypoints, in constant time
+
+            :param index: position of the waypoint in the plan
+        """
+        route_s = self._route_s if self._route_s is not None else self._waypoints_queue.get_s(0)
+        return self._waypoints_queue.get_s(index) - route_s
+
+    def get_route_index(self, distance):
+        """
+        Returns the number of waypoints of the plan that are closer than a distance along the plan
+        to the vehicle, in O(log n)
+
+            :param distance: distance along the plan
+        """
+        if len(self._waypoints_queue) == 0:
+            return 0
+        route_s = self._route_s if self._route_s is not None else self._waypoints_queue.get_s(0)
+        return self._waypoints_queue.bisect(route_s + distance)
+
     def get_incoming_waypoint_and_direction(self, steps=3):
         """
         Returns direction and waypoint at a distance ahead defined by the user.
@@ -286,8 +868,22 @@ class LocalPlanner(object):
             except IndexError as i:
                 return None, RoadOption.VOID
 
+    def get_route_corridor(self, transform, right_extent, left_extent, distance):
+        """
+        Returns the polygon covered by the vehicle following the plan, up to the first waypoint
+        farther than a distance from the start of the corridor
+
+            :param transform: carla.Transform from which the corridor starts
+            :param right_extent: distance to the right border, along the right vectors of the waypoints
+            :param left_extent: distance to the left border, along the right vectors of the waypoints
+            :param distance: distance to the start of the corridor
+            :return: shapely Polygon, or None if there are no waypoints within the distance
+        """
+        return self._route_corridor.get_polygon(
+            transform, right_extent, left_extent, self._waypoints_queue.num_within(transform.location, distance))
+
     def get_plan(self):
-        """Returns the current plan of the local planner"""
+        """Returns the current plan of the local planner. Lazy plans are only part of it once expanded"""
         return self._waypoints_queue
 
     def done(self):
@@ -296,7 +892,7 @@ class LocalPlanner(object):
 
         :return: boolean
         """
-        return len(self._waypoints_queue) == 0
+        return len(self._waypoints_queue) == 0 and self._plan_source is None
 
 
 def _retrieve_options(list_waypoints, current_waypoint):
@@ -0,0 +1,92 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+
+"""
+This module provides a scheduler that runs the stages of an agent, such as its traffic light
+or obstacle checks, at their own rates.
+"""
+
+
+class StageScheduler(object):
+    """
+    StageScheduler runs each stage of an agent at its own rate, and reuses its last output
+    in the steps in between. Stages without a rate run at every step.
+
+    The output of a stage is also refreshed when the ego has moved too far since it was computed,
+    and all stages run at every step while the ego is faster than the refresh speed.
+    """
+
+    def __init__(self, dt, rates={}, max_distance=None, refresh_speed=None):
+        """
+        :param dt: time between the steps of the agent
+        :param rates: dictionary with the frequency, in Hz, of the stages
+        :param max_distance: distance the ego can move before the outputs are refreshed.
+            If None, only the rates are used
+        :param refresh_speed: speed of the ego, in Km/h, from which all the stages run at every step.
+            If None, the rates are always used
+        """
+        self._periods = {}
+        for stage, rate in rates.items():
+            if rate:
+                self._periods[stage] = max(int(round(1.0 / (rate * dt))), 1)
+        self._max_distance = max_distance
+        self._refresh_speed = refresh_speed
+
+        self._step = 0
+        self._location = None
+        self._refresh_all = True
+        self._outputs = {}
+
+    def tick(self, location, speed):
+        """
+        Starts a new step of the agent. Has to be called once per step, before running the stages
+
+            :param location: carla.Location of the ego
+            :param speed: speed of the ego, in Km/h
+        """
+        self._step += 1
+        self._location = location
+        self._refresh_all = self._refresh_speed is not None and speed >= self._refresh_speed
+
+    def run(self, stage, function, *args, refresh=None):
+        """
+        Returns the output of a stage, running it if it is due, or reusing its last output otherwise
+
+            :param stage: name of the stage
+            :param function: function computing the output of the stage
+            :param args: arguments of the function
+            :param refresh: optional function applied to a reused output to update it, such as
+                the distance to a detected obstacle
+        """
+        if self.is_due(stage):
+            output = function(*args)
+            self._outputs[stage] = (output, self._step, self._location)
+            return output
+
+        output = self._outputs[stage][0]
+        if refresh is not None:
+            return refresh(output)
+        return output
+
+    def is_due(self, stage):
+        """Returns whether a stage runs at its next call in this step, instead of reusing its last output"""
+        period = self._periods.get(stage)
+        entry = self._outputs.get(stage)
+        return period is None or entry is None or self._refresh_all or self._step - entry[1] >= period \
+            or self._moved(entry[2])
+
+    def invalidate(self, stage=None):
+        """Forces a stage, or all of them if None, to run at its next call"""
+        if stage is None:
+            self._outputs.clear()
+        else:
+            self._outputs.pop(stage, None)
+
+    def _moved(self, location):
+        """Returns whether the ego is further than the maximum distance from a location"""
+        if self._max_distance is None or location is None or self._location is None:
+            return False
+        return self._location.distance(location) > self._max_distance
@@ -0,0 +1,95 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+
+"""
+This module provides an index of the traffic lights of a map by the road of their trigger volume.
+"""
+
+import threading
+
+from agents.tools.misc import get_trafficlight_trigger_location
+
+
+class TrafficLightIndex(object):
+    """
+    TrafficLightIndex stores the waypoint of the trigger volume of each traffic light, grouped
+    by road, together with its location and forward vector. The agents only check the lights
+    whose trigger is on their road, instead of all the lights of the world.
+
+    The lights are added as they are first seen, as their trigger volumes don't change.
+    """
+
+    def __init__(self, wmap):
+        """
+        :param wmap: carla.Map where the triggers are localized
+        """
+        self._map = wmap
+        self._triggers = {}
+        self._roads = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._triggers)
+
+    def __contains__(self, light_id):
+        return light_id in self._triggers
+
+    def add(self, traffic_lights):
+        """
+        Adds the traffic lights that aren't part of the index yet
+
+            :param traffic_lights: list of carla.TrafficLight
+        """
+        missing = [light for light in traffic_lights if light.id not in self._triggers]
+        if not missing:
+            return
+        with self._lock:
+            for traffic_light in missing:
+                if traffic_light.id in self._triggers:
+                    continue
+                trigger_location = get_trafficlight_trigger_location(traffic_light)
+                trigger_wp = self._map.get_waypoint(trigger_location)
+                trigger = (traffic_light.id, trigger_wp, trigger_wp.transform.location,
+                           trigger_wp.transform.get_forward_vector())
+                self._triggers[traffic_light.id] = trigger
+                self._roads.setdefault(trigger_wp.road_id, []).append(trigger)
+
+    def get_trigger_waypoint(self, light_id):
+        """Returns the waypoint of the trigger volume of a traffic light"""
+        return self._triggers[light_id][1]
+
+    def get_road_triggers(self, road_id):
+        """
+        Returns the triggers of the traffic lights on a road
+
+            :param road_id: id of the road
+            :return: list of (traffic light id, carla.Waypoint, carla.Location, carla.Vector3D forward vector)
+        """
+        return self._roads.get(road_id, [])
+
+
+_traffic_light_indexes = {}
+_traffic_light_indexes_lock = threading.Lock()
+
+
+def get_traffic_light_index(wmap):
+    """
+    Returns the TrafficLightIndex of a map shared by the whole process
+
+        :param wmap: carla.Map of the traffic lights, identified by its name
+        :return: TrafficLightIndex
+    """
+    with _traffic_light_indexes_lock:
+        index = _traffic_light_indexes.get(wmap.name)
+        if index is None:
+            index = _traffic_light_indexes[wmap.name] = TrafficLightIndex(wmap)
+    return index
+
+
+def clear_traffic_light_indexes():
+    """Forgets the shared traffic light indexes"""
+    with _traffic_light_indexes_lock:
+        _traffic_light_indexes.clear()
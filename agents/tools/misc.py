@@ -103,6 +103,74 @@ def is_within_distance(target_transform, reference_transform, max_distance, angl
     return min_angle < angle < max_angle
 
 
+def are_within_distance(target_points, reference_transform, max_distance, angle_interval=None):
+    """
+    Vectorized version of is_within_distance, for an array of target locations.
+
+    :param target_points: (N, 2) or (N, 3) array with the locations of the targets
+    :param reference_transform: location of the reference object
+    :param max_distance: maximum allowed distance
+    :param angle_interval: only locations between [min, max] angles will be considered. This isn't checked by default.
+    :return: (N,) boolean array
+    """
+    target_vectors = np.asarray(target_points, dtype=float)[:, :2] - np.array([
+        reference_transform.location.x, reference_transform.location.y])
+    norms = np.linalg.norm(target_vectors, axis=1)
+    within = norms <= max_distance
+
+    if angle_interval:
+        fwd = reference_transform.get_forward_vector()
+        forward_vector = np.array([fwd.x, fwd.y])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosines = np.clip(target_vectors.dot(forward_vector) / norms, -1., 1.)
+        angles = np.degrees(np.arccos(cosines))
+        within &= (angle_interval[0] < angles) & (angles < angle_interval[1])
+
+    # If the vector is too short, the target is always within distance
+    return within | (norms < 0.001)
+
+
+def rotate_vectors(vectors, rotations):
+    """
+    Rotates vectors as carla.Rotation does, for arrays of vectors and rotations.
+
+    :param vectors: (N, 3) array of vectors
+    :param rotations: (N, 3) array with the pitch, yaw and roll of the rotations, in degrees
+    :return: (N, 3) array of rotated vectors
+    """
+    pitch, yaw, roll = np.radians(rotations).T
+    cp, sp = np.cos(pitch), np.sin(pitch)
+    cy, sy = np.cos(yaw), np.sin(yaw)
+    cr, sr = np.cos(roll), np.sin(roll)
+    x, y, z = np.asarray(vectors, dtype=float).T
+    return np.stack((
+        x * (cp * cy) + y * (cy * sp * sr - sy * cr) + z * (-cy * sp * cr - sy * sr),
+        x * (cp * sy) + y * (sy * sp * sr + cy * cr) + z * (-sy * sp * cr + cy * sr),
+        x * sp + y * (-cp * sr) + z * (cp * cr)), axis=1)
+
+
+def get_world_vertices(locations, rotations, extents, box_locations, box_rotations=None):
+    """
+    Vectorized version of carla.BoundingBox.get_world_vertices, for the bounding boxes of several actors.
+    The vertices are in the same order.
+
+    :param locations: (N, 3) array with the locations of the actors
+    :param rotations: (N, 3) array with the pitch, yaw and roll of the actors, in degrees
+    :param extents: (N, 3) array with the extents of the bounding boxes
+    :param box_locations: (N, 3) array with the locations of the bounding boxes, relative to the actors
+    :param box_rotations: (N, 3) array with the rotations of the bounding boxes, relative to the actors
+    :return: (N, 8, 3) array of vertices
+    """
+    signs = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    count = len(locations)
+    corners = (np.asarray(extents, dtype=float)[:, np.newaxis, :] * signs).reshape(-1, 3)
+    if box_rotations is not None:
+        corners = rotate_vectors(corners, np.repeat(box_rotations, 8, axis=0))
+    corners += np.repeat(box_locations, 8, axis=0)
+    vertices = rotate_vectors(corners, np.repeat(rotations, 8, axis=0)) + np.repeat(locations, 8, axis=0)
+    return vertices.reshape(count, 8, 3)
+
+
 def compute_magnitude_angle(target_location, current_location, orientation):
     """
     Compute relative angle and distance between a target_location and a current_location
@@ -0,0 +1,68 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Module to load OpenDRIVE (.xodr) maps without a running simulator.
+
+The maps are built by the CARLA client library from the OpenDRIVE content, so they have
+the same topology, lanes and waypoints as the ones of the server. They can be used in place
+of the map of the world, for example to build a GlobalRoutePlanner and warm its caches.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+
+import carla
+
+
+def read_opendrive(source):
+    """
+    Returns the OpenDRIVE content of a map, checking that it is a valid OpenDRIVE document.
+
+        :param source: path to a .xodr file, or the OpenDRIVE content itself,
+            such as the output of carla.Map.to_opendrive()
+        :return: tuple (OpenDRIVE content, name of the map found in its header, or None)
+    """
+    if source.lstrip().startswith('<'):
+        content = source
+    else:
+        with open(source, encoding='utf-8') as od_file:
+            content = od_file.read()
+
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError as error:
+        raise ValueError("Invalid OpenDRIVE content: {}".format(error))
+    if root.tag != 'OpenDRIVE':
+        raise ValueError("Invalid OpenDRIVE content: the root element is '{}'".format(root.tag))
+    if root.find('road') is None:
+        raise ValueError("Invalid OpenDRIVE content: the map has no roads")
+
+    header = root.find('header')
+    name = header.get('name') if header is not None else None
+    return content, name or None
+
+
+def load_opendrive_map(source, name=None):
+    """
+    Builds a carla.Map from an OpenDRIVE file or content, without connecting to a simulator.
+
+    The route planner caches are keyed by the name and content of the map, so to reuse them
+    with the map of a running simulator, pass the name of that map (for example
+    'Carla/Maps/Town10HD_Opt') and its carla.Map.to_opendrive() output.
+
+        :param source: path to a .xodr file, or the OpenDRIVE content itself
+        :param name: name of the map. Defaults to the name of the file, or to the one in the
+            OpenDRIVE header if the content is given directly
+        :return: carla.Map
+    """
+    content, header_name = read_opendrive(source)
+    if not name:
+        if not source.lstrip().startswith('<'):
+            name = os.path.splitext(os.path.basename(source))[0]
+        else:
+            name = header_name or 'OpenDRIVE'
+
+    return carla.Map(name, content)
@@ -0,0 +1,132 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Module with a spatial index of points, used to find the actors around a location
+without checking the distance to all of them.
+"""
+
+import math
+
+import numpy as np
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # Without scipy, the queries that cover most of the grid check all the points
+    cKDTree = None
+
+
+class SpatialIndex(object):
+    """
+    SpatialIndex stores points in a uniform grid, hashed by cell, to answer radius and nearest
+    neighbor queries by only checking the points of the cells around the query.
+
+    Queries that would go through more cells than the grid has, such as large radii
+    over sparse points, use a KD-tree of the points instead, built the first time it is needed.
+    Few points are simply all checked, which is faster than going through the grid.
+    """
+
+    def __init__(self, points, cell_size=20.0, min_grid_size=256):
+        """
+        :param points: (N, 3) array of points
+        :param cell_size: size of the cells of the grid, in the XY plane
+        :param min_grid_size: number of points from which the grid is used
+        """
+        self._points = np.asarray(points, dtype=float).reshape(-1, 3)
+        self._cell_size = cell_size
+        self._kdtree = None
+        self._use_grid = len(self._points) >= max(min_grid_size, 1)
+
+        # The points are sorted by cell, with the cells of each column of the grid next to each other,
+        # so the points of the cells of a column between two rows are a slice of the sorted points
+        if self._use_grid:
+            cells = np.floor(self._points[:, :2] / cell_size).astype(np.int64)
+            self._min_x, self._min_y = cells.min(axis=0).tolist()
+            self._max_x, self._max_y = cells.max(axis=0).tolist()
+            self._column_length = self._max_y - self._min_y + 1
+            keys = self._key(cells[:, 0], cells[:, 1])
+            self._order = np.argsort(keys, kind='stable')
+            self._keys = keys[self._order]
+            self._num_cells = int(np.count_nonzero(np.diff(self._keys))) + 1
+        if len(self._points) > 0:
+            self._lower = self._points.min(axis=0)
+            self._upper = self._points.max(axis=0)
+
+    def __len__(self):
+        return len(self._points)
+
+    def _key(self, cell_x, cell_y):
+        """Returns the key of the cells with the given indices, sorted by column and then by row"""
+        return (cell_x - self._min_x) * self._column_length + (cell_y - self._min_y)
+
+    def _candidates(self, point, radius):
+        """Returns the rows of the points that can be closer than the radius to a point, as a superset"""
+        if not self._use_grid:
+            return np.arange(len(self._points))
+
+        x, y = float(point[0]), float(point[1])
+        low_x = max(int(math.floor((x - radius) / self._cell_size)), self._min_x)
+        low_y = max(int(math.floor((y - radius) / self._cell_size)), self._min_y)
+        high_x = min(int(math.floor((x + radius) / self._cell_size)), self._max_x)
+        high_y = min(int(math.floor((y + radius) / self._cell_size)), self._max_y)
+        if low_x > high_x or low_y > high_y:
+            return np.zeros(0, dtype=np.int64)
+
+        if (high_x - low_x + 1) * (high_y - low_y + 1) > self._num_cells:
+            if cKDTree is None:
+                return np.arange(len(self._points))
+            if self._kdtree is None:
+                self._kdtree = cKDTree(self._points)
+            return np.array(self._kdtree.query_ball_point(point, radius), dtype=np.int64)
+
+        columns = np.arange(low_x, high_x + 1)
+        starts = np.searchsorted(self._keys, self._key(columns, low_y), side='left')
+        ends = np.searchsorted(self._keys, self._key(columns, high_y), side='right')
+        return np.concatenate([self._order[start:end] for start, end in zip(starts.tolist(), ends.tolist())])
+
+    def query_radius(self, location, radius, mask=None):
+        """
+        Returns the rows of the points closer than a radius to a location
+
+            :param location: carla.Location of the query
+            :param radius: distance to the location
+            :param mask: optional boolean array selecting the points that can be returned
+            :return: array of rows, in increasing order
+        """
+        point = np.array([location.x, location.y, location.z])
+        rows = self._candidates(point, radius)
+        if mask is not None:
+            rows = rows[mask[rows]]
+        rows = rows[np.linalg.norm(self._points[rows] - point, axis=1) < radius]
+        return np.sort(rows)
+
+    def query_nearest(self, location, count, mask=None, max_distance=None):
+        """
+        Returns the rows of the points closest to a location, and their distances. The search radius
+        grows from the size of a cell until enough points are found.
+
+            :param location: carla.Location of the query
+            :param count: maximum number of points returned
+            :param mask: optional boolean array selecting the points that can be returned
+            :param max_distance: if given, only the points closer than it are returned
+            :return: arrays of rows and distances, sorted by distance
+        """
+        point = np.array([location.x, location.y, location.z])
+        rows = np.zeros(0, dtype=np.int64)
+        if len(self._points) > 0:
+            # Beyond this radius, all the points are covered
+            reach = np.linalg.norm(np.maximum(np.abs(point - self._lower), np.abs(point - self._upper))) + 1.0
+            radius = self._cell_size
+            while True:
+                if max_distance is not None:
+                    radius = min(radius, max_distance)
+                rows = self.query_radius(location, radius, mask)
+                if len(rows) >= count or radius >= reach or radius == max_distance:
+                    break
+                radius *= 2
+
+        distances = np.linalg.norm(self._points[rows] - point, axis=1)
+        order = np.argsort(distances, kind='stable')[:count]
+        return rows[order], distances[order]
@@ -0,0 +1,237 @@
+# Copyright (c) # Copyright (c) 2018-2020 CVC.
+#
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Module with a per frame view of the actors of the world, shared by all the agents of the process.
+
+The state of the actors is read once per frame from the world snapshot and stored as numpy columns,
+so that the agents don't query the actors one by one. Only the actors that weren't part of the
+previous frame are retrieved from the world, for their type and bounding box.
+"""
+
+from fnmatch import fnmatchcase
+import threading
+
+import numpy as np
+import carla
+
+from agents.tools.spatial_index import SpatialIndex
+
+
+class WorldState(object):
+    """
+    WorldState holds the ids, types, transforms, velocities and bounding boxes of the actors
+    of one frame, as numpy columns. The actors themselves can be accessed as ActorState,
+    which answer the usual carla.Actor queries from these columns.
+    """
+
+    def __init__(self, world, snapshot, previous=None):
+        """
+        :param world: carla.World of the actors
+        :param snapshot: carla.WorldSnapshot of the frame
+        :param previous: WorldState of a previous frame, whose static information is reused
+        """
+        self.frame = snapshot.frame
+        self.timestamp = snapshot.timestamp
+        self.episode_id = snapshot.id
+
+        # Type and bounding box of the actors, which don't change during their lifetime
+        static = {}
+        if previous is not None and previous.episode_id == self.episode_id:
+            static = previous._static
+        actor_snapshots = list(snapshot)
+        missing = [a.id for a in actor_snapshots if a.id not in static]
+        if missing:
+            static = dict(static)
+            for actor in world.get_actors(missing):
+                static[actor.id] = (actor, actor.type_id, actor.bounding_box)
+
+        # Actors destroyed before they could be retrieved are left out
+        actor_snapshots = [a for a in actor_snapshots if a.id in static]
+        self._static = {a.id: static[a.id] for a in actor_snapshots}
+
+        transforms = [a.get_transform() for a in actor_snapshots]
+        velocities = [a.get_velocity() for a in actor_snapshots]
+        boxes = [self._static[a.id][2] for a in actor_snapshots]
+
+        self.ids = np.array([a.id for a in actor_snapshots], dtype=np.int64)
+        self.type_ids = [self._static[a.id][1] for a in actor_snapshots]
+        self.locations = np.array(
+            [(t.location.x, t.location.y, t.location.z) for t in transforms]).reshape(-1, 3)
+        self.rotations = np.array(
+            [(t.rotation.pitch, t.rotation.yaw, t.rotation.roll) for t in transforms]).reshape(-1, 3)
+        self.velocities = np.array([(v.x, v.y, v.z) for v in velocities]).reshape(-1, 3)
+        self.extents = np.array([(b.extent.x, b.extent.y, b.extent.z) for b in boxes]).reshape(-1, 3)
+        self.box_locations = np.array([(b.location.x, b.location.y, b.location.z) for b in boxes]).reshape(-1, 3)
+        self.box_rotations = np.array(
+            [(b.rotation.pitch, b.rotation.yaw, b.rotation.roll) for b in boxes]).reshape(-1, 3)
+
+        self._index = {actor_id: i for i, actor_id in enumerate(self.ids.tolist())}
+        self._masks = {}
+        self._actor_states = {}
+        self._traffic_light_states = {}
+        self._spatial_index = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, actor_id):
+        return actor_id in self._index
+
+    def index(self, actor_id):
+        """Returns the row of an actor in the columns, or None if it isn't part of the frame"""
+        return self._index.get(actor_id)
+
+    def mask(self, pattern):
+        """Returns the boolean mask of the actors whose type matches a wildcard pattern, as carla.ActorList.filter"""
+        mask = self._masks.get(pattern)
+        if mask is None:
+            mask = self._masks[pattern] = np.array(
+                [fnmatchcase(type_id, pattern) for type_id in self.type_ids], dtype=bool)
+        return mask
+
+    def filter(self, pattern, location=None, max_distance=None):
+        """
+        Returns the actors whose type matches a wildcard pattern, as carla.ActorList.filter
+
+            :param pattern: wildcard pattern of the type ids, such as '*vehicle*'
+            :param location: if given, only the actors closer than 'max_distance' to it are returned
+            :param max_distance: distance to the location
+            :return: ActorStateList
+        """
+        mask = self.mask(pattern)
+        if location is not None and max_distance is not None:
+            return ActorStateList(self, self.get_spatial_index().query_radius(location, max_distance, mask))
+        return ActorStateList(self, np.flatnonzero(mask))
+
+    def nearest(self, pattern, location, count=None, max_distance=None):
+        """
+        Returns the actors whose type matches a wildcard pattern, sorted by their distance to a location
+
+            :param pattern: wildcard pattern of the type ids, such as '*vehicle*'
+            :param location: carla.Location of the query
+            :param count: maximum number of actors returned. If None, all of them are returned
+            :param max_distance: if given, only the actors closer than it are returned
+            :return: list of (distance, ActorState)
+        """
+        if count is None:
+            count = len(self)
+        rows, distances = self.get_spatial_index().query_nearest(location, count, self.mask(pattern), max_distance)
+        return [(float(d), self.actor(i)) for i, d in zip(rows.tolist(), distances.tolist())]
+
+    def get_spatial_index(self):
+        """Returns the SpatialIndex of the locations of the actors, built the first time it is needed"""
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.locations)
+        return self._spatial_index
+
+    def actor(self, index):
+        """Returns the ActorState of the actor at a row of the columns"""
+        actor_state = self._actor_states.get(index)
+        if actor_state is None:
+            actor_state = self._actor_states[index] = ActorState(self, index)
+        return actor_state
+
+    def get_actor(self, actor_id):
+        """Returns the ActorState of an actor, or None if it isn't part of the frame"""
+        index = self._index.get(actor_id)
+        return None if index is None else self.actor(index)
+
+    def get_transform(self, actor_id):
+        """Returns the carla.Transform of an actor in this frame"""
+        return self.actor(self._index[actor_id]).get_transform()
+
+    def get_traffic_light_state(self, actor_id):
+        """
+        Returns the carla.TrafficLightState of a traffic light in this frame. The snapshots of
+        the actors don't include it, so it is read from the light the first time it is asked for
+        in the frame, and shared by the following queries
+        """
+        state = self._traffic_light_states.get(actor_id)
+        if state is None:
+            state = self._traffic_light_states[actor_id] = self._static[actor_id][0].state
+        return state
+
+
+class ActorStateList(list):
+    """
+    List of the ActorState of some rows of a WorldState. The rows are kept along,
+    so that the columns of the actors can be read without going through the list.
+    """
+
+    def __init__(self, world_state, rows):
+        """
+        :param world_state: WorldState of the actors
+        :param rows: array with the rows of the actors in the columns
+        """
+        super(ActorStateList, self).__init__(world_state.actor(i) for i in rows)
+        self.world_state = world_state
+        self.rows = rows
+
+
+class ActorState(object):
+    """
+    ActorState is the state of an actor in a WorldState. It answers the queries about the transform,
+    velocity and bounding box of the actor from the columns of its frame, and forwards the rest
+    to the carla.Actor.
+    """
+
+    def __init__(self, world_state, index):
+        """
+        :param world_state: WorldState of the actor
+        :param index: row of the actor in the columns
+        """
+        self._world_state = world_state
+        self._row = index
+        self.id = int(world_state.ids[index])
+        self.actor, self.type_id, self.bounding_box = world_state._static[self.id]
+
+    def __getattr__(self, name):
+        return getattr(self.actor, name)
+
+    @property
+    def is_alive(self):
+        """Actors are alive in the frames they are part of"""
+        return True
+
+    def get_location(self):
+        """Returns the carla.Location of the actor"""
+        return carla.Location(*self._world_state.locations[self._row].tolist())
+
+    def get_transform(self):
+        """Returns the carla.Transform of the actor"""
+        return carla.Transform(
+            carla.Location(*self._world_state.locations[self._row].tolist()),
+            carla.Rotation(*self._world_state.rotations[self._row].tolist()))
+
+    def get_velocity(self):
+        """Returns the carla.Vector3D velocity of the actor"""
+        return carla.Vector3D(*self._world_state.velocities[self._row].tolist())
+
+
+_world_states = {}
+_world_states_lock = threading.Lock()
+
+
+def get_world_state(world):
+    """
+    Returns the WorldState of the current frame of a world, shared by the whole process.
+    It is built by the first call of each frame, the following ones only read the frame number.
+
+        :param world: carla.World
+        :return: WorldState
+    """
+    snapshot = world.get_snapshot()
+    with _world_states_lock:
+        world_state = _world_states.get(snapshot.id)
+        if world_state is None or world_state.frame != snapshot.frame:
+            world_state = _world_states[snapshot.id] = WorldState(world, snapshot, world_state)
+    return world_state
+
+
+def clear_world_states():
+    """Forgets the shared world states"""
+    with _world_states_lock:
+        _world_states.clear()
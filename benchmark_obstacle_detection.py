@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the vehicle obstacle detection of the agents. Compares the batched
+BasicAgent._vehicle_obstacle_detected against the previous implementation, which checks
+the vehicles one by one, and verifies that both detect the same vehicles.
+
+The scenes are synthetic: the vehicles are placed on random waypoints of the map, and both
+implementations read them from the WorldState of the frame, as the agents do with 'use_world_state'.
+The map is taken from a running simulator or, with --xodr, built locally from an OpenDRIVE file.
+"""
+
+import glob
+import os
+import sys
+import time
+from itertools import count
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+
+import argparse
+import random
+import networkx as nx
+from shapely.geometry import Polygon
+
+from agents.navigation.basic_agent import BasicAgent
+from agents.tools.world_state import get_world_state
+from agents.tools.misc import is_within_distance, compute_distance
+from agents.tools.opendrive import load_opendrive_map
+
+
+_episode_ids = count()
+
+
+def get_map(args):
+    if args.xodr:
+        return load_opendrive_map(args.xodr)
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    return client.get_world().get_map()
+
+
+class SceneActor(object):
+    """Vehicle of a synthetic scene, with the part of the carla.Actor interface used by the agents"""
+
+    def __init__(self, world, actor_id, transform):
+        self.id = actor_id
+        self.type_id = 'vehicle.synthetic'
+        self.bounding_box = carla.BoundingBox(carla.Location(0.0, 0.0, 0.7), carla.Vector3D(2.3, 1.0, 0.7))
+        self._world = world
+        self._transform = transform
+
+    def get_world(self):
+        return self._world
+
+    def get_transform(self):
+        return carla.Transform(self._transform.location, self._transform.rotation)
+
+    def get_location(self):
+        return carla.Location(self._transform.location)
+
+    def get_velocity(self):
+        return carla.Vector3D()
+
+    def get_control(self):
+        return carla.VehicleControl()
+
+    def get_speed_limit(self):
+        return 30.0
+
+
+class SceneActorList(list):
+    """List of the actors of a synthetic scene"""
+
+    def filter(self, pattern):
+        return SceneActorList(a for a in self if pattern.strip('*') in a.type_id)
+
+
+class SceneSnapshot(list):
+    """Snapshot of a synthetic scene, which never changes"""
+
+    def __init__(self, actors, episode_id):
+        super(SceneSnapshot, self).__init__(actors)
+        self.id = episode_id
+        self.frame = 0
+        self.timestamp = None
+
+
+class SceneWorld(object):
+    """World of a synthetic scene"""
+
+    def __init__(self, world_map, episode_id):
+        self.map = world_map
+        self.actors = SceneActorList()
+        self.episode_id = episode_id
+
+    def get_map(self):
+        return self.map
+
+    def get_snapshot(self):
+        return SceneSnapshot(self.actors, self.episode_id)
+
+    def get_actors(self, actor_ids=None):
+        if actor_ids is None:
+            return SceneActorList(self.actors)
+        return SceneActorList(a for a in self.actors if a.id in set(actor_ids))
+
+
+def reference_obstacle_detected(agent, vehicle_list, max_distance, up_angle_th=90, low_angle_th=0, lane_offset=0):
+    """Previous implementation of BasicAgent._vehicle_obstacle_detected, checking the vehicles one by one"""
+    def get_route_polygon():
+        route_bb = []
+        extent_y = agent._vehicle.bounding_box.extent.y
+        r_ext = extent_y + agent._offset
+        l_ext = -extent_y + agent._offset
+        r_vec = ego_transform.get_right_vector()
+        p1 = ego_location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
+        p2 = ego_location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
+        route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
+
+        for wp, _ in agent._local_planner.get_plan():
+            if ego_location.distance(wp.transform.location) > max_distance:
+                break
+
+            r_vec = wp.transform.get_right_vector()
+            p1 = wp.transform.location + carla.Location(r_ext * r_vec.x, r_ext * r_vec.y)
+            p2 = wp.transform.location + carla.Location(l_ext * r_vec.x, l_ext * r_vec.y)
+            route_bb.extend([[p1.x, p1.y, p1.z], [p2.x, p2.y, p2.z]])
+
+        if len(route_bb) < 3:
+            return None
+
+        return Polygon(route_bb)
+
+    ego_transform = agent._vehicle.get_transform()
+    ego_location = ego_transform.location
+    ego_wpt = agent._get_lane_position(ego_location)
+
+    if ego_wpt.lane_id < 0 and lane_offset != 0:
+        lane_offset *= -1
+
+    ego_front_transform = ego_transform
+    ego_front_transform.location += carla.Location(
+        agent._vehicle.bounding_box.extent.x * ego_transform.get_forward_vector())
+
+    opposite_invasion = abs(agent._offset) + agent._vehicle.bounding_box.extent.y > ego_wpt.lane_width / 2
+    use_bbs = agent._use_bbs_detection or opposite_invasion or ego_wpt.is_junction
+
+    route_polygon = get_route_polygon()
+
+    for target_vehicle in vehicle_list:
+        if target_vehicle.id == agent._vehicle.id:
+            continue
+
+        target_transform = target_vehicle.get_transform()
+        if target_transform.location.distance(ego_location) > max_distance:
+            continue
+
+        target_wpt = agent._get_lane_position(target_transform.location, lane_type=carla.LaneType.Any)
+
+        if (use_bbs or target_wpt.is_junction) and route_polygon:
+            target_bb = target_vehicle.bounding_box
+            target_vertices = target_bb.get_world_vertices(target_vehicle.get_transform())
+            target_list = [[v.x, v.y, v.z] for v in target_vertices]
+            target_polygon = Polygon(target_list)
+
+            if route_polygon.intersects(target_polygon):
+                return (True, target_vehicle, compute_distance(target_vehicle.get_location(), ego_location))
+
+        else:
+            if target_wpt.road_id != ego_wpt.road_id or target_wpt.lane_id != ego_wpt.lane_id + lane_offset:
+                next_wpt = agent._local_planner.get_incoming_waypoint_and_direction(steps=3)[0]
+                if not next_wpt:
+                    continue
+                if target_wpt.road_id != next_wpt.road_id or target_wpt.lane_id != next_wpt.lane_id + lane_offset:
+                    continue
+
+            target_forward_vector = target_transform.get_forward_vector()
+            target_extent = target_vehicle.bounding_box.extent.x
+            target_rear_transform = target_transform
+            target_rear_transform.location -= carla.Location(
+                x=target_extent * target_forward_vector.x,
+                y=target_extent * target_forward_vector.y,
+            )
+
+            if is_within_distance(target_rear_transform, ego_front_transform, max_distance, [low_angle_th, up_angle_th]):
+                return (True, target_vehicle, compute_distance(target_transform.location, ego_transform.location))
+
+    return (False, None, -1)
+
+
+def create_scene(world_map, waypoints, number_of_actors, seed):
+    """Returns a BasicAgent following a random route, with vehicles on random waypoints of the map"""
+    random.seed(seed)
+    world = SceneWorld(world_map, next(_episode_ids))
+    ego_waypoint = random.choice(waypoints)
+    ego = SceneActor(world, 1, ego_waypoint.transform)
+    world.actors.append(ego)
+
+    for i in range(number_of_actors):
+        wp = random.choice(waypoints)
+        transform = carla.Transform(
+            wp.transform.location + carla.Location(random.uniform(-1, 1), random.uniform(-1, 1)),
+            carla.Rotation(yaw=wp.transform.rotation.yaw + random.uniform(-10, 10)))
+        world.actors.append(SceneActor(world, 100 + i, transform))
+
+    agent = BasicAgent(ego, opt_dict={'shared_global_planner': True, 'use_world_state': True}, map_inst=world_map)
+    while True:
+        try:
+            agent.set_destination(random.choice(waypoints).transform.location)
+            break
+        except nx.NetworkXNoPath:
+            pass
+    return agent, get_world_state(world).filter('*vehicle*')
+
+
+def time_detection(detect, scenes, max_distance, repetitions):
+    """Returns the mean time of a detection, in ms, and its results"""
+    results = []
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        results = [detect(agent, actors, max_distance) for agent, actors in scenes]
+    elapsed = time.perf_counter() - start
+    return elapsed / (repetitions * len(scenes)) * 1000, results
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--xodr',
+        metavar='FILE',
+        help='Build the map from this OpenDRIVE file instead of connecting to the simulator')
+    argparser.add_argument(
+        '-n', '--number-of-actors',
+        metavar='N',
+        default=[50, 200, 1000],
+        nargs='+',
+        type=int,
+        help='Numbers of vehicles of the scenes (default: 50 200 1000)')
+    argparser.add_argument(
+        '--scenes',
+        metavar='S',
+        default=20,
+        type=int,
+        help='Number of random scenes per number of vehicles (default: 20)')
+    argparser.add_argument(
+        '--max-distance',
+        metavar='D',
+        default=30.0,
+        type=float,
+        help='Maximum detection distance (default: 30.0)')
+    argparser.add_argument(
+        '--repetitions',
+        metavar='R',
+        default=3,
+        type=int,
+        help='Repetitions of the detections of each scene (default: 3)')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the scenes (default: 0)')
+
+    args = argparser.parse_args()
+
+    world_map = get_map(args)
+    waypoints = world_map.generate_waypoints(2.0)
+
+    def batched(agent, actors, max_distance):
+        return agent._vehicle_obstacle_detected(actors, max_distance)
+
+    print('%8s %6s %16s %14s %8s %10s %10s' % (
+        'vehicles', 'bbs', 'reference [ms]', 'batched [ms]', 'speedup', 'detections', 'mismatches'))
+    for number_of_actors in args.number_of_actors:
+        scenes = [create_scene(world_map, waypoints, number_of_actors, args.seed + i)
+                  for i in range(args.scenes)]
+        for use_bbs in (False, True):
+            for agent, _ in scenes:
+                agent._use_bbs_detection = use_bbs
+
+            reference_time, reference = time_detection(
+                reference_obstacle_detected, scenes, args.max_distance, args.repetitions)
+            batched_time, results = time_detection(batched, scenes, args.max_distance, args.repetitions)
+
+            mismatches = sum(1 for r, b in zip(reference, results) if r[0] != b[0] or r[1] is not b[1])
+            detections = sum(1 for r in reference if r[0])
+            print('%8d %6s %16.3f %14.3f %7.1fx %10d %10d' % (
+                number_of_actors, use_bbs, reference_time, batched_time, reference_time / batched_time,
+                detections, mismatches))
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
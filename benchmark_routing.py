@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Benchmark of the GlobalRoutePlanner query latency. Compares the networkx A* search used
+by default against the array based A* search and the landmark (ALT) search.
+
+The map is taken from a running simulator or, with --xodr, built locally from an OpenDRIVE file.
+"""
+
+import glob
+import os
+import sys
+import time
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+
+import argparse
+import random
+import numpy as np
+import networkx as nx
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.tools.opendrive import load_opendrive_map
+
+
+def get_map(args):
+    if args.xodr:
+        return load_opendrive_map(args.xodr)
+
+    client = carla.Client(args.host, args.port)
+    client.set_timeout(10.0)
+    return client.get_world().get_map()
+
+
+def time_queries(search, queries):
+    latencies = []
+    for source, target in queries:
+        start = time.perf_counter()
+        try:
+            search(source, target)
+        except nx.NetworkXNoPath:
+            pass
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '--host',
+        metavar='H',
+        default='127.0.0.1',
+        help='IP of the host server (default: 127.0.0.1)')
+    argparser.add_argument(
+        '-p', '--port',
+        metavar='P',
+        default=2000,
+        type=int,
+        help='TCP port to listen to (default: 2000)')
+    argparser.add_argument(
+        '--xodr',
+        metavar='FILE',
+        help='Build the map from this OpenDRIVE file instead of connecting to the simulator')
+    argparser.add_argument(
+        '-n', '--number-of-queries',
+        metavar='N',
+        default=1000,
+        type=int,
+        help='Number of random route queries (default: 1000)')
+    argparser.add_argument(
+        '-r', '--sampling-resolution',
+        metavar='R',
+        default=2.0,
+        type=float,
+        help='Sampling resolution of the route planner (default: 2.0)')
+    argparser.add_argument(
+        '-l', '--landmarks',
+        metavar='L',
+        default=8,
+        type=int,
+        help='Number of landmarks of the ALT search (default: 8)')
+    argparser.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        help='Directory where the graph and the landmarks are cached')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the queries (default: 0)')
+
+    args = argparser.parse_args()
+
+    world_map = get_map(args)
+
+    opt_dict = {'routing_engine': 'alt', 'num_landmarks': args.landmarks}
+    if args.cache_dir:
+        opt_dict['graph_cache_dir'] = args.cache_dir
+
+    start = time.perf_counter()
+    grp = GlobalRoutePlanner(world_map, args.sampling_resolution, opt_dict)
+    print('Route planner ready in %.2f s (graph and landmark preprocessing)' % (time.perf_counter() - start))
+
+    graph = grp._graph
+    compact_graph = grp._compact_graph
+    print('Graph: %d nodes, %d edges, %d landmarks' % (
+        graph.number_of_nodes(), graph.number_of_edges(), len(compact_graph.landmarks)))
+
+    # Random queries between the nodes of the graph
+    random.seed(args.seed)
+    nodes = list(compact_graph.node_ids)
+    queries = [(random.choice(nodes), random.choice(nodes)) for _ in range(args.number_of_queries)]
+
+    def networkx_astar(source, target):
+        return nx.astar_path(graph, source, target, heuristic=grp._distance_heuristic, weight='length')
+
+    results = [
+        ('networkx astar_path', time_queries(networkx_astar, queries)),
+        ('CSR A*', time_queries(compact_graph.astar, queries)),
+        ('ALT', time_queries(compact_graph.alt, queries)),
+    ]
+
+    print('\n%-20s %10s %10s %10s %10s' % ('search', 'mean [ms]', 'p50 [ms]', 'p95 [ms]', 'speedup'))
+    reference = np.mean(results[0][1])
+    for name, latencies in results:
+        print('%-20s %10.3f %10.3f %10.3f %9.1fx' % (
+            name, np.mean(latencies), np.percentile(latencies, 50),
+            np.percentile(latencies, 95), reference / np.mean(latencies)))
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Runs all the checks of the agents that don't need a simulator, with their default arguments:
+the route planner on the sample maps (check_opendrive_maps.py) and the array based structures
+against brute force versions of the searches they replace (check_spatial_index.py,
+check_waypoint_queue.py and check_compact_graph.py). Fails if any of them fails.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+CHECKS = [
+    'check_opendrive_maps.py',
+    'check_spatial_index.py',
+    'check_waypoint_queue.py',
+    'check_compact_graph.py',
+]
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'checks',
+        metavar='CHECK',
+        nargs='*',
+        help='Checks to run (default: all of them)')
+
+    args = argparser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    failed = []
+    for check in args.checks or CHECKS:
+        print('== %s' % check)
+        sys.stdout.flush()
+        start = time.time()
+        result = subprocess.run([sys.executable, os.path.join(root, check)], cwd=root)
+        print('== %s %s (%.1f s)\n' % (check, 'OK' if result.returncode == 0 else 'FAILED', time.time() - start))
+        if result.returncode != 0:
+            failed.append(check)
+
+    if failed:
+        print('%d of %d checks failed: %s' % (len(failed), len(args.checks or CHECKS), ', '.join(failed)))
+        sys.exit(1)
+    print('All checks passed')
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
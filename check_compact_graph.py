@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Checks the CompactGraph of the GlobalRoutePlanner against the networkx searches it replaces.
+On random pairs of nodes, with and without random cost multipliers, it compares:
+
+    - astar with networkx.astar_path and the euclidean heuristic, which must return the same path
+    - alt and search_backward with the networkx Dijkstra distances, which they must reach
+    - the first path of alternatives with astar, and the landmark tables with Dijkstra
+
+The graphs are the ones of the route planner on OpenDRIVE maps, built locally, by default
+the sample maps of the 'sample_maps' folder, and random graphs.
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import argparse
+import math
+import random
+import networkx as nx
+import numpy as np
+
+from agents.navigation.compact_graph import CompactGraph
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.tools.opendrive import load_opendrive_map
+
+SAMPLE_MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_maps')
+
+
+def random_graph(number_of_nodes, rng):
+    """Returns a random networkx.DiGraph, with each node linked to some of its closest ones"""
+    graph = nx.DiGraph()
+    vertices = [(rng.uniform(0, 1000), rng.uniform(0, 1000), 0.0) for _ in range(number_of_nodes)]
+    for node, vertex in enumerate(vertices):
+        graph.add_node(node, vertex=vertex)
+    for node, vertex in enumerate(vertices):
+        closest = sorted(range(number_of_nodes), key=lambda other: math.dist(vertex, vertices[other]))[1:5]
+        for other in rng.sample(closest, rng.randint(1, len(closest))):
+            # Lengths representable in single precision, as the ones stored by the CompactGraph
+            length = round(math.dist(vertex, vertices[other]) * rng.uniform(1.0, 1.3) * 8) / 8
+            graph.add_edge(node, other, length=length)
+    return graph
+
+
+def path_cost(graph, path, weight):
+    """Returns the cost of a path, or None if it isn't a path of the graph"""
+    if any(not graph.has_edge(n1, n2) for n1, n2 in zip(path[:-1], path[1:])):
+        return None
+    return sum(weight(n1, n2, graph.edges[n1, n2]) for n1, n2 in zip(path[:-1], path[1:]))
+
+
+def check_graph(name, graph, pairs, rng):
+    """Asserts that the searches of the CompactGraph of a graph give the same results as networkx"""
+    compact = CompactGraph(graph)
+    edges = list(graph.edges)
+    vertices = {node: tuple(float(v) for v in graph.nodes[node]['vertex']) for node in graph.nodes}
+
+    def heuristic(n1, n2):
+        # Same operations as the CompactGraph, so that both break the ties between nodes the same way
+        (x, y, z), (tx, ty, tz) = vertices[n1], vertices[n2]
+        return math.sqrt((x - tx) * (x - tx) + (y - ty) * (y - ty) + (z - tz) * (z - tz))
+
+    for with_multipliers in (False, True):
+        case = '%s%s' % (name, ', with multipliers' if with_multipliers else '')
+        compact.reset_cost_multipliers()
+        multipliers = {}
+        if with_multipliers:
+            changed = rng.sample(edges, len(edges) // 4)
+            values = [rng.choice([1.0, 1.5, 3.0, 10.0]) for _ in changed]
+            compact.set_cost_multipliers([compact.edge_index(n1, n2) for n1, n2 in changed], values)
+            multipliers = dict(zip(changed, values))
+
+        def weight(n1, n2, data):
+            # The CompactGraph multiplies the costs in single precision
+            return float(np.float32(data.get('length', 1)) * np.float32(multipliers.get((n1, n2), 1.0)))
+
+        compact.build_landmarks(4)
+        for landmark, from_landmark, to_landmark in zip(*compact.get_landmarks()):
+            expected_from = nx.single_source_dijkstra_path_length(graph, landmark, weight='length')
+            expected_to = nx.single_source_dijkstra_path_length(graph.reverse(copy=False), landmark, weight='length')
+            for node, i in compact._node_index.items():
+                assert math.isclose(from_landmark[i], expected_from.get(node, math.inf), rel_tol=1e-5), \
+                    '%s: distance from the landmark %s to %s' % (case, landmark, node)
+                assert math.isclose(to_landmark[i], expected_to.get(node, math.inf), rel_tol=1e-5), \
+                    '%s: distance from %s to the landmark %s' % (case, node, landmark)
+
+        for source, target in pairs:
+            try:
+                expected = nx.astar_path(graph, source, target, heuristic=heuristic, weight=weight)
+                shortest = nx.dijkstra_path_length(graph, source, target, weight=weight)
+            except nx.NetworkXNoPath:
+                expected, shortest = None, None
+
+            results = {}
+            for search, run in (('astar', lambda: compact.astar(source, target)),
+                                ('alt', lambda: compact.alt(source, target)),
+                                ('alternatives', lambda: compact.alternatives(source, target, 3)[0]),
+                                ('search_backward', lambda: compact.search_backward(target, {source}))):
+                try:
+                    results[search] = run()
+                except nx.NetworkXNoPath:
+                    results[search] = None
+
+            pair = '%s: %%s from %s to %s' % (case, source, target)
+            assert results['astar'] == expected, pair % 'astar'
+            assert results['alternatives'] == results['astar'], pair % 'first alternative'
+            for search in ('alt', 'search_backward'):
+                path = results[search]
+                assert (path is None) == (shortest is None), pair % search
+                if path is not None:
+                    cost = path_cost(graph, path, weight)
+                    assert path[0] == source and path[-1] == target and cost is not None, pair % search
+                    assert math.isclose(cost, shortest, rel_tol=1e-5, abs_tol=1e-5), pair % search
+
+    print('%-24s %6d nodes %6d edges %6d pairs OK' % (
+        name, graph.number_of_nodes(), graph.number_of_edges(), len(pairs)))
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'maps',
+        metavar='FILE',
+        nargs='*',
+        help='OpenDRIVE files whose planner graphs are checked (default: the sample maps)')
+    argparser.add_argument(
+        '-n', '--number-of-pairs',
+        metavar='N',
+        default=200,
+        type=int,
+        help='Number of random pairs of nodes searched on each graph (default: 200)')
+    argparser.add_argument(
+        '--random-graphs',
+        metavar='G',
+        default=[50, 300],
+        nargs='*',
+        type=int,
+        help='Numbers of nodes of the random graphs (default: 50 300)')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the graphs and pairs (default: 0)')
+
+    args = argparser.parse_args()
+
+    rng = random.Random(args.seed)
+    graphs = []
+    for filename in args.maps or sorted(glob.glob(os.path.join(SAMPLE_MAPS_DIR, '*.xodr'))):
+        planner = GlobalRoutePlanner(load_opendrive_map(filename), 2.0)
+        graphs.append((os.path.splitext(os.path.basename(filename))[0], planner._graph))
+    for number_of_nodes in args.random_graphs:
+        graphs.append(('random %d' % number_of_nodes, random_graph(number_of_nodes, rng)))
+
+    for name, graph in graphs:
+        nodes = list(graph.nodes)
+        pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(args.number_of_pairs)]
+        check_graph(name, graph, pairs, rng)
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except AssertionError as error:
+        print('FAILED: {}'.format(error))
+        sys.exit(1)
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Builds the GlobalRoutePlanner of OpenDRIVE maps without a simulator, and checks the
+resulting graph and routes. By default, the sample maps of the 'sample_maps' folder are used.
+
+With --cache-dir, the planner caches are stored in that folder, so that they are ready
+when the same maps are loaded from a simulator (see --name).
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import argparse
+import random
+import networkx as nx
+
+from agents.navigation.global_route_planner import GlobalRoutePlanner
+from agents.navigation.local_planner import RoadOption
+from agents.tools.opendrive import load_opendrive_map
+
+SAMPLE_MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_maps')
+
+
+def graph_signature(grp):
+    """Returns the nodes and edges of the planner graph, in a comparable form"""
+    graph = grp._graph
+    nodes = sorted(tuple(round(v, 2) for v in graph.nodes[n]['vertex']) for n in graph.nodes)
+    edges = sorted(
+        (tuple(round(v, 2) for v in graph.nodes[n1]['vertex']),
+         tuple(round(v, 2) for v in graph.nodes[n2]['vertex']),
+         int(data['type']), data['length'])
+        for n1, n2, data in graph.edges(data=True))
+    return nodes, edges
+
+
+def lane_signature(grp):
+    """Returns the (road_id, section_id, lane_id) of the waypoints of the planner topology and graph"""
+    def lanes(waypoints):
+        return [(wp.road_id, wp.section_id, wp.lane_id) for wp in waypoints]
+
+    topology = [lanes([segment['entry'], segment['exit']] + list(segment['path'])) for segment in grp._topology]
+    edges = sorted(
+        (n1, n2, lanes([data[key] for key in ('entry_waypoint', 'exit_waypoint', 'change_waypoint') if key in data]
+                       + list(data['path'])))
+        for n1, n2, data in grp._graph.edges(data=True))
+    return topology, edges
+
+
+def vector_signature(grp):
+    """Returns the type and the value of the direction vectors of the planner graph edges"""
+    def signature(value):
+        if value is None:
+            return None
+        return type(value).__name__, tuple(round(float(v), 6) for v in value)
+
+    return sorted(
+        (n1, n2, tuple(signature(data.get(key)) for key in ('entry_vector', 'exit_vector', 'net_vector')))
+        for n1, n2, data in grp._graph.edges(data=True))
+
+
+def route_signature(route):
+    """Returns the OpenDRIVE identifiers of the waypoints of a route"""
+    return [(wp.road_id, wp.section_id, wp.lane_id, round(wp.s, 3), int(option)) for wp, option in route]
+
+
+def check_graph(grp, sampling_resolution):
+    """Returns the list of problems found in the planner graph"""
+    errors = []
+    graph = grp._graph
+    if graph.number_of_nodes() == 0 or graph.number_of_edges() == 0:
+        errors.append('the graph is empty')
+
+    for segment in grp._topology:
+        if grp._localize(segment['entry'].transform.location) is None:
+            errors.append('road {} lane {} is not part of the graph'.format(
+                segment['entry'].road_id, segment['entry'].lane_id))
+
+    for n1, n2, data in graph.edges(data=True):
+        if data['type'] != RoadOption.LANEFOLLOW:
+            continue
+        path = [data['entry_waypoint']] + list(data['path']) + [data['exit_waypoint']]
+        for wp1, wp2 in zip(path[:-1], path[1:]):
+            if wp1.transform.location.distance(wp2.transform.location) > 2 * sampling_resolution + 0.01:
+                errors.append('the path of the edge {} -> {} has gaps'.format(n1, n2))
+                break
+    return errors
+
+
+def check_lane_index(grp, world_map, args):
+    """
+    Returns the problems of the lane index of the planner, which has to localize locations on the same
+    lanes as the map, at the joints between lanes, where they are tied between them, and along the lanes
+    """
+    lane_index = grp.get_lane_index()
+    locations = []
+    for segment in grp._topology:
+        locations.extend([segment['entry'].transform.location, segment['exit'].transform.location])
+    locations.extend(wp.transform.location for wp in world_map.generate_waypoints(args.sampling_resolution))
+
+    mismatches = 0
+    for location in locations:
+        expected = world_map.get_waypoint(location)
+        waypoint = lane_index.get_waypoint(location)
+        if waypoint is None or (waypoint.road_id, waypoint.section_id, waypoint.lane_id) != \
+                (expected.road_id, expected.section_id, expected.lane_id):
+            mismatches += 1
+
+    if mismatches:
+        return ['the lane index localizes {} of {} locations on other lanes than the map'.format(
+            mismatches, len(locations))]
+    return []
+
+
+def check_routes(grp, world_map, args):
+    """Traces random routes, returning their signatures, the number of unreachable pairs and the problems found"""
+    errors = []
+    signatures = []
+    no_path = 0
+
+    # Lanes without successors aren't part of the topology, so they can't be routed
+    random.seed(args.seed)
+    waypoints = [wp for wp in world_map.generate_waypoints(args.sampling_resolution)
+                 if grp._localize(wp.transform.location) is not None]
+    for _ in range(args.number_of_routes):
+        origin = random.choice(waypoints).transform.location
+        destination_waypoint = random.choice(waypoints)
+        destination = destination_waypoint.transform.location
+        try:
+            route = grp.trace_route(origin, destination)
+        except nx.NetworkXNoPath:
+            no_path += 1
+            signatures.append(None)
+            continue
+
+        # Routes end on the lane of the destination, or next to it when it is at the end of a lane
+        if not route:
+            errors.append('empty route from {} to {}'.format(origin, destination))
+        elif (route[-1][0].road_id, route[-1][0].lane_id) != (destination_waypoint.road_id, destination_waypoint.lane_id) \
+                and route[-1][0].transform.location.distance(destination) > 2 * args.sampling_resolution:
+            errors.append('the route from {} to {} doesn\'t reach its destination'.format(origin, destination))
+        signatures.append(route_signature(route))
+
+    return signatures, no_path, errors
+
+
+def check_map(filename, args):
+    """Runs all the checks of a map, returning the list of problems found"""
+    world_map = load_opendrive_map(filename, args.name)
+    opt_dict = {'routing_engine': args.routing_engine}
+    if args.cache_dir:
+        opt_dict['graph_cache_dir'] = args.cache_dir
+
+    grp = GlobalRoutePlanner(world_map, args.sampling_resolution, opt_dict)
+    errors = check_graph(grp, args.sampling_resolution)
+
+    # The map written back to OpenDRIVE has to give the same graph
+    copy_map = load_opendrive_map(world_map.to_opendrive(), world_map.name)
+    copy_grp = GlobalRoutePlanner(copy_map, args.sampling_resolution, {'routing_engine': args.routing_engine})
+    if graph_signature(grp) != graph_signature(copy_grp):
+        errors.append('the graph changes when the map is exported to OpenDRIVE')
+
+    signatures, no_path, route_errors = check_routes(grp, world_map, args)
+    errors.extend(route_errors)
+
+    # The routes localized with the lane index have to be the ones localized with the map
+    index_grp = GlobalRoutePlanner(
+        world_map, args.sampling_resolution, {'routing_engine': args.routing_engine, 'use_lane_index': True})
+    errors.extend(check_lane_index(index_grp, world_map, args))
+    if check_routes(index_grp, world_map, args)[0] != signatures:
+        errors.append('the routes localized with the lane index differ from the ones localized with the map')
+
+    # And so does the cached graph, if any, compared with the copy that is always built
+    if args.cache_dir:
+        cached_grp = GlobalRoutePlanner(world_map, args.sampling_resolution, opt_dict)
+        if graph_signature(copy_grp) != graph_signature(cached_grp):
+            errors.append('the cached graph differs from the built one')
+        elif lane_signature(copy_grp) != lane_signature(cached_grp):
+            errors.append('the waypoints of the cached graph are on other lanes than the ones of the built one')
+        elif vector_signature(copy_grp) != vector_signature(cached_grp):
+            errors.append('the direction vectors of the cached graph differ from the ones of the built one')
+        elif check_routes(cached_grp, world_map, args)[0] != signatures:
+            errors.append('the routes of the cached graph differ from the ones of the built one')
+
+    print('%-30s %6d nodes %6d edges %5d routes (%d unreachable) %s' % (
+        world_map.name, grp._graph.number_of_nodes(), grp._graph.number_of_edges(),
+        args.number_of_routes, no_path, 'OK' if not errors else 'FAILED'))
+    for error in errors:
+        print('    ' + error)
+    return errors
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        'maps',
+        metavar='FILE',
+        nargs='*',
+        help='OpenDRIVE files to check (default: the sample maps)')
+    argparser.add_argument(
+        '--name',
+        metavar='NAME',
+        help='Name given to the map, such as Carla/Maps/Town10HD_Opt (default: the file name)')
+    argparser.add_argument(
+        '-r', '--sampling-resolution',
+        metavar='R',
+        default=2.0,
+        type=float,
+        help='Sampling resolution of the route planner (default: 2.0)')
+    argparser.add_argument(
+        '-n', '--number-of-routes',
+        metavar='N',
+        default=100,
+        type=int,
+        help='Number of random routes traced on each map (default: 100)')
+    argparser.add_argument(
+        '--routing-engine',
+        metavar='E',
+        default='networkx',
+        choices=['networkx', 'compact', 'alt'],
+        help='Routing engine of the route planner (default: networkx)')
+    argparser.add_argument(
+        '--cache-dir',
+        metavar='DIR',
+        help='Directory where the route planner caches are stored')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the routes (default: 0)')
+
+    args = argparser.parse_args()
+
+    maps = args.maps or sorted(glob.glob(os.path.join(SAMPLE_MAPS_DIR, '*.xodr')))
+    if not maps:
+        print('No OpenDRIVE maps found')
+        sys.exit(1)
+
+    failed = 0
+    for filename in maps:
+        if check_map(filename, args):
+            failed += 1
+
+    if failed:
+        print('%d of %d maps failed' % (failed, len(maps)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
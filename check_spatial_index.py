@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Checks the SpatialIndex of the WorldState against a brute force search over all the points.
+The radius and nearest neighbor queries are compared on random points, with the uniform grid,
+with the KD-tree used by the queries that cover most of the grid and, if scipy is installed,
+also without it, and with the few points that are simply all checked.
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+
+import argparse
+import numpy as np
+
+from agents.tools import spatial_index
+from agents.tools.spatial_index import SpatialIndex
+
+
+def brute_force_radius(points, point, radius, mask):
+    """Returns the rows of the points closer than the radius to a point, checking all of them"""
+    distances = np.linalg.norm(points - point, axis=1)
+    selected = distances < radius
+    if mask is not None:
+        selected &= mask
+    return np.flatnonzero(selected)
+
+
+def brute_force_nearest(points, point, count, mask, max_distance):
+    """Returns the distances of the points closest to a point, checking all of them"""
+    distances = np.linalg.norm(points - point, axis=1)
+    if mask is not None:
+        distances = distances[mask]
+    if max_distance is not None:
+        distances = distances[distances < max_distance]
+    return np.sort(distances)[:count]
+
+
+def check_index(name, points, queries, rng, **kwargs):
+    """Asserts that the queries of a SpatialIndex give the same results as the brute force ones"""
+    index = SpatialIndex(points, **kwargs)
+    case = '%s, %d points' % (name, len(points))
+    for point in queries:
+        location = carla.Location(*point.tolist())
+        mask = rng.random(len(points)) < 0.5 if rng.random() < 0.5 else None
+        radius = float(rng.choice([1.0, 10.0, 50.0, 500.0, 5000.0]))
+        rows = index.query_radius(location, radius, mask)
+        assert np.array_equal(rows, brute_force_radius(points, point, radius, mask)), \
+            '%s: points within %g of %s' % (case, radius, point.tolist())
+
+        count = int(rng.integers(1, 20))
+        max_distance = float(rng.choice([5.0, 50.0, 500.0])) if rng.random() < 0.5 else None
+        rows, distances = index.query_nearest(location, count, mask, max_distance)
+        expected = brute_force_nearest(points, point, count, mask, max_distance)
+        assert len(distances) == len(expected) and np.allclose(distances, expected) and \
+            np.allclose(np.linalg.norm(points[rows] - point, axis=1), distances), \
+            '%s: %d nearest points of %s' % (case, count, point.tolist())
+
+    print('%-24s %8d points %6d queries OK' % (name, len(points), len(queries)))
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '-n', '--number-of-points',
+        metavar='N',
+        default=[0, 1, 50, 1000, 20000],
+        nargs='+',
+        type=int,
+        help='Numbers of points of the indexes (default: 0 1 50 1000 20000)')
+    argparser.add_argument(
+        '-q', '--queries',
+        metavar='Q',
+        default=500,
+        type=int,
+        help='Number of queries of each index (default: 500)')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the points and queries (default: 0)')
+
+    args = argparser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for number_of_points in args.number_of_points:
+        # Clustered points, as the actors of a map, with some of them far away from the rest
+        centers = rng.uniform(-1000, 1000, (max(number_of_points // 100, 1), 3)) * (1, 1, 0.01)
+        points = centers[rng.integers(0, len(centers), number_of_points)] + rng.normal(0, 30, (number_of_points, 3))
+        if number_of_points:
+            points[rng.integers(0, number_of_points, max(number_of_points // 200, 1))] *= 10
+        # Half of the queries next to the points, and the rest anywhere around them
+        queries = rng.uniform(-3000, 3000, (args.queries, 3))
+        if number_of_points:
+            near = rng.integers(0, number_of_points, args.queries // 2)
+            queries[:len(near)] = points[near] + rng.normal(0, 5, (len(near), 3))
+        # The carla.Location of the queries is in single precision
+        queries = queries.astype(np.float32).astype(float)
+
+        check_index('grid', points, queries, rng, min_grid_size=1)
+        check_index('grid, large cells', points, queries, rng, cell_size=500.0, min_grid_size=1)
+        check_index('all points', points, queries, rng, min_grid_size=len(points) + 1)
+        if spatial_index.cKDTree is not None:
+            kdtree = spatial_index.cKDTree
+            spatial_index.cKDTree = None
+            try:
+                check_index('grid, without scipy', points, queries, rng, min_grid_size=1)
+            finally:
+                spatial_index.cKDTree = kdtree
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except AssertionError as error:
+        print('FAILED: {}'.format(error))
+        sys.exit(1)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# This work is licensed under the terms of the MIT license.
+# For a copy, see <https://opensource.org/licenses/MIT>.
+
+"""
+Checks the WaypointQueue of the LocalPlanner against a plain list of (carla.Waypoint, RoadOption)
+pairs. Random sequences of additions and removals, which wrap around and grow the ring buffer,
+are applied to both, and after each one the queries of the WaypointQueue are compared with
+the loops over the list that they replace: the pairs, the arc lengths, the right vectors, the
+reached waypoints, the waypoints within a distance and the projection onto the polyline.
+
+The waypoints are taken from an OpenDRIVE map, built locally. By default, a sample map is used.
+"""
+
+import glob
+import os
+import sys
+
+try:
+    sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
+        sys.version_info.major,
+        sys.version_info.minor,
+        'win-amd64' if os.name == 'nt' else 'linux-x86_64'))[0])
+except IndexError:
+    pass
+
+import carla
+
+import argparse
+import random
+import numpy as np
+
+from agents.navigation.local_planner import WaypointQueue, RoadOption
+from agents.tools.opendrive import load_opendrive_map
+
+SAMPLE_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sample_maps', 'Grid3x3.xodr')
+
+
+class ReferenceQueue(object):
+    """List of (carla.Waypoint, RoadOption) pairs, with the arc length of each waypoint along them"""
+
+    def __init__(self, history_length):
+        self.pairs = []
+        self.s = []
+        self.history = []
+        self.history_length = history_length
+
+    def extend(self, pairs):
+        for wp, option in pairs:
+            location = wp.transform.location
+            if self.pairs:
+                s = self.s[-1] + location.distance(self.pairs[-1][0].transform.location)
+            elif self.history:
+                s = self.history[-1][1] + location.distance(self.history[-1][0])
+            else:
+                s = 0.0
+            self.pairs.append((wp, option))
+            self.s.append(s)
+
+    def popleft(self, count):
+        removed = [(wp.transform.location, s) for (wp, _), s in zip(self.pairs[:count], self.s[:count])]
+        self.history = (self.history + removed)[-self.history_length:]
+        self.pairs, self.s = self.pairs[count:], self.s[count:]
+
+    def pop(self, count):
+        if count:
+            self.pairs, self.s = self.pairs[:-count], self.s[:-count]
+
+    def clear(self):
+        self.pairs, self.s, self.history = [], [], []
+
+    def num_reached(self, location, min_distance, last_min_distance):
+        """Loop of LocalPlanner.run_step over the waypoints reached by the vehicle"""
+        num_waypoint_removed = 0
+        for waypoint, _ in self.pairs:
+            if len(self.pairs) - num_waypoint_removed == 1:
+                distance = last_min_distance
+            else:
+                distance = min_distance
+            if location.distance(waypoint.transform.location) < distance:
+                num_waypoint_removed += 1
+            else:
+                break
+        return num_waypoint_removed
+
+    def num_within(self, location, max_distance):
+        """Loop of the route polygon of BasicAgent._vehicle_obstacle_detected"""
+        num_waypoints = 0
+        for waypoint, _ in self.pairs:
+            if location.distance(waypoint.transform.location) > max_distance:
+                break
+            num_waypoints += 1
+        return num_waypoints
+
+    def project(self, location):
+        """Projection onto the polyline of the history and the waypoints, extended backwards from its start"""
+        points = [(loc.x, loc.y, loc.z) for loc, _ in self.history]
+        points += [(wp.transform.location.x, wp.transform.location.y, wp.transform.location.z) for wp, _ in self.pairs]
+        arc_lengths = [s for _, s in self.history] + self.s
+        point = np.array([location.x, location.y, location.z])
+        if len(points) == 1:
+            return arc_lengths[0], float(np.linalg.norm(point - points[0]))
+
+        best = None
+        for i in range(len(points) - 1):
+            start, vector = np.array(points[i]), np.subtract(points[i + 1], points[i])
+            squared_length = float(np.dot(vector, vector))
+            ratio = float(np.dot(point - start, vector)) / squared_length if squared_length > 0 else 0.0
+            ratio = min(ratio, 1.0) if i == 0 else min(max(ratio, 0.0), 1.0)
+            offset = point - (start + ratio * vector)
+            distance = float(np.linalg.norm(offset))
+            if best is None or distance < best[1]:
+                side = 1.0 if vector[0] * offset[1] - vector[1] * offset[0] >= 0 else -1.0
+                best = (arc_lengths[i] + ratio * np.sqrt(squared_length), distance, side)
+        return best[0], best[2] * best[1]
+
+
+def random_route(wmap_waypoints, length, sampling_radius):
+    """Returns a list of (carla.Waypoint, RoadOption) pairs following the lanes from a random waypoint"""
+    wp = random.choice(wmap_waypoints)
+    pairs = []
+    for _ in range(length):
+        pairs.append((wp, random.choice([RoadOption.LANEFOLLOW, RoadOption.LEFT, RoadOption.RIGHT])))
+        next_waypoints = wp.next(sampling_radius)
+        if not next_waypoints:
+            break
+        wp = random.choice(next_waypoints)
+    return pairs
+
+
+def compare(queue, reference, wmap_waypoints, operation):
+    """Asserts that the queries of the queue give the same results as the reference"""
+    case = 'after operation %d' % operation
+    assert len(queue) == len(reference.pairs), 'length %d != %d %s' % (len(queue), len(reference.pairs), case)
+    assert all(a[0] is b[0] and a[1] == b[1] for a, b in zip(queue, reference.pairs)), 'pairs ' + case
+    if reference.pairs:
+        assert queue[-1][0] is reference.pairs[-1][0] and queue[0][0] is reference.pairs[0][0], 'indexing ' + case
+    arc_lengths = [queue.get_s(i) for i in range(len(queue))]
+    assert np.allclose(arc_lengths, reference.s), 'arc lengths ' + case
+
+    for s in random.sample(reference.s, min(5, len(reference.s))) + [random.uniform(-10, 500)]:
+        assert queue.bisect(s) == sum(1 for value in arc_lengths if value < s), 'bisect of %g %s' % (s, case)
+
+    count = random.randint(0, len(reference.pairs) + 2)
+    locations, right_vectors = queue.get_right_vectors(count)
+    expected = [(wp.transform.get_right_vector().x, wp.transform.get_right_vector().y) for wp, _ in reference.pairs[:count]]
+    assert len(right_vectors) == len(expected) and (not expected or np.allclose(right_vectors, expected)), \
+        'right vectors ' + case
+    expected = [(wp.transform.location.x, wp.transform.location.y, wp.transform.location.z)
+                for wp, _ in reference.pairs[:count]]
+    assert len(locations) == len(expected) and (not expected or np.allclose(locations, expected)), \
+        'locations ' + case
+
+    if reference.pairs:
+        # Locations next to the start of the queue, where the vehicle usually is, and elsewhere
+        base = random.choice(reference.pairs[:3])[0].transform.location
+        for location in (carla.Location(base.x + random.uniform(-3, 3), base.y + random.uniform(-3, 3), base.z),
+                         random.choice(wmap_waypoints).transform.location):
+            min_distance = random.choice([0.5, 2.0, 4.5, 20.0])
+            assert queue.num_reached(location, min_distance, 1.0) == \
+                reference.num_reached(location, min_distance, 1.0), 'reached waypoints ' + case
+            max_distance = random.choice([0.5, 5.0, 30.0, 200.0])
+            assert queue.num_within(location, max_distance) == reference.num_within(location, max_distance), \
+                'waypoints within a distance ' + case
+            assert np.allclose(queue.project(location), reference.project(location), atol=1e-6), \
+                'projection ' + case
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description=__doc__)
+    argparser.add_argument(
+        '--xodr',
+        metavar='FILE',
+        default=SAMPLE_MAP,
+        help='OpenDRIVE file of the waypoints (default: the Grid3x3 sample map)')
+    argparser.add_argument(
+        '-n', '--number-of-operations',
+        metavar='N',
+        default=2000,
+        type=int,
+        help='Number of random additions and removals (default: 2000)')
+    argparser.add_argument(
+        '-s', '--seed',
+        metavar='S',
+        default=0,
+        type=int,
+        help='Random seed of the operations (default: 0)')
+
+    args = argparser.parse_args()
+
+    random.seed(args.seed)
+    wmap_waypoints = load_opendrive_map(args.xodr).generate_waypoints(2.0)
+
+    # A small buffer and history, so that the queue wraps around and grows often
+    queue = WaypointQueue(capacity=4, history_length=8)
+    reference = ReferenceQueue(history_length=8)
+
+    max_length = 0
+    for operation in range(args.number_of_operations):
+        action = random.choices(['extend', 'append', 'popleft', 'pop', 'clear'], [40, 10, 35, 10, 1])[0]
+        if action == 'extend':
+            pairs = random_route(wmap_waypoints, random.randint(1, 40), random.choice([1.0, 2.0, 4.5]))
+            if random.random() < 0.5:
+                locations = np.array([(wp.transform.location.x, wp.transform.location.y, wp.transform.location.z)
+                                      for wp, _ in pairs])
+                queue.extend(pairs, locations)
+            else:
+                queue.extend(pairs)
+            reference.extend(pairs)
+        elif action == 'append':
+            pair = random_route(wmap_waypoints, 1, 2.0)[0]
+            queue.append(pair)
+            reference.extend([pair])
+        elif action == 'popleft':
+            count = random.randint(0, 40)
+            queue.popleft(count)
+            reference.popleft(count)
+        elif action == 'pop':
+            count = random.randint(0, 6)
+            queue.pop(count)
+            reference.pop(count)
+        else:
+            queue.clear()
+            reference.clear()
+
+        max_length = max(max_length, len(queue))
+        compare(queue, reference, wmap_waypoints, operation)
+
+    print('%d operations, up to %d waypoints OK' % (args.number_of_operations, max_length))
+
+
+if __name__ == '__main__':
+
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except AssertionError as error:
+        print('FAILED: {}'.format(error))
+        sys.exit(1)
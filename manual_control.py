@@ -188,6 +188,8 @@ try:
 except ImportError:
     raise RuntimeError('cannot import numpy, make sure numpy package is installed')
 
+from agents.tools.world_state import get_world_state
+
 
 # ==============================================================================
 # -- Global functions ----------------------------------------------------------
@@ -762,7 +764,8 @@ class HUD(object):
         collision = [colhist[x + self.frame - 200] for x in range(0, 200)]
         max_col = max(1.0, max(collision))
         collision = [x / max_col for x in collision]
-        vehicles = world.world.get_actors().filter('vehicle.*')
+        world_state = get_world_state(world.world)
+        vehicle_count = int(np.count_nonzero(world_state.mask('vehicle.*')))
         self._info_text = [
             'Server:  % 16.0f FPS' % self.server_fps,
             'Client:  % 16.0f FPS' % clock.get_fps(),
@@ -803,14 +806,12 @@ class HUD(object):
             'Collision:',
             collision,
             '',
-            'Number of vehicles: % 8d' % len(vehicles)]
-        if len(vehicles) > 1:
+            'Number of vehicles: % 8d' % vehicle_count]
+        if vehicle_count > 1:
             self._info_text += ['Nearby vehicles:']
-            distance = lambda l: math.sqrt((l.x - t.location.x)**2 + (l.y - t.location.y)**2 + (l.z - t.location.z)**2)
-            vehicles = [(distance(x.get_location()), x) for x in vehicles if x.id != world.player.id]
-            for d, vehicle in sorted(vehicles, key=lambda vehicles: vehicles[0]):
-                if d > 200.0:
-                    break
+            for d, vehicle in world_state.nearest('vehicle.*', t.location, max_distance=200.0):
+                if vehicle.id == world.player.id:
+                    continue
                 vehicle_type = get_actor_display_name(vehicle, truncate=22)
                 self._info_text.append('% 4dm %s' % (d, vehicle_type))
 
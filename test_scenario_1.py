@@ -52,13 +52,13 @@ def main():
 
     agent = BehaviorAgent(ego_vehicle, behavior='aggressive')
     agent.ignore_traffic_lights(True)
-    agent.set_destination(second_vehicle.get_location())
+    agent.update_destination(second_vehicle.get_location())
 
     spectator = world.get_spectator()
 
     while True:
-        if agent.done():
-            agent.set_destination(second_vehicle.get_location())
+        # Only the end of the route is searched again as the second vehicle moves
+        agent.update_destination(second_vehicle.get_location())
 
         transform = ego_vehicle.get_transform()
         spectator.set_transform(carla.Transform(transform.location + carla.Location(z=30),carla.Rotation(pitch=-90)))